@@ -1,26 +1,73 @@
 ﻿import os
 import requests
 import time
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from loguru import logger
-from dotenv import load_dotenv
 import json
 
-load_dotenv()
+from agents.email_verifier import normalize_email
+from utils import tracing
+from utils.config import load_env
+from utils.projection import LeadProjector
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP-date), None if unparseable"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
 
 class ApolloAgent:
-    def __init__(self):
+    BULK_LIMIT = 10  # Apollo bulk endpoints accept at most 10 records per request
+    
+    def __init__(self, governor=None, verifier=None, base_url: str = None,
+                 max_retries: int = 3, backoff: float = 1.0, timeout: float = 30,
+                 pool_size: int = 10, projector: LeadProjector = None, alerts=None,
+                 rate_limiter=None):
+        self.governor = governor  # optional BudgetGovernor
+        self.rate_limiter = rate_limiter  # optional limiter shared with other processes; acquire() per request
+        self.alerts = alerts  # optional AlertManager; reports failed Apollo calls
+        self.verifier = verifier  # optional EmailVerifier; without one emails pass unverified
+        self.projector = projector or LeadProjector()
+        load_env()
         self.api_key = os.getenv('APOLLO_API_KEY')
-        self.base_url = "https://api.apollo.io/v1"
+        
+        # APOLLO_BASE_URL points the agent at a stand-in server (testing/fake_apollo.py)
+        root = (base_url or os.getenv('APOLLO_BASE_URL', "https://api.apollo.io")).rstrip("/")
+        self.base_url = f"{root}/v1"
+        self.search_url = f"{root}/api/v1/mixed_people/search"  # Note: /api/v1 not just /v1
+        
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
         self.headers = {
             "Cache-Control": "no-cache",
             "Content-Type": "application/json",
             "X-Api-Key": self.api_key
         }
+        # Pooled keep-alive connections instead of a new TLS handshake per call
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         
     def search_people(self, search_params: Dict, limit: int = 10) -> List[Dict]:
         """Search for 10 people using PARAMS in POST (your working format)"""
-        url = f"https://api.apollo.io/api/v1/mixed_people/search"  # Note: /api/v1 not just /v1
+        url = self.search_url
         
         # Use PARAMS not body (as per your working code)
         params = {
@@ -31,26 +78,38 @@ class ApolloAgent:
             "page": search_params.get("page", 1),
             "per_page": limit
         }
+        # Array filters from ApolloSearchManager (metro cities, titles, seniorities, ...) override the defaults
+        params.update({key: value for key, value in search_params.items() if key.endswith("[]") and value})
+        
+        reservation = self._reserve("search", 1)
+        if reservation is False:
+            return []
         
         try:
             logger.info(f"Searching Apollo for {limit} people")
             # POST with params, empty body
-            response = requests.post(url, headers=self.headers, params=params, json={})
-            response.raise_for_status()
+            response = self._post("mixed_people/search", url, params=params, json={})
             
             data = response.json()
             people = data.get("people", [])
             logger.info(f"Found {len(people)} people")
             
+            self._settle(reservation, 1)
             return people
             
         except Exception as e:
             logger.error(f"Apollo search failed: {e}")
+            self._settle(reservation, 0, error=e)
+            self._alert("search", e)
             return []
     
     def enrich_people_bulk(self, people: List[Dict]) -> List[Dict]:
         """Bulk enrich using BODY with details array (your working format)"""
-        endpoint = f"{self.base_url}/people/bulk_match"
+        if len(people) > self.BULK_LIMIT:
+            return [match for i in range(0, len(people), self.BULK_LIMIT)
+                    for match in self.enrich_people_bulk(people[i:i + self.BULK_LIMIT])]
+        
+        url = f"{self.base_url}/people/bulk_match"
         
         # Build details array exactly like your working code
         details = []
@@ -72,57 +131,137 @@ class ApolloAgent:
             "reveal_phone_number": "false"
         }
         
+        # Reserve for every person; only matches are charged
+        reservation = self._reserve("enrich_person", len(details))
+        if reservation is False:
+            return []
+        
         try:
             logger.info(f"Enriching {len(details)} people")
             # POST with body AND params
-            response = requests.post(endpoint, headers=self.headers, json=payload, params=params)
-            response.raise_for_status()
+            response = self._post("people/bulk_match", url, json=payload, params=params)
             
             data = response.json()
-            matches = data.get("matches", [])
+            matches = [m for m in data.get("matches", []) if m]
             logger.info(f"Enriched {len(matches)} people successfully")
             
+            self._settle(reservation, len(matches))
             return matches
             
         except Exception as e:
             logger.error(f"Person enrichment failed: {e}")
+            self._settle(reservation, 0, error=e)
+            self._alert("enrich_person", e)
             return []
     
     def enrich_organizations(self, domains: List[str]) -> List[Dict]:
         """Bulk enrich orgs using domains[] param format (your working format)"""
-        endpoint = f"{self.base_url}/organizations/bulk_enrich"
+        if len(domains) > self.BULK_LIMIT:
+            return [org for i in range(0, len(domains), self.BULK_LIMIT)
+                    for org in self.enrich_organizations(domains[i:i + self.BULK_LIMIT])]
+        
+        url = f"{self.base_url}/organizations/bulk_enrich"
         
         # Build params with domains[] format exactly like your code
         params = [("domains[]", domain) for domain in domains]
         
+        reservation = self._reserve("enrich_org", len(domains))
+        if reservation is False:
+            return []
+        
         try:
             logger.info(f"Enriching {len(domains)} organizations")
             # POST with params as list of tuples, empty body
-            response = requests.post(endpoint, headers=self.headers, params=params, json={})
-            response.raise_for_status()
+            response = self._post("organizations/bulk_enrich", url, params=params, json={})
             
             data = response.json()
-            orgs = data.get("organizations", [])
+            orgs = [org for org in data.get("organizations", []) if org]
             logger.info(f"Enriched {len(orgs)} organizations successfully")
             
+            self._settle(reservation, len(orgs))
             return orgs
             
         except Exception as e:
             logger.error(f"Organization enrichment failed: {e}")
+            self._settle(reservation, 0, error=e)
+            self._alert("enrich_org", e)
             return []
     
-    def process_batch_of_10(self, search_params: Dict) -> Dict:
-        """Process a single batch of 10 leads through the full pipeline"""
+    def _post(self, endpoint: str, url: str, **kwargs) -> requests.Response:
+        """POST on the pooled session, retrying rate limits and transient server errors
+        
+        endpoint is the short name recorded on the span, e.g. "people/bulk_match".
+        """
+        for attempt in range(self.max_retries + 1):
+            with tracing.span("apollo.post", endpoint=endpoint, attempt=attempt) as span:
+                if self.rate_limiter:
+                    waited = time.perf_counter()
+                    self.rate_limiter.acquire()
+                    span.set(rate_limit_wait_ms=round((time.perf_counter() - waited) * 1000, 1))
+                response = self.session.post(url, timeout=self.timeout, **kwargs)
+                span.set(status=response.status_code)
+            if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                break
+            
+            retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+            delay = min(retry_after, 30) if retry_after is not None else self.backoff * 2 ** attempt
+            logger.warning(f"Apollo returned {response.status_code}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+        
+        response.raise_for_status()
+        return response
+    
+    def _reserve(self, operation: str, units: int):
+        """Reserve Apollo credits; False when the budget governor denies the call"""
+        if not self.governor:
+            return None
+        
+        reservation = self.governor.reserve("apollo", operation, units)
+        if reservation is None:
+            logger.warning(f"Skipping Apollo {operation}: daily credit budget exhausted")
+            return False
+        return reservation
+    
+    def _settle(self, reservation, units_used: int, error: Exception = None):
+        """Record actual usage against a reservation made by _reserve"""
+        if not reservation:
+            return
+        
+        status = getattr(getattr(error, "response", None), "status_code", None)
+        self.governor.settle(reservation, units_used, success=error is None,
+                             rate_limited=status == 429)
+    
+    def _alert(self, operation: str, error: Exception):
+        """Report a failed call; the AlertManager folds repeats into one alert"""
+        if not self.alerts:
+            return
+        
+        status = getattr(getattr(error, "response", None), "status_code", None)
+        severity = "critical" if status in (401, 403) else "high"
+        self.alerts.report("api_error", "apollo", f"Apollo {operation} failed: {error}",
+                           severity=severity, details={"operation": operation, "status": status})
+    
+    def process_batch_of_10(self, search_params: Dict, priority: int = 1) -> Dict:
+        """Process a single batch of 10 leads through the full pipeline
+        
+        priority is the industry priority from the search config; lower-priority
+        batches are skipped once the Apollo budget passes its soft limit.
+        """
         results = {
             "raw_people": [],
             "enriched_people": [],
             "valid_emails": [],
             "enriched_orgs": [],
+            "orgs_by_domain": {},
             "qualified_leads": []
         }
         
-        # Step 1: Search for 10 people
-        people = self.search_people(search_params, limit=10)
+        if self.governor and self.governor.should_skip("apollo", priority):
+            logger.warning(f"Apollo budget near limit, skipping priority {priority} batch")
+            return results
+        
+        # Step 1: Search for 10 people (or per_page from the search config)
+        people = self.search_people(search_params, limit=search_params.get("per_page", 10))
         results["raw_people"] = people
         
         if not people:
@@ -133,9 +272,8 @@ class ApolloAgent:
         enriched = self.enrich_people_bulk(people)
         results["enriched_people"] = enriched
         
-        # Step 3: Extract emails for validation (Neverbounce later)
+        # Step 3: Extract emails and verify them in bulk
         emails_to_validate = []
-        unique_domains = set()
         
         for person in enriched:
             email = person.get("email")
@@ -145,19 +283,32 @@ class ApolloAgent:
                     "person_id": person.get("id"),
                     "person": person
                 })
-                
-                # Extract domain for org enrichment
-                org = person.get("organization", {})
-                domain = org.get("domain")
-                if domain:
-                    unique_domains.add(domain)
-        
-        # For now, mark all as valid (Neverbounce next step)
-        results["valid_emails"] = emails_to_validate
-        logger.info(f"Found {len(emails_to_validate)} emails to validate")
-        
-        # Step 4: Enrich organizations
-        if unique_domains:
+        
+        if self.verifier and emails_to_validate:
+            verification = self.verifier.verify(e["email"] for e in emails_to_validate)
+            for email_data in emails_to_validate:
+                email_data["verification"] = verification.get(normalize_email(email_data["email"]), "unknown")
+            results["valid_emails"] = [
+                e for e in emails_to_validate if self.verifier.is_deliverable(e["verification"])
+            ]
+        else:
+            results["valid_emails"] = emails_to_validate
+        if self.verifier:
+            logger.info(f"{len(results['valid_emails'])}/{len(emails_to_validate)} emails passed verification")
+        else:
+            logger.info(f"Found {len(emails_to_validate)} emails (verification skipped)")
+        
+        # Only enrich organizations that still have a deliverable contact
+        unique_domains = set()
+        for email_data in results["valid_emails"]:
+            domain = (email_data["person"].get("organization") or {}).get("domain")
+            if domain:
+                unique_domains.add(domain)
+        
+        # Step 4: Enrich organizations (person records already carry basic org data,
+        # so this is the first thing dropped when the budget runs low)
+        low_budget = self.governor and self.governor.should_skip("apollo", priority=2)
+        if unique_domains and not low_budget:
             enriched_orgs = self.enrich_organizations(list(unique_domains))
             results["enriched_orgs"] = enriched_orgs
             
@@ -170,6 +321,12 @@ class ApolloAgent:
         else:
             org_by_domain = {}
         
+        # Org payloads are stored once per domain (company_intelligence_cache),
+        # not copied onto every lead at the company
+        results["orgs_by_domain"] = {
+            domain: self.projector.project_org(org) for domain, org in org_by_domain.items()
+        }
+        
         # Step 5: Combine into qualified leads
         for email_data in results["valid_emails"]:
             person = email_data["person"]
@@ -181,6 +338,7 @@ class ApolloAgent:
             
             qualified_lead = {
                 "email": email_data.get("email"),
+                "email_verification": email_data.get("verification"),
                 "first_name": person.get("first_name"),
                 "last_name": person.get("last_name"),
                 "title": person.get("title"),
@@ -188,9 +346,8 @@ class ApolloAgent:
                 "company_size": enriched_org.get("estimated_num_employees"),
                 "revenue": enriched_org.get("estimated_annual_revenue"),
                 "industry": enriched_org.get("industry"),
-                "domain": domain,
-                "person_data": person,
-                "org_data": enriched_org
+                "domain": domain,  # references company_intelligence_cache.domain
+                "person_data": self.projector.project_person(person)
             }
             results["qualified_leads"].append(qualified_lead)
         
@@ -1,17 +1,19 @@
 ﻿import os
 import json
+import fcntl
 import requests
 from typing import List, Dict, Any, Optional
 from pathlib import Path
+from contextlib import contextmanager
 from loguru import logger
-from dotenv import load_dotenv
 
-load_dotenv()
+from utils.config import load_env
 
 class ApolloSearchManager:
     """Modular Apollo search manager with configurable parameters"""
     
     def __init__(self, config_path: str = "config/apollo_search_config.json"):
+        load_env()
         self.api_key = os.getenv("APOLLO_API_KEY")
         self.config = self._load_config(config_path)
         self.progress_file = Path("data/apollo_progress.json")
@@ -102,8 +104,11 @@ class ApolloSearchManager:
     
     def get_next_search_params(self) -> tuple[dict, dict]:
         """Get next search parameters with automatic rotation"""
-        progress = self._load_progress()
-        
+        with self._progress_update() as progress:
+            return self._next_search_params(progress)
+    
+    def _next_search_params(self, progress: dict) -> tuple[dict, dict]:
+        """Advance the rotation in progress (caller holds the progress lock)"""
         # Get current position in rotation
         industries = sorted(
             self.config["us_industries"].items(),
@@ -136,8 +141,6 @@ class ApolloSearchManager:
         if industry_idx + 1 >= len(industries):
             progress["metro_index"] = (metro_idx + 1) % len(metros)
         
-        self._save_progress(progress)
-        
         metadata = {
             "industry": industry_name,
             "metro": metro_name,
@@ -147,6 +150,50 @@ class ApolloSearchManager:
         
         return params, metadata
     
+    def claim_pages(self, industry: str, metro: str, count: int) -> List[int]:
+        """Advance the page cursor of one industry/metro combination by count pages"""
+        combo_key = f"{industry}_{metro}"
+        with self._progress_update() as progress:
+            last = progress.setdefault("pages", {}).get(combo_key, 0)
+            progress["pages"][combo_key] = last + count
+        return list(range(last + 1, last + count + 1))
+    
+    def release_pages(self, industry: str, metro: str, claimed_through: int, first_unused: int) -> bool:
+        """Rewind a combination's cursor so pages from first_unused on are claimed again
+        
+        Only done while the cursor is still at claimed_through; if pages were
+        claimed since, rewinding would hand those out twice.
+        """
+        combo_key = f"{industry}_{metro}"
+        with self._progress_update() as progress:
+            cursor = progress.setdefault("pages", {}).get(combo_key, 0)
+            if cursor != claimed_through:
+                logger.warning(f"Not releasing pages {first_unused}-{claimed_through} of {combo_key}: "
+                               f"cursor moved to {cursor}")
+                return False
+            progress["pages"][combo_key] = first_unused - 1
+        return True
+    
+    @contextmanager
+    def _progress_update(self):
+        """Read-modify-write of the progress file under an exclusive lock
+        
+        The lock is on a sibling .lock file, since the progress file itself is
+        replaced on every save. Other processes (coordinators, ingest) block
+        until the update is written; nothing is saved if the block raises.
+        """
+        lock_path = self.progress_file.with_name(self.progress_file.name + ".lock")
+        with open(lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                progress = self._load_progress()
+                before = json.dumps(progress, sort_keys=True)
+                yield progress
+                if json.dumps(progress, sort_keys=True) != before:
+                    self._save_progress(progress)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+    
     def _load_progress(self) -> dict:
         if self.progress_file.exists():
             with open(self.progress_file, 'r') as f:
@@ -154,8 +201,11 @@ class ApolloSearchManager:
         return {}
     
     def _save_progress(self, progress: dict):
-        with open(self.progress_file, 'w') as f:
+        # Write then rename, so readers never see a half-written file
+        partial = self.progress_file.with_suffix(".tmp")
+        with open(partial, 'w') as f:
             json.dump(progress, f, indent=2)
+        os.replace(partial, self.progress_file)
     
     def _deep_merge(self, base: dict, updates: dict):
         """Deep merge updates into base dictionary"""
@@ -0,0 +1,247 @@
+﻿import os
+import json
+import time
+import threading
+import requests
+from typing import Dict, Iterable, List, Optional
+from datetime import datetime, timedelta
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+
+from utils import tracing
+from utils.config import load_env
+
+DELIVERABLE_RESULTS = {"valid"}
+DOMAIN_WIDE_RESULTS = {"catchall"}
+
+
+def normalize_email(email: Optional[str]) -> str:
+    """The form emails are cached, verified and looked up under"""
+    return (email or "").strip().lower()
+
+
+class NeverBounceBackend:
+    """NeverBounce v4: bulk jobs (create, poll status, page through results) and single checks"""
+
+    def __init__(self, base_url: str = None, poll_interval: float = 2.0, job_timeout: float = 600):
+        load_env()
+        self.api_key = os.getenv("NEVERBOUNCE_API_KEY")
+        self.base_url = (base_url or os.getenv("NEVERBOUNCE_BASE_URL", "https://api.neverbounce.com/v4")).rstrip("/")
+        self.poll_interval = poll_interval
+        self.job_timeout = job_timeout
+        self.session = requests.Session()
+
+    def verify_single(self, email: str) -> Dict:
+        """Check one address synchronously: {"result": ..., "flags": [...]}"""
+        data = self._request("GET", "single/check", params={"key": self.api_key, "email": email})
+        if data.get("status") != "success":
+            raise RuntimeError(f"NeverBounce single check failed: {data.get('message')}")
+        return {"result": data.get("result", "unknown"), "flags": data.get("flags", [])}
+
+    def verify_bulk(self, emails: List[str]) -> Dict[str, Dict]:
+        """Run one bulk job and return {email: {"result": ..., "flags": [...]}}"""
+        job_id = self._create_job(emails)
+        self._wait_for_job(job_id)
+        return self._fetch_results(job_id)
+
+    def _create_job(self, emails: List[str]) -> str:
+        data = self._request("POST", "jobs/create", emails=len(emails), json={
+            "key": self.api_key,
+            "input_location": "supplied",
+            "input": [[email] for email in emails],
+            "auto_parse": 1,
+            "auto_start": 1
+        })
+        if data.get("status") != "success":
+            raise RuntimeError(f"NeverBounce job creation failed: {data.get('message')}")
+        return data["job_id"]
+
+    def _wait_for_job(self, job_id: str):
+        deadline = time.monotonic() + self.job_timeout
+        while time.monotonic() < deadline:
+            status = self._request("GET", "jobs/status", params={"key": self.api_key, "job_id": job_id}).get("job_status")
+            if status == "complete":
+                return
+            if status == "failed":
+                raise RuntimeError(f"NeverBounce job {job_id} failed")
+            time.sleep(self.poll_interval)
+        raise TimeoutError(f"NeverBounce job {job_id} did not complete in {self.job_timeout}s")
+
+    def _fetch_results(self, job_id: str) -> Dict[str, Dict]:
+        results = {}
+        page, total_pages = 1, 1
+        while page <= total_pages:
+            data = self._request("GET", "jobs/results", params={
+                "key": self.api_key, "job_id": job_id, "page": page, "items_per_page": 1000
+            })
+            total_pages = data.get("total_pages", 1)
+
+            for item in data.get("results", []):
+                email = item["data"][0] if isinstance(item["data"], list) else item["data"].get("email")
+                verification = item.get("verification", {})
+                results[normalize_email(email)] = {
+                    "result": verification.get("result", "unknown"),
+                    "flags": verification.get("flags", [])
+                }
+            page += 1
+        return results
+
+    def _request(self, method: str, endpoint: str, emails: Optional[int] = None, **kwargs) -> Dict:
+        """One API call in a span named after the endpoint; returns the decoded body"""
+        with tracing.span("neverbounce.request", endpoint=endpoint) as span:
+            if emails is not None:
+                span.set(emails=emails)
+            response = self.session.request(method, f"{self.base_url}/{endpoint}", **kwargs)
+            span.set(status=response.status_code)
+            response.raise_for_status()
+            return response.json()
+
+
+class EmailVerifier:
+    """Bulk email verification with per-email TTL cache and domain short-circuits
+
+    Emails on a domain already known to be catch-all, or to have no mail
+    server, get that result without another paid lookup. Up to
+    single_check_limit unknown emails (a sourcing batch) are checked one by
+    one in parallel, which answers in one round trip instead of a job's poll
+    interval; larger sets are verified in bulk jobs of job_size, at most
+    max_concurrent_jobs at a time.
+    """
+
+    def __init__(self, backend=None, job_size: int = 500, max_concurrent_jobs: int = 4,
+                 ttl: timedelta = timedelta(days=30), accept_catchall: bool = False,
+                 governor=None, cache_file: Optional[str] = "data/email_verification_cache.json",
+                 single_check_limit: int = 25, max_concurrent_checks: int = 10):
+        self.backend = backend or NeverBounceBackend()
+        self.job_size = job_size
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.single_check_limit = single_check_limit
+        self.max_concurrent_checks = max_concurrent_checks
+        self.ttl = ttl
+        self.accept_catchall = accept_catchall
+        self.governor = governor  # optional BudgetGovernor
+        self.cache_file = Path(cache_file) if cache_file else None
+
+        self._lock = threading.Lock()
+        cache = self._load_cache()
+        self._emails: Dict[str, Dict] = cache.get("emails", {})
+        self._domains: Dict[str, Dict] = cache.get("domains", {})
+        self.stats = {"cache_hits": 0, "domain_hits": 0, "verified": 0, "jobs": 0, "failed": 0}
+
+    def verify(self, emails: Iterable[str]) -> Dict[str, str]:
+        """Return {email: result} for every email, using the backend only for unknowns"""
+        now = datetime.now()
+        results = {}
+        to_verify = []
+        cache_hits = domain_hits = 0
+
+        for email in {normalize_email(e) for e in emails if e}:
+            cached = self._lookup(self._emails, email, now)
+            if cached:
+                results[email] = cached["result"]
+                cache_hits += 1
+                continue
+
+            domain_status = self._lookup(self._domains, email.split("@")[-1], now)
+            if domain_status:
+                results[email] = domain_status["result"]
+                domain_hits += 1
+                continue
+
+            to_verify.append(email)
+
+        self.stats["cache_hits"] += cache_hits
+        self.stats["domain_hits"] += domain_hits
+
+        if len(to_verify) <= self.single_check_limit and hasattr(self.backend, "verify_single"):
+            jobs, check, workers = [[email] for email in to_verify], self._check_single, self.max_concurrent_checks
+        else:
+            jobs = [to_verify[i:i + self.job_size] for i in range(0, len(to_verify), self.job_size)]
+            check, workers = self.backend.verify_bulk, self.max_concurrent_jobs
+        if jobs:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for verified in pool.map(lambda job: self._run_job(job, check), jobs):
+                    results.update(verified)
+            self._save_cache()
+
+        logger.info(
+            f"Verified {len(results)} emails: {cache_hits} cached, "
+            f"{domain_hits} by domain, {len(to_verify)} sent in {len(jobs)} requests"
+        )
+        return results
+
+    def is_deliverable(self, result: Optional[str]) -> bool:
+        if result in DELIVERABLE_RESULTS:
+            return True
+        return self.accept_catchall and result == "catchall"
+
+    def _check_single(self, emails: List[str]) -> Dict[str, Dict]:
+        return {email: self.backend.verify_single(email) for email in emails}
+
+    def _run_job(self, emails: List[str], check) -> Dict[str, str]:
+        reservation = None
+        if self.governor:
+            reservation = self.governor.reserve("neverbounce", "verify", len(emails))
+            if reservation is None:
+                logger.warning(f"NeverBounce budget exhausted, {len(emails)} emails left unverified")
+                return {email: "unknown" for email in emails}
+
+        try:
+            verified = check(emails)
+        except Exception as e:
+            logger.error(f"Email verification job failed: {e}")
+            self.stats["failed"] += len(emails)
+            if reservation:
+                self.governor.settle(reservation, 0, success=False)
+            return {email: "unknown" for email in emails}
+
+        if reservation:
+            self.governor.settle(reservation, len(verified))
+
+        expires_at = (datetime.now() + self.ttl).isoformat()
+        with self._lock:
+            self.stats["jobs"] += 1
+            self.stats["verified"] += len(verified)
+            for email, verification in verified.items():
+                if verification["result"] == "unknown":
+                    continue  # worth retrying next time, not caching
+                self._emails[email] = {"result": verification["result"], "expires_at": expires_at}
+                self._remember_domain(email.split("@")[-1], verification, expires_at)
+
+        return {email: verified.get(email, {}).get("result", "unknown") for email in emails}
+
+    def _remember_domain(self, domain: str, verification: Dict, expires_at: str):
+        """Cache results that hold for every address on the domain"""
+        result = verification["result"]
+        flags = verification.get("flags") or []
+        if result in DOMAIN_WIDE_RESULTS:
+            self._domains[domain] = {"result": result, "expires_at": expires_at}
+        elif result == "invalid" and "bad_dns" in flags:
+            # NeverBounce found no DNS for the domain, so no address on it can be valid.
+            # A missing has_dns_mx flag is not enough: bad_syntax results can lack it too.
+            self._domains[domain] = {"result": "invalid", "expires_at": expires_at}
+
+    def _lookup(self, cache: Dict[str, Dict], key: str, now: datetime) -> Optional[Dict]:
+        entry = cache.get(key)
+        if entry and datetime.fromisoformat(entry["expires_at"]) > now:
+            return entry
+        return None
+
+    def _load_cache(self) -> Dict:
+        if self.cache_file and self.cache_file.exists():
+            with open(self.cache_file, 'r') as f:
+                return json.load(f)
+        return {}
+
+    def _save_cache(self):
+        if not self.cache_file:
+            return
+        self.cache_file.parent.mkdir(exist_ok=True)
+        with self._lock:
+            snapshot = {"emails": dict(self._emails), "domains": dict(self._domains)}
+        # Sourcing workers share the file; replace it whole so readers never see a partial write
+        tmp_path = self.cache_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.cache_file)
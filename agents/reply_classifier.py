@@ -0,0 +1,328 @@
+﻿import os
+import re
+import json
+import hashlib
+import requests
+from typing import Dict, List, Optional, Tuple
+from pathlib import Path
+from loguru import logger
+
+from utils import db, tracing
+from utils.config import load_env
+from utils.db import get_connection
+
+PROMPT_VERSION = "v1"
+
+CLASSIFICATION_FIELDS = [
+    "interest_level", "sentiment", "reply_type", "objection_category",
+    "next_action", "priority_level", "confidence"
+]
+
+CLASSIFICATION_PROMPT = """You classify replies to B2B cold outreach emails sent to business owners.
+For each numbered reply return an object with:
+  interest_level: hot | warm | cold | none
+  sentiment: positive | neutral | negative
+  reply_type: interested | meeting_request | question | objection | not_interested | unsubscribe | out_of_office | auto_reply | referral | other
+  objection_category: timing | price | not_selling | already_advised | trust | other | null
+  next_action: notify_founder | book_meeting | follow_up | nurture | suppress | none
+  priority_level: high | medium | low
+  confidence: number between 0 and 1
+Respond with JSON: {"results": [ ...one object per reply, in the same order... ]}"""
+
+# Everything below one of these markers is a quoted thread, not the reply itself
+QUOTE_MARKERS = [
+    re.compile(r"^\s*On .+wrote:\s*$", re.IGNORECASE | re.MULTILINE),
+    re.compile(r"^\s*-{2,}\s*Original Message\s*-{2,}", re.IGNORECASE | re.MULTILINE),
+    re.compile(r"^\s*From:\s.+$", re.IGNORECASE | re.MULTILINE),
+    re.compile(r"^\s*_{5,}\s*$", re.MULTILINE),
+]
+
+# Only searched after the first body line, so "Thanks," opening a reply is kept
+SIGNATURE_MARKERS = [
+    re.compile(r"^\s*--\s*$", re.MULTILINE),
+    re.compile(r"^\s*Sent from my \w+", re.IGNORECASE | re.MULTILINE),
+    re.compile(r"^\s*(Best|Thanks|Thank you|Regards|Kind regards|Best regards|Cheers|Sincerely),?\s*$",
+               re.IGNORECASE | re.MULTILINE),
+]
+
+# Masked before hashing so auto-replies that only differ by dates, phone
+# numbers or addresses share one cache entry
+VOLATILE_PATTERNS = [
+    (re.compile(r"\S+@\S+\.\w+"), "<email>"),
+    (re.compile(r"https?://\S+|www\.\S+"), "<url>"),
+    (re.compile(r"\d+"), "<n>"),
+]
+
+
+def normalize_reply(text: str) -> str:
+    """Strip quoted threads, signatures and '>' lines from a reply"""
+    if not text:
+        return ""
+
+    body = text.replace("\r\n", "\n")
+    for pattern in QUOTE_MARKERS:
+        match = pattern.search(body)
+        if match:
+            body = body[:match.start()]
+
+    first_line = re.search(r"\S.*", body)
+    body_start = first_line.end() if first_line else 0
+    for pattern in SIGNATURE_MARKERS:
+        match = pattern.search(body, body_start)
+        if match:
+            body = body[:match.start()]
+
+    lines = [line for line in body.split("\n") if not line.lstrip().startswith(">")]
+    return re.sub(r"\s+", " ", " ".join(lines)).strip()
+
+
+def reply_hash(normalized: str) -> str:
+    """Content hash of a normalized reply, insensitive to case and volatile tokens"""
+    key = normalized.lower()
+    for pattern, replacement in VOLATILE_PATTERNS:
+        key = pattern.sub(replacement, key)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class KeywordClassifierBackend:
+    """Deterministic local classifier for tests and offline runs"""
+
+    name = "keyword-local"
+
+    # First match wins, so negative phrases come before the positive words they contain
+    RULES = [
+        (("out of office", "out of the office", "on vacation", "annual leave", "limited access to email"),
+         {"interest_level": "none", "sentiment": "neutral", "reply_type": "out_of_office",
+          "next_action": "follow_up", "priority_level": "low"}),
+        (("auto-reply", "automatic reply", "autoreply", "do not reply", "this mailbox is not monitored"),
+         {"interest_level": "none", "sentiment": "neutral", "reply_type": "auto_reply",
+          "next_action": "none", "priority_level": "low"}),
+        (("unsubscribe", "remove me", "stop emailing", "take me off"),
+         {"interest_level": "none", "sentiment": "negative", "reply_type": "unsubscribe",
+          "next_action": "suppress", "priority_level": "low"}),
+        (("not selling", "not interested", "not really interested", "no interest", "no thanks", "no thank you",
+          "not at this time"),
+         {"interest_level": "cold", "sentiment": "negative", "reply_type": "not_interested",
+          "objection_category": "not_selling", "next_action": "nurture", "priority_level": "low"}),
+        (("schedule a call", "book a call", "set up a call", "calendar", "meet next week", "let's talk", "lets talk"),
+         {"interest_level": "hot", "sentiment": "positive", "reply_type": "meeting_request",
+          "next_action": "notify_founder", "priority_level": "high"}),
+        (("interested", "tell me more", "send me more", "sounds good", "curious"),
+         {"interest_level": "warm", "sentiment": "positive", "reply_type": "interested",
+          "next_action": "notify_founder", "priority_level": "high"}),
+    ]
+    # Whole words only: "uninterested" must not match "interested"
+    _PATTERNS = [
+        (re.compile(r"\b(?:" + "|".join(re.escape(keyword) for keyword in keywords) + r")\b"), result)
+        for keywords, result in RULES
+    ]
+
+    def classify_batch(self, texts: List[str]) -> List[Dict]:
+        return [self._classify(text.lower()) for text in texts]
+
+    def _classify(self, text: str) -> Dict:
+        for pattern, result in self._PATTERNS:
+            if pattern.search(text):
+                return {"objection_category": None, "confidence": 0.6, **result}
+
+        return {
+            "interest_level": "cold" if text else "none",
+            "sentiment": "neutral",
+            "reply_type": "other",
+            "objection_category": None,
+            "next_action": "follow_up",
+            "priority_level": "medium",
+            "confidence": 0.3
+        }
+
+
+class OpenAIClassifierBackend:
+    """Classifies many replies per chat completion request"""
+
+    def __init__(self, model: str = None, timeout: int = 60):
+        load_env()
+        self.api_key = os.getenv("OPENAI_API_KEY")
+        self.model = model or os.getenv("OPENAI_CLASSIFIER_MODEL", "gpt-4o-mini")
+        self.name = f"openai:{self.model}"
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        })
+
+    def classify_batch(self, texts: List[str]) -> List[Dict]:
+        numbered = "\n\n".join(f"[{i + 1}] {text}" for i, text in enumerate(texts))
+        payload = {
+            "model": self.model,
+            "temperature": 0,
+            "response_format": {"type": "json_object"},
+            "messages": [
+                {"role": "system", "content": CLASSIFICATION_PROMPT},
+                {"role": "user", "content": numbered}
+            ]
+        }
+
+        with tracing.span("openai.classify", model=self.model, texts=len(texts)) as span:
+            response = self.session.post("https://api.openai.com/v1/chat/completions",
+                                         json=payload, timeout=self.timeout)
+            span.set(status=response.status_code)
+            response.raise_for_status()
+            data = response.json()
+            span.set(total_tokens=data.get("usage", {}).get("total_tokens"))
+
+        content = data["choices"][0]["message"]["content"]
+        results = json.loads(content).get("results", [])
+        if len(results) != len(texts):
+            raise ValueError(f"Expected {len(texts)} classifications, got {len(results)}")
+        return results
+
+
+class ReplyClassifier:
+    """Classifies unclassified replies in batches, caching by content hash
+
+    Cache keys include the prompt version and backend name, so results from
+    one backend (e.g. the keyword fallback) are never served as another's.
+    New entries are appended to a JSON-lines cache file.
+    """
+
+    def __init__(self, backend=None, batch_size: int = 100, max_per_request: int = 20,
+                 cache_file: Optional[str] = "data/reply_classification_cache.jsonl"):
+        self.backend = backend or KeywordClassifierBackend()
+        self.batch_size = batch_size
+        self.max_per_request = max_per_request
+        self.cache_file = Path(cache_file) if cache_file else None
+        self.cache = self._load_cache()
+        self.stats = {"classified": 0, "cache_hits": 0, "model_requests": 0}
+
+    def classify_texts(self, texts: List[str]) -> List[Optional[Dict]]:
+        """Classify raw reply texts, sending only uncached ones to the backend"""
+        keys = []
+        misses = {}  # cache key -> normalized text, deduplicated within the batch
+
+        for text in texts:
+            normalized = normalize_reply(text)
+            key = self.cache_key(normalized)
+            keys.append(key)
+            if key not in self.cache and key not in misses:
+                misses[key] = normalized
+
+        self.stats["cache_hits"] += len(texts) - len(misses)
+
+        new_entries = {}
+        miss_items = list(misses.items())
+        for start in range(0, len(miss_items), self.max_per_request):
+            chunk = miss_items[start:start + self.max_per_request]
+            try:
+                self.stats["model_requests"] += 1
+                results = self.backend.classify_batch([text for _, text in chunk])
+            except Exception as e:
+                logger.error(f"Reply classification request failed: {e}")
+                continue
+
+            for (key, _), result in zip(chunk, results):
+                new_entries[key] = {field: result.get(field) for field in CLASSIFICATION_FIELDS}
+
+        self.cache.update(new_entries)
+        self._append_cache(new_entries)
+        return [self.cache.get(key) for key in keys]
+
+    def cache_key(self, normalized: str) -> str:
+        return f"{PROMPT_VERSION}:{self.backend.name}:{reply_hash(normalized)}"
+
+    def run(self) -> Dict[str, int]:
+        """Classify all unclassified replies in the database"""
+        conn = get_connection()
+        try:
+            while True:
+                rows = self._fetch_unclassified(conn)
+                if not rows:
+                    break
+
+                results = self.classify_texts([row["reply_text"] for row in rows])
+                classified = [(row["reply_id"], result) for row, result in zip(rows, results) if result]
+                self._save_classifications(conn, classified)
+                self.stats["classified"] += len(classified)
+
+                logger.info(f"Classified {len(classified)}/{len(rows)} replies")
+                if len(classified) < len(rows):
+                    # Backend is failing; leave the rest for the next run
+                    break
+        finally:
+            conn.close()
+
+        logger.info(
+            f"Reply classification complete: {self.stats['classified']} classified, "
+            f"{self.stats['cache_hits']} cache hits, {self.stats['model_requests']} model requests"
+        )
+        return self.stats
+
+    def _fetch_unclassified(self, conn) -> List[Dict]:
+        with conn.cursor(cursor_factory=db.RealDictCursor) as cur:
+            cur.execute("""
+                SELECT reply_id, reply_text
+                FROM reply_classifications
+                WHERE classified_by IS NULL
+                ORDER BY reply_date NULLS LAST
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, (self.batch_size,))
+            return cur.fetchall()
+
+    def _save_classifications(self, conn, classified: List[Tuple[str, Dict]]):
+        rows = [
+            (
+                str(reply_id),
+                result.get("interest_level"),
+                result.get("sentiment"),
+                result.get("reply_type"),
+                result.get("objection_category"),
+                result.get("next_action"),
+                result.get("priority_level"),
+                result.get("confidence"),
+                self.backend.name,
+                PROMPT_VERSION
+            )
+            for reply_id, result in classified
+        ]
+
+        with conn.cursor() as cur:
+            if rows:
+                db.execute_values(cur, """
+                    UPDATE reply_classifications AS r
+                    SET interest_level = v.interest_level,
+                        sentiment = v.sentiment,
+                        reply_type = v.reply_type,
+                        objection_category = v.objection_category,
+                        next_action = v.next_action,
+                        priority_level = v.priority_level,
+                        classification_confidence = v.confidence,
+                        classified_by = v.classified_by,
+                        classification_prompt_version = v.prompt_version,
+                        classified_at = NOW()
+                    FROM (VALUES %s) AS v(reply_id, interest_level, sentiment, reply_type,
+                                          objection_category, next_action, priority_level,
+                                          confidence, classified_by, prompt_version)
+                    WHERE r.reply_id = v.reply_id
+                """, rows, template="(%s::uuid, %s, %s, %s, %s, %s, %s, %s::decimal, %s, %s)")
+        # Commit also releases the row locks taken by the fetch
+        conn.commit()
+
+    def _load_cache(self) -> Dict[str, Dict]:
+        cache = {}
+        if self.cache_file and self.cache_file.exists():
+            with open(self.cache_file, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # torn last line from an interrupted write
+                    cache[entry["key"]] = entry["result"]
+        return cache
+
+    def _append_cache(self, entries: Dict[str, Dict]):
+        if not self.cache_file or not entries:
+            return
+        self.cache_file.parent.mkdir(exist_ok=True)
+        with open(self.cache_file, 'a') as f:
+            f.writelines(json.dumps({"key": key, "result": result}) + "\n" for key, result in entries.items())
@@ -0,0 +1,290 @@
+﻿import os
+import json
+import threading
+import requests
+from typing import Callable, Dict, Optional, Tuple
+from datetime import datetime, timedelta
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from loguru import logger
+
+from utils import db, tracing
+from utils.config import load_env
+from utils.db import get_connection
+
+RESEARCH_PROMPT = """Research the {industry} industry in {location} for owner-operated companies with $1M-$20M revenue.
+Respond with JSON containing:
+  exit_multiples: string
+  industry_challenges: list of strings
+  regulatory_changes: list of strings
+  consolidation_activity: string
+  operational_problems: list of strings
+  success_stories: list of strings
+  growth_outlook: string"""
+
+RESEARCH_FIELDS = [
+    "exit_multiples", "industry_challenges", "regulatory_changes", "consolidation_activity",
+    "operational_problems", "success_stories", "growth_outlook"
+]
+
+
+class PerplexityResearcher:
+    """Fetches industry research from the Perplexity API"""
+
+    def __init__(self, model: str = None, timeout: int = 90):
+        load_env()
+        self.api_key = os.getenv("PERPLEXITY_API_KEY")
+        self.model = model or os.getenv("PERPLEXITY_MODEL", "sonar")
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        })
+
+    def research(self, industry: str, location: Optional[str]) -> Dict:
+        query = RESEARCH_PROMPT.format(industry=industry, location=location or "the United States")
+        with tracing.span("perplexity.research", model=self.model, industry=industry) as span:
+            response = self.session.post(
+                "https://api.perplexity.ai/chat/completions",
+                json={"model": self.model, "messages": [{"role": "user", "content": query}]},
+                timeout=self.timeout
+            )
+            span.set(status=response.status_code)
+            response.raise_for_status()
+            data = response.json()
+            span.set(total_tokens=data.get("usage", {}).get("total_tokens"))
+
+        content = data["choices"][0]["message"]["content"]
+        start, end = content.find("{"), content.rfind("}")
+        fields = json.loads(content[start:end + 1]) if start != -1 else {}
+
+        return {"research_query": query, "perplexity_response": data, **fields}
+
+
+class _Entry:
+    __slots__ = ("data", "expires_at", "retry_after")
+
+    def __init__(self, data: Dict, expires_at: datetime):
+        self.data = data
+        self.expires_at = expires_at
+        self.retry_after = None  # set when a background refresh fails
+
+
+class IndustryResearchCache:
+    """Shared industry research with single-flight misses and refresh-ahead
+
+    Lookups go memory -> industry_research_cache table -> researcher. Concurrent
+    misses on the same key wait on one in-flight fetch instead of each paying
+    for a Perplexity call. Entries inside the refresh window are served as-is
+    while a background refresh replaces them; the refresh first checks whether
+    another process already refreshed the row, and a failed refresh is not
+    retried for refresh_backoff. Usage counts are flushed off the get() path.
+    """
+
+    def __init__(self, researcher: Callable[[str, Optional[str]], Dict] = None,
+                 ttl: timedelta = timedelta(days=30),
+                 refresh_ahead: timedelta = timedelta(days=2),
+                 usage_flush_size: int = 50,
+                 connection_factory: Optional[Callable] = get_connection,
+                 refresh_workers: int = 2,
+                 refresh_backoff: timedelta = timedelta(hours=1)):
+        self.researcher = researcher or PerplexityResearcher().research
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.refresh_backoff = refresh_backoff
+        self.usage_flush_size = usage_flush_size
+        self.connection_factory = connection_factory
+
+        self._entries: Dict[str, _Entry] = {}
+        self._inflight: Dict[str, Future] = {}
+        self._usage = Counter()
+        self._flush_scheduled = False
+        self._lock = threading.Lock()
+        self._usage_lock = threading.Lock()
+        self._refresher = ThreadPoolExecutor(max_workers=refresh_workers,
+                                             thread_name_prefix="research-refresh")
+        self.stats = Counter()
+
+    @staticmethod
+    def make_cache_key(industry: str, location: Optional[str]) -> str:
+        return f"{industry.strip().lower()}|{(location or 'us').strip().lower()}"
+
+    def get(self, industry: str, location: Optional[str] = None) -> Dict:
+        """Return research for an industry/location, fetching at most once per key"""
+        key = self.make_cache_key(industry, location)
+        now = datetime.now()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry.expires_at > now:
+                backing_off = entry.retry_after and entry.retry_after > now
+                if entry.expires_at - now <= self.refresh_ahead and not backing_off:
+                    self._start_flight(key, industry, location, background=True)
+                hit = True
+            else:
+                future, leader = self._start_flight(key, industry, location)
+                hit = False
+
+        if hit:
+            self.stats["memory_hits"] += 1
+            self._record_usage(key)
+            return entry.data
+
+        if leader:
+            self._load(key, industry, location, future, refresh=False)
+        else:
+            self.stats["coalesced"] += 1
+        data = future.result()
+        if not leader:
+            self._record_usage(key)
+        return data
+
+    def flush_usage(self):
+        """Write buffered usage_count increments in one statement"""
+        with self._usage_lock:
+            pending, self._usage = self._usage, Counter()
+            self._flush_scheduled = False
+
+        if not pending or not self.connection_factory:
+            return
+
+        conn = self.connection_factory()
+        try:
+            with conn.cursor() as cur:
+                db.execute_values(cur, """
+                    UPDATE industry_research_cache AS c
+                    SET usage_count = c.usage_count + v.hits
+                    FROM (VALUES %s) AS v(cache_key, hits)
+                    WHERE c.cache_key = v.cache_key
+                """, list(pending.items()))
+            conn.commit()
+            logger.debug(f"Flushed research cache usage for {len(pending)} keys")
+        except Exception as e:
+            logger.error(f"Research cache usage flush failed: {e}")
+            with self._usage_lock:
+                self._usage.update(pending)
+        finally:
+            conn.close()
+
+    def close(self):
+        self._refresher.shutdown(wait=True)
+        self.flush_usage()
+
+
+    def _start_flight(self, key: str, industry: str, location: Optional[str],
+                      background: bool = False) -> Tuple[Future, bool]:
+        """Join the in-flight load for key or register a new one (caller holds the lock)"""
+        future = self._inflight.get(key)
+        if future:
+            return future, False
+
+        future = Future()
+        self._inflight[key] = future
+        if background:
+            self.stats["background_refreshes"] += 1
+            self._refresher.submit(self._load, key, industry, location, future, True)
+        return future, True
+
+    def _load(self, key: str, industry: str, location: Optional[str],
+              future: Future, refresh: bool):
+        """Resolve future from the table or the researcher and update memory"""
+        try:
+            row = self._read_row(key)
+            if row and refresh and row[1] - datetime.now() <= self.refresh_ahead:
+                row = None  # still the stale row; nobody else has refreshed it
+            if row:
+                data, expires_at = row
+                self.stats["db_hits"] += 1
+                self._record_usage(key)
+            else:
+                logger.info(f"Researching {industry} / {location or 'US'}")
+                data = self.researcher(industry, location)
+                expires_at = datetime.now() + self.ttl
+                self.stats["fetches"] += 1
+                self._write_row(key, industry, location, data, expires_at)
+
+            with self._lock:
+                self._entries[key] = _Entry(data, expires_at)
+            future.set_result(data)
+
+        except Exception as e:
+            if refresh:
+                retry_after = datetime.now() + self.refresh_backoff
+                with self._lock:
+                    entry = self._entries.get(key)
+                    if entry:
+                        entry.retry_after = retry_after
+                logger.warning(f"Background research refresh failed for {key}, retrying after "
+                               f"{retry_after:%H:%M}: {e}")
+            else:
+                logger.error(f"Industry research failed for {key}: {e}")
+            future.set_exception(e)
+
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _read_row(self, key: str) -> Optional[Tuple[Dict, datetime]]:
+        if not self.connection_factory:
+            return None
+
+        conn = self.connection_factory()
+        try:
+            with conn.cursor(cursor_factory=db.RealDictCursor) as cur:
+                cur.execute(f"""
+                    SELECT research_query, perplexity_response, expires_at, {', '.join(RESEARCH_FIELDS)}
+                    FROM industry_research_cache
+                    WHERE cache_key = %s AND expires_at > NOW()
+                """, (key,))
+                row = cur.fetchone()
+        finally:
+            conn.close()
+
+        if not row:
+            return None
+        expires_at = row.pop("expires_at")
+        return dict(row), expires_at
+
+    def _write_row(self, key: str, industry: str, location: Optional[str],
+                   data: Dict, expires_at: datetime):
+        if not self.connection_factory:
+            return
+
+        conn = self.connection_factory()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    INSERT INTO industry_research_cache (
+                        cache_key, industry, location, research_query, perplexity_response,
+                        {', '.join(RESEARCH_FIELDS)}, research_date, expires_at
+                    )
+                    VALUES (%s, %s, %s, %s, %s, {', '.join(['%s'] * len(RESEARCH_FIELDS))}, CURRENT_DATE, %s)
+                    ON CONFLICT (cache_key) DO UPDATE SET
+                        research_query = EXCLUDED.research_query,
+                        perplexity_response = EXCLUDED.perplexity_response,
+                        {', '.join(f'{field} = EXCLUDED.{field}' for field in RESEARCH_FIELDS)},
+                        research_date = EXCLUDED.research_date,
+                        expires_at = EXCLUDED.expires_at
+                """, (
+                    key, industry, location, data.get("research_query"),
+                    db.Json(data.get("perplexity_response")),
+                    *[data.get(field) for field in RESEARCH_FIELDS],
+                    expires_at
+                ))
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to store industry research for {key}: {e}")
+        finally:
+            conn.close()
+
+    def _record_usage(self, key: str):
+        with self._usage_lock:
+            self._usage[key] += 1
+            if self._flush_scheduled or sum(self._usage.values()) < self.usage_flush_size:
+                return
+            self._flush_scheduled = True
+        try:
+            self._refresher.submit(self.flush_usage)
+        except RuntimeError:
+            pass  # closing; close() flushes what is left
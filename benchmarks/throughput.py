@@ -0,0 +1,300 @@
+﻿"""
+Offline throughput benchmarks for ApolloAgent and OutreachWorkflow.run
+
+Runs every batch size x concurrency combination against a FakeApolloServer
+in a child process and reports leads/sec, per-stage latency percentiles
+(agent calls, and each graph node for the workflow scenario), peak RSS and
+Apollo HTTP calls per lead. Each scenario runs in a fresh process, so peak
+RSS is that scenario's own. Results can be saved as a JSON baseline and
+compared against one to catch regressions. --sourcing also runs the
+multi-process SourcingCoordinator, one shard per metro, and fails if two
+shards return the same lead.
+
+    python -m benchmarks.throughput --batch-sizes 10,25,50 --concurrency 1,4,8
+    python -m benchmarks.throughput --save-baseline benchmarks/baselines/default.json
+    python -m benchmarks.throughput --compare benchmarks/baselines/default.json
+    python -m benchmarks.throughput --sourcing
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from functools import wraps
+from pathlib import Path
+from typing import Dict, List
+
+import requests
+from loguru import logger
+
+from agents.apollo_agent import ApolloAgent
+from testing.fake_apollo import FakeApolloServer
+
+AGENT_STAGES = {
+    "search": "search_people",
+    "enrich_people": "enrich_people_bulk",
+    "enrich_orgs": "enrich_organizations",
+    "batch": "process_batch_of_10",
+}
+
+WORKFLOW_STAGES = {
+    f"node.{name}": name
+    for name in ("source_leads", "dedupe_leads", "enrich_leads", "score_leads", "persist_state")
+}
+
+
+class StageTimer:
+    """Thread-safe wall-clock samples per stage
+
+    Only the outermost call of a stage is timed on each thread, so methods
+    that recurse over chunks are measured once per top-level call.
+    """
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def instrument(self, obj, stages: Dict[str, str]):
+        for stage, method_name in stages.items():
+            setattr(obj, method_name, self._wrap(stage, getattr(obj, method_name)))
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def summary(self) -> Dict[str, Dict]:
+        return {stage: _percentiles(samples) for stage, samples in sorted(self.samples.items())}
+
+    def _wrap(self, stage: str, func):
+        @wraps(func)
+        def timed(*args, **kwargs):
+            active = getattr(self._local, "active", None)
+            if active is None:
+                active = self._local.active = set()
+            if stage in active:
+                return func(*args, **kwargs)
+
+            active.add(stage)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+                active.discard(stage)
+        return timed
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    if not ordered:
+        return {"count": 0}
+
+    def pick(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+
+    return {"count": len(ordered), "p50_ms": pick(0.50), "p95_ms": pick(0.95), "max_ms": pick(1.0)}
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_scenario(server_url: str, scenario: str, batch_size: int, concurrency: int,
+                 batches: int) -> Dict:
+    """Run `batches` batches of `batch_size` leads with `concurrency` threads"""
+    requests.post(f"{server_url}/__reset")
+
+    timer = StageTimer()
+    agent = ApolloAgent(base_url=server_url, backoff=0.01, pool_size=max(concurrency, 10))
+    timer.instrument(agent, AGENT_STAGES)
+
+    if scenario == "workflow":
+        from workflows.outreach_workflow import OutreachWorkflow
+        workflow = OutreachWorkflow(apollo_agent=agent)
+        # Before the graph is compiled, so its nodes are the timed methods
+        timer.instrument(workflow, {"workflow_run": "run", **WORKFLOW_STAGES})
+
+        def run_batch(page: int) -> int:
+            params = {"q_keywords": "benchmark", "page": page, "per_page": batch_size}
+            return len(workflow.run(batch_number=page, search_params=params)["qualified_leads"])
+    else:
+        def run_batch(page: int) -> int:
+            params = {"q_keywords": "benchmark", "page": page, "per_page": batch_size}
+            return len(agent.process_batch_of_10(params)["qualified_leads"])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        leads = sum(pool.map(run_batch, range(1, batches + 1)))
+    elapsed = time.perf_counter() - start
+
+    http = requests.get(f"{server_url}/__stats").json()
+    api_calls = http.get("total", 0)
+
+    return {
+        "scenario": scenario,
+        "batch_size": batch_size,
+        "concurrency": concurrency,
+        "batches": batches,
+        "leads": leads,
+        "elapsed_s": round(elapsed, 3),
+        "leads_per_sec": round(leads / elapsed, 2) if elapsed else 0.0,
+        "http_calls": api_calls,
+        "http_calls_per_lead": round(api_calls / leads, 3) if leads else None,
+        "rate_limited": http.get("rate_limited", 0),
+        "server_errors": http.get("errors", 0),
+        "peak_rss_mb": _peak_rss_mb(),
+        "stages": timer.summary(),
+    }
+
+
+def run_sourcing(server_url: str) -> Dict:
+    """One SourcingCoordinator run; two workers deal the combinations into one shard per metro"""
+    from agents.apollo_search_manager import ApolloSearchManager
+    from workflows.sourcing_coordinator import SourcingCoordinator
+
+    requests.post(f"{server_url}/__reset")
+    manager = ApolloSearchManager()
+    with tempfile.TemporaryDirectory() as progress_dir:
+        manager.progress_file = Path(progress_dir) / "apollo_progress.json"  # leave the real cursor alone
+        coordinator = SourcingCoordinator(workers=2, rate_per_second=100, credit_limit=10_000,
+                                          search_manager=manager, agent_options={"base_url": server_url})
+        report = coordinator.run()
+
+    return {key: report[key] for key in ("unique_leads", "duplicates", "cross_shard_duplicates",
+                                         "elapsed_s", "leads_per_sec", "errors")}
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Return regressions in throughput or p95 latency beyond tolerance"""
+
+    def key(result: Dict):
+        return result["scenario"], result["batch_size"], result["concurrency"]
+
+    baseline_results = {key(r): r for r in baseline.get("results", [])}
+    regressions = []
+
+    for result in current["results"]:
+        base = baseline_results.get(key(result))
+        if not base:
+            continue
+        label = "{} batch={} concurrency={}".format(*key(result))
+
+        if base["leads_per_sec"] and result["leads_per_sec"] < base["leads_per_sec"] * (1 - tolerance):
+            regressions.append(f"{label}: leads/sec {base['leads_per_sec']} -> {result['leads_per_sec']}")
+
+        for stage, stats in result["stages"].items():
+            base_p95 = base["stages"].get(stage, {}).get("p95_ms")
+            if base_p95 and stats.get("p95_ms", 0) > base_p95 * (1 + tolerance):
+                regressions.append(f"{label}: {stage} p95 {base_p95}ms -> {stats['p95_ms']}ms")
+
+    return regressions
+
+
+def print_report(report: Dict):
+    print(f"\n{'scenario':<10}{'batch':>7}{'conc':>6}{'leads':>8}{'leads/s':>10}"
+          f"{'calls/lead':>12}{'batch p95':>11}{'rss MB':>9}")
+    for r in report["results"]:
+        batch_p95 = r["stages"].get("batch", {}).get("p95_ms", "-")
+        print(f"{r['scenario']:<10}{r['batch_size']:>7}{r['concurrency']:>6}{r['leads']:>8}"
+              f"{r['leads_per_sec']:>10}{str(r['http_calls_per_lead']):>12}{batch_p95:>11}{r['peak_rss_mb']:>9}")
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline Apollo throughput benchmarks")
+    parser.add_argument("--batch-sizes", default="10,25,50", help="leads per batch (Apollo per_page)")
+    parser.add_argument("--concurrency", default="1,4,8", help="concurrent batches")
+    parser.add_argument("--batches", type=int, default=20, help="batches per scenario")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake Apollo latency per request (s)")
+    parser.add_argument("--latency-jitter", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workflow", action="store_true", help="also benchmark OutreachWorkflow.run")
+    parser.add_argument("--sourcing", action="store_true",
+                        help="also run the sourcing coordinator and check shards don't overlap")
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--save-baseline", help="write results as a baseline JSON")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed regression fraction")
+    args = parser.parse_args(argv)
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    server_config = {
+        "seed": args.seed,
+        "latency": args.latency,
+        "latency_jitter": args.latency_jitter,
+        "error_rate": args.error_rate,
+        "rate_limit_rate": args.rate_limit_rate,
+    }
+    scenarios = ["agent", "workflow"] if args.workflow else ["agent"]
+    batch_sizes = [int(x) for x in args.batch_sizes.split(",")]
+    concurrency_levels = [int(x) for x in args.concurrency.split(",")]
+
+    results = []
+    with FakeApolloServer.spawn(**server_config) as server:
+        for scenario in scenarios:
+            for batch_size in batch_sizes:
+                for concurrency in concurrency_levels:
+                    # A fresh process per scenario: ru_maxrss is a process-lifetime high-water mark
+                    with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) as pool:
+                        result = pool.submit(run_scenario, server.url, scenario, batch_size,
+                                             concurrency, args.batches).result()
+                    results.append(result)
+                    print(f"{scenario} batch={batch_size} concurrency={concurrency}: "
+                          f"{result['leads_per_sec']} leads/s", file=sys.stderr)
+        sourcing = run_sourcing(server.url) if args.sourcing else None
+
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "server": server_config,
+        "batches": args.batches,
+        "results": results,
+    }
+    if sourcing:
+        report["sourcing"] = sourcing
+    print_report(report)
+
+    for path in filter(None, [args.output, args.save_baseline]):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved results to {path}")
+
+    if sourcing:
+        print(f"\nsourcing: {sourcing['unique_leads']} unique leads, {sourcing['leads_per_sec']} leads/s, "
+              f"{sourcing['cross_shard_duplicates']} cross-shard duplicates")
+        if sourcing["cross_shard_duplicates"] or sourcing["errors"]:
+            print("Sourcing shards overlapped or failed: metro filters are not reaching the search")
+            return 1
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) vs {args.compare}:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            return 1
+        print(f"\nNo regressions vs {args.compare} (tolerance {args.tolerance:.0%})")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
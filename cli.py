@@ -0,0 +1,400 @@
+﻿#!/usr/bin/env python3
+"""
+On Pulse Solutions - Outreach worker CLI
+Single entry point for cron workers: run a batch, schedule batches, ingest leads, benchmark.
+
+    python cli.py run --batch 3 --live --persist
+    python cli.py schedule --batches 8 --dry-run
+    python cli.py ingest --batches 5
+    python cli.py source --workers 4 --pages 2
+    python cli.py dedupe
+    python cli.py bench --batch-sizes 10,25 --concurrency 1,4
+    python cli.py notion-sync --tables system_alerts workflow_runs
+    python cli.py migrate --dry-run
+    python cli.py export --tables leads
+    python cli.py --trace data/trace.jsonl --profile cprofile run --live
+    python cli.py trace-summary data/trace.jsonl
+    python cli.py --import-profile run
+
+Heavy dependencies (langgraph, psycopg2, notion_client, pyarrow) are imported inside
+the subcommand that needs them, so startup only pays for what runs.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from datetime import date, datetime, time, timedelta
+
+
+def cmd_run(args) -> int:
+    """Run one workflow batch"""
+    import uuid
+    from workflows.outreach_workflow import get_workflow
+
+    run_id = str(uuid.uuid4())
+    kwargs, governor = {}, None
+    if args.live:
+        from agents.apollo_agent import ApolloAgent
+        from agents.apollo_search_manager import ApolloSearchManager
+        from agents.email_verifier import EmailVerifier
+        from utils.budget import BudgetGovernor
+        governor = BudgetGovernor(workflow_run_id=run_id)
+        governor.start_run(batch_number=args.batch)
+        verifier = None if args.no_verify else EmailVerifier(governor=governor)
+        kwargs["apollo_agent"] = ApolloAgent(governor=governor, verifier=verifier)
+        kwargs["search_manager"] = ApolloSearchManager()
+    if args.persist:
+        from utils.lead_store import LeadStore
+        kwargs["lead_store"] = LeadStore()
+    if args.dedupe:
+        from utils.entity_resolution import EntityResolver
+        kwargs["entity_resolver"] = EntityResolver()
+
+    result = get_workflow(**kwargs).run(batch_number=args.batch, workflow_run_id=run_id)
+    if governor:
+        governor.close()
+    print(f"Run ID: {result['workflow_run_id']}")
+    print(f"Qualified leads: {len(result['qualified_leads'])}")
+    return 0
+
+
+def cmd_schedule(args) -> int:
+    """Plan a day's batches into workflow_schedule, rotating industry x metro"""
+    from agents.apollo_search_manager import ApolloSearchManager
+
+    manager = ApolloSearchManager()
+    industries = [name for name, _ in sorted(manager.config["us_industries"].items(),
+                                             key=lambda item: item[1].get("priority", 99))]
+    metros = list(manager.config["us_metro_areas"])
+
+    day = date.fromisoformat(args.date) if args.date else date.today()
+    start = datetime.combine(day, time(args.start_hour))
+    spacing = timedelta(hours=args.end_hour - args.start_hour) / max(args.batches, 1)
+
+    rows = []
+    for i in range(args.batches):
+        rows.append((
+            day,
+            i + 1,
+            (start + spacing * i).time(),
+            industries[i % len(industries)],
+            metros[(i // len(industries)) % len(metros)],
+            args.leads_per_workflow,
+        ))
+
+    for row in rows:
+        print(f"  batch {row[1]:>2}  {row[2].strftime('%H:%M')}  {row[3]:<20} {row[4]}")
+    if args.dry_run:
+        return 0
+
+    from utils import db
+    conn = db.get_connection()
+    try:
+        with conn.cursor() as cur:
+            db.execute_values(cur, """
+                INSERT INTO workflow_schedule (date, batch_number, scheduled_time, industry,
+                                               location, leads_per_workflow)
+                VALUES %s
+                ON CONFLICT (date, batch_number) DO NOTHING
+            """, rows)
+            inserted = cur.rowcount
+        conn.commit()
+    finally:
+        conn.close()
+
+    print(f"Scheduled {inserted} new batches for {day}")
+    return 0
+
+
+def cmd_ingest(args) -> int:
+    """Source leads through the search rotation and store them"""
+    import uuid
+    from agents.apollo_agent import ApolloAgent
+    from agents.apollo_search_manager import ApolloSearchManager
+    from agents.email_verifier import EmailVerifier
+    from utils.alerts import AlertManager
+    from utils import tracing
+    from utils.budget import BudgetGovernor
+    from utils.db import get_connection
+    from utils.lead_store import LeadStore
+
+    run_id = str(uuid.uuid4())
+    alerts = AlertManager(connection_factory=None if args.dry_run else get_connection)
+    governor = BudgetGovernor(workflow_run_id=run_id)  # credits are spent even on a dry run
+    governor.start_run(batch_number=1)
+    verifier = None if args.no_verify else EmailVerifier(governor=governor)
+    agent = ApolloAgent(governor=governor, verifier=verifier, alerts=alerts)
+    manager = ApolloSearchManager()
+    store = None if args.dry_run else LeadStore()
+
+    total = 0
+    for batch_number in range(1, args.batches + 1):
+        with tracing.run_context(run_id, batch_number), tracing.span("ingest.batch") as span:
+            params, metadata = manager.get_next_search_params()
+            priority = manager.config["us_industries"].get(metadata["industry"], {}).get("priority", 1)
+            results = agent.process_batch_of_10(params, priority=priority)
+
+            stored = len(results["qualified_leads"])
+            if store:
+                stored = store.save_batch(results["qualified_leads"], results["orgs_by_domain"],
+                                          workflow_run_id=run_id, batch_number=batch_number)
+            span.set(**metadata, stored=stored)
+        total += stored
+        print(f"Batch {batch_number}: {metadata['industry']} / {metadata['metro']} page "
+              f"{metadata['page']} -> {stored} leads")
+
+    governor.close()
+    alerts.close()
+    print(f"Ingested {total} leads (run {run_id})")
+    return 0
+
+
+def cmd_notion_sync(args) -> int:
+    """Push changed dashboard rows to Notion"""
+    from utils.notion_sync import NotionSync
+
+    summary = NotionSync(workers=args.workers).sync(args.tables)
+    failed = sum(stats.get("failed", 0) for stats in summary.values())
+    return 1 if failed else 0
+
+
+def cmd_migrate(args) -> int:
+    """Apply pending schema migrations from database/migrations"""
+    from utils.migrations import MigrationError, MigrationRunner
+
+    runner = MigrationRunner(lock_timeout=args.lock_timeout)
+    try:
+        if args.baseline is not None:
+            runner.baseline(args.baseline)
+            return 0
+        if args.dry_run:
+            for migration, status in runner.plan(args.target):
+                print(f"  {migration.path.name:<40} {status}")
+            return 0
+        runner.migrate(target=args.target)
+    except MigrationError as e:
+        print(f"Migration failed: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def cmd_export(args) -> int:
+    """Export new leads/engagement rows to partitioned Parquet files"""
+    from utils.analytics_export import AnalyticsExporter
+
+    exporter = AnalyticsExporter(output_dir=args.output_dir)
+    for table, rows in exporter.export(args.tables, full=args.full).items():
+        print(f"  {table:<20} {rows} rows")
+    return 0
+
+
+def cmd_source(args) -> int:
+    """Source leads in parallel worker processes, one shard of industry x metro each"""
+    import uuid
+    from utils.budget import BudgetGovernor
+    from utils.lead_store import LeadStore
+    from workflows.sourcing_coordinator import SourcingCoordinator
+
+    run_id = str(uuid.uuid4())
+    governor = BudgetGovernor(workflow_run_id=run_id)
+    governor.start_run(batch_number=1)
+    coordinator = SourcingCoordinator(
+        workers=args.workers,
+        pages_per_combo=args.pages,
+        rate_per_second=args.rate,
+        credit_limit=args.credits,
+        lead_store=None if args.dry_run else LeadStore(),
+        governor=governor,
+        verify_emails=not args.no_verify,
+    )
+    report = coordinator.run(workflow_run_id=run_id)
+    governor.close()
+
+    print(f"Sourced {report['unique_leads']} unique leads ({report['duplicates']} duplicates), "
+          f"stored {report['stored']} in {report['elapsed_s']}s (run {run_id})")
+    for shard_id, error in report["errors"].items():
+        print(f"  shard {shard_id} failed: {error}")
+    return 1 if report["errors"] else 0
+
+
+def cmd_dedupe(args) -> int:
+    """Link historical duplicate leads to their canonical lead"""
+    from utils.entity_resolution import EntityResolver
+
+    linked = EntityResolver().backfill()
+    print(f"Linked {linked} duplicate leads")
+    return 0
+
+
+def cmd_trace_summary(args) -> int:
+    """Summarize a trace file: time per stage and the slowest spans"""
+    from utils.tracing import summarize
+
+    summary = summarize(args.trace_file, workflow_run_id=args.run_id, top=args.top)
+    print(f"{'span':<28}{'count':>7}{'total ms':>12}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for stage in summary["stages"]:
+        print(f"{stage['name']:<28}{stage['count']:>7}{stage['total_ms']:>12.1f}"
+              f"{stage['p50_ms']:>10.1f}{stage['p95_ms']:>10.1f}{stage['max_ms']:>10.1f}")
+
+    print(f"\nSlowest {len(summary['slowest'])} spans:")
+    for record in summary["slowest"]:
+        attrs = " ".join(f"{k}={v}" for k, v in record["attrs"].items() if not isinstance(v, (list, dict)))
+        print(f"{record['duration_ms']:>10.1f} ms  {record['name']:<20} run={str(record.get('workflow_run_id'))[:8]} "
+              f"batch={record.get('batch_number')} {record['status']}  {attrs}")
+    return 0
+
+
+def cmd_bench(args) -> int:
+    """Offline throughput benchmarks (see benchmarks/throughput.py)"""
+    from benchmarks.throughput import main as bench_main
+    return bench_main(args.bench_args)
+
+
+# What each subcommand imports when it runs, including the lazy heavy dependencies
+COMMAND_IMPORTS = {
+    "run": ["workflows.outreach_workflow", "langgraph.graph", "agents.apollo_agent",
+            "agents.apollo_search_manager", "agents.email_verifier", "utils.budget",
+            "utils.lead_store", "utils.entity_resolution", "psycopg2.extras"],
+    "schedule": ["agents.apollo_search_manager", "utils.db", "psycopg2.extras"],
+    "ingest": ["agents.apollo_agent", "agents.apollo_search_manager", "agents.email_verifier",
+               "utils.alerts", "utils.tracing", "utils.budget", "utils.lead_store", "psycopg2.extras"],
+    "notion-sync": ["utils.notion_sync", "notion_client", "psycopg2.extras"],
+    "migrate": ["utils.migrations", "psycopg2.extras"],
+    "export": ["utils.analytics_export", "pyarrow.parquet", "psycopg2.extras"],
+    "source": ["utils.budget", "utils.lead_store", "workflows.sourcing_coordinator", "psycopg2.extras"],
+    "dedupe": ["utils.entity_resolution", "psycopg2.extras"],
+    "trace-summary": ["utils.tracing"],
+    "bench": ["benchmarks.throughput"],
+}
+
+
+def import_profile(argv) -> int:
+    """Import what the command would load under -X importtime and summarize the slowest imports
+
+    Only the imports run; the command itself does not, so profiling has no side effects.
+    """
+    args = build_parser().parse_args(argv)
+    modules = COMMAND_IMPORTS[args.command] + (["utils.tracing"] if args.trace or args.profile else [])
+    script = f"import cli, importlib\nfor name in {modules!r}:\n    importlib.import_module(name)"
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", script],
+                          capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    imports, other = [], []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            other.append(line)
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # column header
+        name = parts[2].rstrip()
+        imports.append((int(parts[1]), int(parts[0]), name.strip(), len(name) - len(name.lstrip())))
+
+    sys.stdout.write(proc.stdout)
+    if other:
+        sys.stderr.write("\n".join(other) + "\n")
+
+    top_level = sorted((i for i in imports if i[3] == 1), reverse=True)
+    total = sum(i[0] for i in top_level)
+    print(f"\nImport profile: {total / 1000:.1f} ms across {len(imports)} modules")
+    print(f"{'cumulative ms':>14}{'self ms':>10}  module")
+    for cumulative, self_us, name, _ in top_level[:25]:
+        print(f"{cumulative / 1000:>14.1f}{self_us / 1000:>10.1f}  {name}")
+    return proc.returncode
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Outreach workflow worker CLI")
+    parser.add_argument("--import-profile", action="store_true",
+                        help="report where the command's import time goes, without running it")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="write tracing spans as JSON lines (same as OUTREACH_TRACE_FILE)")
+    parser.add_argument("--profile", choices=["cprofile", "tracemalloc"],
+                        help="profile each workflow node (same as OUTREACH_PROFILE)")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+
+    run = subcommands.add_parser("run", help=cmd_run.__doc__)
+    run.add_argument("--batch", type=int, default=1)
+    run.add_argument("--live", action="store_true", help="source from Apollo instead of dummy leads")
+    run.add_argument("--persist", action="store_true", help="write qualified leads to the database")
+    run.add_argument("--dedupe", action="store_true", help="flag leads that match a known person")
+    run.add_argument("--no-verify", action="store_true", help="skip NeverBounce email verification")
+    run.set_defaults(func=cmd_run)
+
+    schedule = subcommands.add_parser("schedule", help=cmd_schedule.__doc__)
+    schedule.add_argument("--date", help="YYYY-MM-DD, defaults to today")
+    schedule.add_argument("--batches", type=int, default=8)
+    schedule.add_argument("--start-hour", type=int, default=8)
+    schedule.add_argument("--end-hour", type=int, default=18)
+    schedule.add_argument("--leads-per-workflow", type=int, default=30)
+    schedule.add_argument("--dry-run", action="store_true")
+    schedule.set_defaults(func=cmd_schedule)
+
+    ingest = subcommands.add_parser("ingest", help=cmd_ingest.__doc__)
+    ingest.add_argument("--batches", type=int, default=1)
+    ingest.add_argument("--dry-run", action="store_true", help="source but don't store")
+    ingest.add_argument("--no-verify", action="store_true", help="skip NeverBounce email verification")
+    ingest.set_defaults(func=cmd_ingest)
+
+    notion_sync = subcommands.add_parser("notion-sync", help=cmd_notion_sync.__doc__)
+    notion_sync.add_argument("--tables", nargs="+", help="defaults to every configured table")
+    notion_sync.add_argument("--workers", type=int, default=3)
+    notion_sync.set_defaults(func=cmd_notion_sync)
+
+    migrate = subcommands.add_parser("migrate", help=cmd_migrate.__doc__)
+    migrate.add_argument("--dry-run", action="store_true", help="print the plan without applying")
+    migrate.add_argument("--target", type=int, help="stop after this version")
+    migrate.add_argument("--baseline", type=int, metavar="VERSION",
+                         help="mark migrations up to VERSION as applied without running them")
+    migrate.add_argument("--lock-timeout", default="5s")
+    migrate.set_defaults(func=cmd_migrate)
+
+    export = subcommands.add_parser("export", help=cmd_export.__doc__)
+    export.add_argument("--tables", nargs="+", help="defaults to every configured table")
+    export.add_argument("--output-dir", default="exports")
+    export.add_argument("--full", action="store_true", help="ignore watermarks and export everything")
+    export.set_defaults(func=cmd_export)
+
+    source = subcommands.add_parser("source", help=cmd_source.__doc__)
+    source.add_argument("--workers", type=int, default=4)
+    source.add_argument("--pages", type=int, default=1, help="pages per industry x metro combination")
+    source.add_argument("--rate", type=float, default=5.0, help="Apollo requests/sec across all workers")
+    source.add_argument("--credits", type=int,
+                        help="credit cap for this run (default: what is left of today's budget)")
+    source.add_argument("--dry-run", action="store_true", help="source but don't store")
+    source.add_argument("--no-verify", action="store_true", help="skip NeverBounce email verification")
+    source.set_defaults(func=cmd_source)
+
+    dedupe = subcommands.add_parser("dedupe", help=cmd_dedupe.__doc__)
+    dedupe.set_defaults(func=cmd_dedupe)
+
+    trace_summary = subcommands.add_parser("trace-summary", help=cmd_trace_summary.__doc__)
+    trace_summary.add_argument("trace_file")
+    trace_summary.add_argument("--run-id", help="only spans from this workflow run")
+    trace_summary.add_argument("--top", type=int, default=10, help="number of slowest spans to list")
+    trace_summary.set_defaults(func=cmd_trace_summary)
+
+    bench = subcommands.add_parser("bench", help=cmd_bench.__doc__, add_help=False)
+    bench.add_argument("bench_args", nargs=argparse.REMAINDER)
+    bench.set_defaults(func=cmd_bench)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if "--import-profile" in argv:
+        return import_profile([arg for arg in argv if arg != "--import-profile"])
+
+    args = build_parser().parse_args(argv)
+    if args.trace or args.profile:
+        from utils import tracing
+        # Also exported to the environment, so spawned sourcing workers trace too
+        tracing.configure(trace_file=args.trace or os.getenv("OUTREACH_TRACE_FILE"),
+                          profile=args.profile or os.getenv("OUTREACH_PROFILE"))
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
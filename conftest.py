@@ -0,0 +1,14 @@
+﻿import pytest
+
+from testing import fake_db
+
+# Connection checks against the live services, run by hand with python
+collect_ignore = ["test_apollo_simple.py", "test_db.py", "test_notion.py"]
+
+
+@pytest.fixture
+def fake_execute_values(monkeypatch):
+    """Route utils.db.execute_values through the fake connection's handler"""
+    from utils import db
+    monkeypatch.setattr(db, "execute_values", fake_db.execute_values, raising=False)
+    return fake_db.execute_values
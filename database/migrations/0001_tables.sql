@@ -1,14 +1,4 @@
--- On Pulse Solutions Outreach System
--- Complete Database Schema v1.1 - Fixed Order
--- Last Updated: 2024
-
--- Drop existing schema if needed (uncomment to use)
--- DROP SCHEMA public CASCADE;
--- CREATE SCHEMA public;
-
--- =====================================================
--- PART 1: CREATE ALL TABLES (NO INDEXES YET)
--- =====================================================
+-- Core tables
 
 -- 1. Main leads table
 CREATE TABLE IF NOT EXISTS leads (
@@ -372,189 +362,3 @@ CREATE TABLE IF NOT EXISTS api_usage_tracking (
     created_at TIMESTAMP DEFAULT NOW(),
     UNIQUE(date, api_provider)
 );
-
--- =====================================================
--- PART 2: CREATE ALL VIEWS
--- =====================================================
-
-CREATE OR REPLACE VIEW active_sequence_leads AS
-SELECT 
-    l.lead_id,
-    l.email,
-    l.company_name,
-    l.sequence_position,
-    l.next_email_date,
-    l.campaign_angle,
-    cp.guidelines
-FROM leads l
-LEFT JOIN campaign_playbooks cp ON 
-    cp.campaign_angle = l.campaign_angle 
-    AND cp.email_position = l.sequence_position + 1
-    AND cp.status = 'validated'
-WHERE l.sequence_status = 'active'
-    AND l.next_email_date <= CURRENT_DATE;
-
-CREATE OR REPLACE VIEW todays_sending_queue AS
-SELECT 
-    COUNT(*) as total_to_send,
-    campaign_angle,
-    sequence_position,
-    COUNT(*) as count_at_position
-FROM leads
-WHERE sequence_status = 'active'
-    AND next_email_date = CURRENT_DATE
-GROUP BY campaign_angle, sequence_position
-ORDER BY sequence_position;
-
-CREATE OR REPLACE VIEW campaign_performance_trends AS
-SELECT 
-    date,
-    campaign_angle,
-    SUM(emails_sent) as total_sent,
-    AVG(open_rate) as avg_open_rate,
-    AVG(reply_rate) as avg_reply_rate,
-    AVG(positive_rate) as avg_positive_rate,
-    SUM(evgp_conversions) as total_conversions
-FROM campaign_performance
-WHERE date >= CURRENT_DATE - INTERVAL '30 days'
-GROUP BY date, campaign_angle
-ORDER BY date DESC, campaign_angle;
-
--- =====================================================
--- PART 3: CREATE ALL FUNCTIONS
--- =====================================================
-
-CREATE OR REPLACE FUNCTION update_updated_at_column()
-RETURNS TRIGGER AS $$
-BEGIN
-    NEW.updated_at = NOW();
-    RETURN NEW;
-END;
-$$ LANGUAGE plpgsql;
-
-CREATE OR REPLACE FUNCTION calculate_next_email_date(
-    current_position INTEGER,
-    last_sent TIMESTAMP
-) RETURNS DATE AS $$
-BEGIN
-    IF current_position <= 4 THEN
-        RETURN DATE(last_sent) + INTERVAL '3 days';
-    ELSE
-        RETURN DATE(last_sent) + INTERVAL '4 days';
-    END IF;
-END;
-$$ LANGUAGE plpgsql;
-
--- =====================================================
--- PART 4: CREATE ALL TRIGGERS
--- =====================================================
-
-DROP TRIGGER IF EXISTS update_leads_updated_at ON leads;
-CREATE TRIGGER update_leads_updated_at 
-    BEFORE UPDATE ON leads
-    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
-
-DROP TRIGGER IF EXISTS update_campaign_performance_updated_at ON campaign_performance;
-CREATE TRIGGER update_campaign_performance_updated_at 
-    BEFORE UPDATE ON campaign_performance
-    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
-
-DROP TRIGGER IF EXISTS update_playbooks_updated_at ON campaign_playbooks;
-CREATE TRIGGER update_playbooks_updated_at 
-    BEFORE UPDATE ON campaign_playbooks
-    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
-
-DROP TRIGGER IF EXISTS update_schedule_updated_at ON workflow_schedule;
-CREATE TRIGGER update_schedule_updated_at 
-    BEFORE UPDATE ON workflow_schedule
-    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
-
--- =====================================================
--- PART 5: CREATE ALL INDEXES
--- =====================================================
-
--- Leads table indexes
-CREATE INDEX IF NOT EXISTS idx_leads_email ON leads(email);
-CREATE INDEX IF NOT EXISTS idx_leads_domain ON leads(domain);
-CREATE INDEX IF NOT EXISTS idx_leads_icp ON leads(icp_score);
-CREATE INDEX IF NOT EXISTS idx_leads_campaign ON leads(campaign_angle);
-CREATE INDEX IF NOT EXISTS idx_leads_sequence ON leads(sequence_status, next_email_date);
-CREATE INDEX IF NOT EXISTS idx_leads_workflow ON leads(workflow_run_id);
-
--- Search history indexes
-CREATE INDEX IF NOT EXISTS idx_search_hash ON search_history(search_hash);
-CREATE INDEX IF NOT EXISTS idx_search_params ON search_history(industry, location, page_number);
-
--- Suppression list indexes
-CREATE INDEX IF NOT EXISTS idx_suppression_email ON suppression_list(email);
-CREATE INDEX IF NOT EXISTS idx_suppression_domain ON suppression_list(domain);
-CREATE INDEX IF NOT EXISTS idx_suppression_company ON suppression_list(company_name);
-
--- Override rules indexes
-CREATE INDEX IF NOT EXISTS idx_override_lookup ON override_rules(scope, value);
-CREATE INDEX IF NOT EXISTS idx_override_type ON override_rules(rule_type);
-
--- Campaign performance indexes
-CREATE INDEX IF NOT EXISTS idx_campaign_perf_date ON campaign_performance(date, campaign_angle);
-
--- Playbook indexes
-CREATE INDEX IF NOT EXISTS idx_playbook_lookup ON campaign_playbooks(campaign_angle, email_position, status);
-
--- Email engagement indexes
-CREATE INDEX IF NOT EXISTS idx_engagement_lead ON email_engagement(lead_id);
-CREATE INDEX IF NOT EXISTS idx_engagement_replied ON email_engagement(replied_at);
-CREATE INDEX IF NOT EXISTS idx_engagement_campaign ON email_engagement(campaign_angle, email_position);
-
--- Reply classification indexes
-CREATE INDEX IF NOT EXISTS idx_reply_lead ON reply_classifications(lead_id);
-CREATE INDEX IF NOT EXISTS idx_reply_action ON reply_classifications(next_action, priority_level);
-CREATE INDEX IF NOT EXISTS idx_reply_interest ON reply_classifications(interest_level);
-
--- Workflow indexes
-CREATE INDEX IF NOT EXISTS idx_workflow_date ON workflow_runs(date, batch_number);
-CREATE INDEX IF NOT EXISTS idx_workflow_status ON workflow_runs(status);
-CREATE INDEX IF NOT EXISTS idx_cost_date ON workflow_costs(date);
-CREATE INDEX IF NOT EXISTS idx_cost_workflow ON workflow_costs(workflow_run_id);
-CREATE INDEX IF NOT EXISTS idx_schedule_date ON workflow_schedule(date, scheduled_time);
-CREATE INDEX IF NOT EXISTS idx_schedule_status ON workflow_schedule(status);
-
--- Cache indexes
-CREATE INDEX IF NOT EXISTS idx_research_cache ON industry_research_cache(industry, location);
-CREATE INDEX IF NOT EXISTS idx_research_expiry ON industry_research_cache(expires_at);
-CREATE INDEX IF NOT EXISTS idx_company_domain ON company_intelligence_cache(domain);
-CREATE INDEX IF NOT EXISTS idx_company_expiry ON company_intelligence_cache(expires_at);
-
--- System indexes
-CREATE INDEX IF NOT EXISTS idx_alert_unresolved ON system_alerts(resolved, severity);
-CREATE INDEX IF NOT EXISTS idx_alert_type ON system_alerts(alert_type, component);
-CREATE INDEX IF NOT EXISTS idx_usage_date ON api_usage_tracking(date);
-
--- Composite/partial indexes
-CREATE INDEX IF NOT EXISTS idx_leads_active_sequence 
-    ON leads(sequence_status, next_email_date) 
-    WHERE sequence_status = 'active';
-
-CREATE INDEX IF NOT EXISTS idx_engagement_recent 
-    ON email_engagement(sent_at) 
-    WHERE sent_at >= CURRENT_DATE - INTERVAL '7 days';
-
-CREATE INDEX IF NOT EXISTS idx_replies_pending 
-    ON reply_classifications(next_action, priority_level) 
-    WHERE next_action IN ('follow_up', 'notify_founder', 'book_meeting');
-
--- =====================================================
--- PART 6: INSERT INITIAL DATA
--- =====================================================
-
-INSERT INTO thompson_sampling_weights (date, campaign_angle, successes, failures, current_weight)
-VALUES 
-    (CURRENT_DATE, 'fear', 1, 1, 0.20),
-    (CURRENT_DATE, 'legacy', 1, 1, 0.20),
-    (CURRENT_DATE, 'peer', 1, 1, 0.20),
-    (CURRENT_DATE, 'authority', 1, 1, 0.20),
-    (CURRENT_DATE, 'diagnostic', 1, 1, 0.20)
-ON CONFLICT DO NOTHING;
-
--- =====================================================
--- SCHEMA COMPLETE
--- =====================================================
\ No newline at end of file
@@ -0,0 +1,44 @@
+-- Reporting and sending views
+
+CREATE OR REPLACE VIEW active_sequence_leads AS
+SELECT 
+    l.lead_id,
+    l.email,
+    l.company_name,
+    l.sequence_position,
+    l.next_email_date,
+    l.campaign_angle,
+    cp.guidelines
+FROM leads l
+LEFT JOIN campaign_playbooks cp ON 
+    cp.campaign_angle = l.campaign_angle 
+    AND cp.email_position = l.sequence_position + 1
+    AND cp.status = 'validated'
+WHERE l.sequence_status = 'active'
+    AND l.next_email_date <= CURRENT_DATE;
+
+CREATE OR REPLACE VIEW todays_sending_queue AS
+SELECT 
+    COUNT(*) as total_to_send,
+    campaign_angle,
+    sequence_position,
+    COUNT(*) as count_at_position
+FROM leads
+WHERE sequence_status = 'active'
+    AND next_email_date = CURRENT_DATE
+GROUP BY campaign_angle, sequence_position
+ORDER BY sequence_position;
+
+CREATE OR REPLACE VIEW campaign_performance_trends AS
+SELECT 
+    date,
+    campaign_angle,
+    SUM(emails_sent) as total_sent,
+    AVG(open_rate) as avg_open_rate,
+    AVG(reply_rate) as avg_reply_rate,
+    AVG(positive_rate) as avg_positive_rate,
+    SUM(evgp_conversions) as total_conversions
+FROM campaign_performance
+WHERE date >= CURRENT_DATE - INTERVAL '30 days'
+GROUP BY date, campaign_angle
+ORDER BY date DESC, campaign_angle;
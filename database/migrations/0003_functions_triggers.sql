@@ -0,0 +1,42 @@
+-- Functions and updated_at triggers
+
+CREATE OR REPLACE FUNCTION update_updated_at_column()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at = NOW();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION calculate_next_email_date(
+    current_position INTEGER,
+    last_sent TIMESTAMP
+) RETURNS DATE AS $$
+BEGIN
+    IF current_position <= 4 THEN
+        RETURN DATE(last_sent) + INTERVAL '3 days';
+    ELSE
+        RETURN DATE(last_sent) + INTERVAL '4 days';
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS update_leads_updated_at ON leads;
+CREATE TRIGGER update_leads_updated_at 
+    BEFORE UPDATE ON leads
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+DROP TRIGGER IF EXISTS update_campaign_performance_updated_at ON campaign_performance;
+CREATE TRIGGER update_campaign_performance_updated_at 
+    BEFORE UPDATE ON campaign_performance
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+DROP TRIGGER IF EXISTS update_playbooks_updated_at ON campaign_playbooks;
+CREATE TRIGGER update_playbooks_updated_at 
+    BEFORE UPDATE ON campaign_playbooks
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+DROP TRIGGER IF EXISTS update_schedule_updated_at ON workflow_schedule;
+CREATE TRIGGER update_schedule_updated_at 
+    BEFORE UPDATE ON workflow_schedule
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
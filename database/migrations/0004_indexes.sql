@@ -0,0 +1,73 @@
+-- migrate: no-transaction
+-- Built CONCURRENTLY so writes to populated tables are not blocked.
+-- CONCURRENTLY cannot run inside a transaction block; the runner executes
+-- each statement on its own and drops invalid leftovers of failed builds.
+
+-- Leads table indexes
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_leads_email ON leads(email);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_leads_domain ON leads(domain);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_leads_icp ON leads(icp_score);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_leads_campaign ON leads(campaign_angle);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_leads_sequence ON leads(sequence_status, next_email_date);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_leads_workflow ON leads(workflow_run_id);
+
+-- Search history indexes
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_search_hash ON search_history(search_hash);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_search_params ON search_history(industry, location, page_number);
+
+-- Suppression list indexes
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_suppression_email ON suppression_list(email);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_suppression_domain ON suppression_list(domain);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_suppression_company ON suppression_list(company_name);
+
+-- Override rules indexes
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_override_lookup ON override_rules(scope, value);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_override_type ON override_rules(rule_type);
+
+-- Campaign performance indexes
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_campaign_perf_date ON campaign_performance(date, campaign_angle);
+
+-- Playbook indexes
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_playbook_lookup ON campaign_playbooks(campaign_angle, email_position, status);
+
+-- Email engagement indexes
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_engagement_lead ON email_engagement(lead_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_engagement_replied ON email_engagement(replied_at);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_engagement_campaign ON email_engagement(campaign_angle, email_position);
+
+-- Reply classification indexes
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reply_lead ON reply_classifications(lead_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reply_action ON reply_classifications(next_action, priority_level);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reply_interest ON reply_classifications(interest_level);
+
+-- Workflow indexes
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_workflow_date ON workflow_runs(date, batch_number);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_workflow_status ON workflow_runs(status);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_cost_date ON workflow_costs(date);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_cost_workflow ON workflow_costs(workflow_run_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_schedule_date ON workflow_schedule(date, scheduled_time);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_schedule_status ON workflow_schedule(status);
+
+-- Cache indexes
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_research_cache ON industry_research_cache(industry, location);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_research_expiry ON industry_research_cache(expires_at);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_company_domain ON company_intelligence_cache(domain);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_company_expiry ON company_intelligence_cache(expires_at);
+
+-- System indexes
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_alert_unresolved ON system_alerts(resolved, severity);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_alert_type ON system_alerts(alert_type, component);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_usage_date ON api_usage_tracking(date);
+
+-- Composite/partial indexes
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_leads_active_sequence 
+    ON leads(sequence_status, next_email_date) 
+    WHERE sequence_status = 'active';
+
+-- Not partial: a CURRENT_DATE predicate is not immutable, so Postgres rejects it
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_engagement_recent 
+    ON email_engagement(sent_at);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_replies_pending 
+    ON reply_classifications(next_action, priority_level) 
+    WHERE next_action IN ('follow_up', 'notify_founder', 'book_meeting');
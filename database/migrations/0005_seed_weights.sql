@@ -0,0 +1,10 @@
+-- Seed Thompson Sampling weights
+
+INSERT INTO thompson_sampling_weights (date, campaign_angle, successes, failures, current_weight)
+VALUES 
+    (CURRENT_DATE, 'fear', 1, 1, 0.20),
+    (CURRENT_DATE, 'legacy', 1, 1, 0.20),
+    (CURRENT_DATE, 'peer', 1, 1, 0.20),
+    (CURRENT_DATE, 'authority', 1, 1, 0.20),
+    (CURRENT_DATE, 'diagnostic', 1, 1, 0.20)
+ON CONFLICT DO NOTHING;
@@ -0,0 +1,4 @@
+-- Entity resolution: duplicates point at their canonical lead (NULL = canonical itself).
+-- Nullable with no default, so this is a catalog-only change on a populated table.
+
+ALTER TABLE leads ADD COLUMN IF NOT EXISTS canonical_lead_id UUID;
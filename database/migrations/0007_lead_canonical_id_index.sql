@@ -0,0 +1,5 @@
+-- migrate: no-transaction
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_leads_canonical
+    ON leads(canonical_lead_id)
+    WHERE canonical_lead_id IS NOT NULL;
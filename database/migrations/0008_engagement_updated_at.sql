@@ -0,0 +1,11 @@
+-- email_engagement rows change after they are created (opens, clicks, replies),
+-- so incremental exports watermark on updated_at rather than created_at.
+-- NOW() is evaluated once for the existing rows, so this is a catalog-only
+-- change; those rows are exported once more on the next run.
+
+ALTER TABLE email_engagement ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT NOW();
+
+DROP TRIGGER IF EXISTS update_email_engagement_updated_at ON email_engagement;
+CREATE TRIGGER update_email_engagement_updated_at
+    BEFORE UPDATE ON email_engagement
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
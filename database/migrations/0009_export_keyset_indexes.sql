@@ -0,0 +1,6 @@
+-- migrate: no-transaction
+-- Keyset indexes for the incremental analytics export, which reads
+-- WHERE (updated_at, key) > (...) ORDER BY updated_at, key.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_leads_export_keyset ON leads(updated_at, lead_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_engagement_export_keyset ON email_engagement(updated_at, engagement_id);
@@ -0,0 +1,8 @@
+-- migrate: no-transaction
+-- Entity resolution looks up candidate leads by email, domain and, for
+-- companies known only by name, company_name. Partial, so it only covers
+-- the few leads without a domain.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_leads_company_name_no_domain
+    ON leads(company_name)
+    WHERE domain IS NULL;
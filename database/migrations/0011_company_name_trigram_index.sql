@@ -0,0 +1,8 @@
+-- migrate: no-transaction
+-- Entity resolution finds known companies with a name similar to a batch's
+-- through a trigram index, instead of loading every company per process.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_company_name_trgm
+    ON company_intelligence_cache USING gin (lower(company_name) gin_trgm_ops);
@@ -1,14 +1,14 @@
 ﻿#!/usr/bin/env python3
 """
 On Pulse Solutions - Database Deployment Script
-Python version for deploying the complete outreach database schema
+Applies pending migrations from database/migrations (see utils/migrations.py)
 """
 
+import argparse
 import psycopg2
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 import os
 from dotenv import load_dotenv
-from pathlib import Path
 import sys
 from getpass import getpass
 
@@ -33,7 +33,7 @@ def print_warning(msg):
 def print_error(msg):
     print(f"{Colors.RED}✗ {msg}{Colors.ENDC}")
 
-def main():
+def main(dry_run: bool = False):
     # Banner
     print_info("\n" + "="*60)
     print_info("     On Pulse Solutions - Database Deployment")
@@ -104,46 +104,39 @@ def main():
             print("  4. Ensure user has proper permissions")
             return 1
     
-    # Check for schema file
-    schema_file = Path('database/complete_schema.sql')
-    if not schema_file.exists():
-        print_warning("\nSchema file not found at database/complete_schema.sql")
-        
-        # Check if the artifact content should be saved
-        print_info("\nTo deploy the schema:")
-        print("  1. Create directory: mkdir database")
-        print("  2. Save the schema artifact content to: database/complete_schema.sql")
-        print("  3. Run this script again")
-        
-        # Offer to create directory
-        if not Path('database').exists():
-            create_dir = input("\nCreate 'database' directory now? (y/n): ").lower()
-            if create_dir == 'y':
-                Path('database').mkdir(exist_ok=True)
-                print_success("Directory created!")
-                print("\nNow save the schema artifact to: database/complete_schema.sql")
+    # Plan migrations
+    from utils.migrations import MigrationError, MigrationRunner
+
+    runner = MigrationRunner(connection_factory=lambda: psycopg2.connect(**config))
+    if not runner.discover():
+        print_error("No migrations found in database/migrations")
         return 1
-    
+
+    print_info("\nMigration plan:")
+    try:
+        plan = runner.plan()
+    except Exception as e:
+        print_error(f"Could not read schema_migrations: {e}")
+        return 1
+    for migration, status in plan:
+        print(f"  {migration.path.name:<40} {status}")
+
+    if dry_run:
+        print_info("\nDry run, nothing applied.")
+        return 0
+
     # Deploy schema
     print_info("\n" + "="*60)
-    print_info("Starting database deployment...")
+    print_info("Applying pending migrations...")
     print_info("="*60)
     
     try:
+        applied = runner.migrate()
+        print_success(f"Applied {len(applied)} migration(s)")
+        
         conn = psycopg2.connect(**config)
         cur = conn.cursor()
         
-        # Read and execute schema
-        print_info("\nExecuting schema file...")
-        with open(schema_file, 'r') as f:
-            schema_sql = f.read()
-        
-        # Execute the entire schema
-        cur.execute(schema_sql)
-        conn.commit()
-        
-        print_success("Schema deployed successfully!")
-        
         # Verify tables
         print_info("\nVerifying tables...")
         cur.execute("""
@@ -256,40 +249,20 @@ def main():
         print_success("\n✓ All done!")
         return 0
         
-    except Exception as e:
+    except MigrationError as e:
         print_error(f"\nDeployment failed: {e}")
         print_warning("\nThe error above may indicate:")
-        print("  - Syntax error in schema file")
+        print("  - Syntax error in a migration file")
         print("  - Permission issues")
-        print("  - Existing tables conflicting")
-        
-        # Offer to drop and recreate
-        if "already exists" in str(e):
-            print_warning("\nSome tables already exist.")
-            drop = input("Drop all tables and start fresh? (y/n): ").lower()
-            if drop == 'y':
-                try:
-                    conn = psycopg2.connect(**config)
-                    cur = conn.cursor()
-                    
-                    # Drop all tables CASCADE
-                    cur.execute("""
-                        DROP SCHEMA public CASCADE;
-                        CREATE SCHEMA public;
-                        GRANT ALL ON SCHEMA public TO postgres;
-                        GRANT ALL ON SCHEMA public TO public;
-                    """)
-                    conn.commit()
-                    cur.close()
-                    conn.close()
-                    
-                    print_success("Schema reset complete!")
-                    print("Run the script again to deploy fresh schema.")
-                    
-                except Exception as drop_error:
-                    print_error(f"Failed to reset schema: {drop_error}")
-        
+        print("  - A lock_timeout on a busy table (rerun when traffic is lower)")
+        print("Migrations applied before the failure are recorded; rerunning continues from there.")
+        return 1
+    
+    except Exception as e:
+        print_error(f"\nDeployment failed: {e}")
         return 1
 
 if __name__ == "__main__":
-    sys.exit(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations")
+    parser.add_argument("--dry-run", action="store_true", help="show the migration plan only")
+    sys.exit(main(dry_run=parser.parse_args().dry_run))
\ No newline at end of file
@@ -0,0 +1,67 @@
+﻿from datetime import datetime, timedelta
+
+from testing.fake_db import FakeConnection
+from utils.alerts import AlertManager, alert_fingerprint
+
+SWEEP = "WHERE resolved = FALSE AND details ? 'fingerprint'"
+
+
+class FakeAlertsTable:
+    def __init__(self):
+        self.connections = []
+
+    def handler(self, sql, params):
+        if "INSERT INTO system_alerts" in sql:
+            return [(row[-1].adapted["fingerprint"], f"alert-{i}") for i, row in enumerate(params)]
+        if "UPDATE system_alerts" in sql:
+            return 0
+
+    def connect(self):
+        conn = FakeConnection(self.handler)
+        self.connections.append(conn)
+        return conn
+
+    def executed(self, fragment):
+        return [stmt for conn in self.connections for stmt in conn.executed(fragment)]
+
+
+def test_fingerprint_ignores_variable_parts():
+    first = alert_fingerprint("api_error", "apollo", "HTTP 503 for https://api.apollo.io/v1/x after 3 tries")
+    second = alert_fingerprint("api_error", "apollo", "HTTP 502 for https://api.apollo.io/v1/y after 4 tries")
+    assert first == second
+
+
+def test_repeats_fold_into_one_row(fake_execute_values):
+    table = FakeAlertsTable()
+    alerts = AlertManager(connection_factory=table.connect)
+
+    for attempt in range(5):
+        alerts.report("api_error", "apollo", f"Apollo returned 503 on attempt {attempt}")
+    alerts.close()
+
+    (_, rows), = table.executed("INSERT INTO system_alerts")
+    assert len(rows) == 1 and rows[0][-1].adapted["count"] == 5
+
+
+def test_close_sweeps_alerts_left_open_by_exited_processes(fake_execute_values):
+    table = FakeAlertsTable()
+    alerts = AlertManager(resolve_after=600, connection_factory=table.connect)
+
+    alerts.close()
+
+    (_, (note, cutoff)), = table.executed(SWEEP)
+    assert "600s" in note
+    assert abs(datetime.now() - timedelta(seconds=600) - cutoff) < timedelta(seconds=5)
+
+
+def test_sweep_is_throttled(fake_execute_values):
+    table = FakeAlertsTable()
+    alerts = AlertManager(sweep_interval=300, connection_factory=table.connect)
+
+    alerts.flush()
+    alerts.flush()
+
+    assert len(table.executed(SWEEP)) == 1
+    alerts._next_sweep = datetime.now()
+    alerts.flush()
+    assert len(table.executed(SWEEP)) == 2
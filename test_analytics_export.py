@@ -0,0 +1,54 @@
+﻿import json
+from datetime import datetime, timedelta
+
+import pyarrow.parquet as pq
+
+from testing.fake_db import FakeConnection
+from utils.analytics_export import AnalyticsExporter
+from utils.migrations import MigrationRunner
+
+SPEC = {"key": "engagement_id", "watermark": "updated_at",
+        "columns": {"engagement_id": "string", "open_count": "int", "updated_at": "timestamp"}}
+
+
+def make_exporter(tmp_path, rows):
+    config = tmp_path / "export.json"
+    config.write_text(json.dumps({"batch_size": 2, "tables": {"email_engagement": SPEC}}))
+    conn = FakeConnection(lambda sql, params: rows)
+    exporter = AnalyticsExporter(config_path=str(config), output_dir=str(tmp_path / "exports"),
+                                 watermark_file=str(tmp_path / "watermarks.json"),
+                                 connection_factory=lambda: conn)
+    return exporter, conn
+
+
+def test_keyset_compares_the_native_key(tmp_path):
+    exporter, _ = make_exporter(tmp_path, [])
+
+    query, params = exporter.build_query("email_engagement", SPEC, {"value": "2026-10-01T00:00:00", "key": "e1"})
+
+    assert "(email_engagement.updated_at, email_engagement.engagement_id) > (%s::timestamp, %s)" in query
+    # The output column engagement_id is a ::text cast; ordering must use the table column
+    assert query.rstrip().endswith("ORDER BY email_engagement.updated_at, email_engagement.engagement_id")
+    assert params == (300, "2026-10-01T00:00:00", "e1")
+
+
+def test_export_writes_day_partitions_and_saves_watermark(tmp_path):
+    day = datetime(2026, 10, 1, 12)
+    rows = [("e1", 1, day), ("e2", 0, day + timedelta(minutes=1)), ("e3", 2, day + timedelta(days=1))]
+    exporter, conn = make_exporter(tmp_path, rows)
+
+    assert exporter.export_table("email_engagement") == 3
+
+    files = sorted((tmp_path / "exports" / "email_engagement").glob("dt=*/*.parquet"))
+    assert [path.parent.name for path in files] == ["dt=2026-10-01", "dt=2026-10-02"]
+    assert pq.read_table(files[0]).num_rows == 2
+    assert exporter.watermarks["email_engagement"] == {"value": "2026-10-02T12:00:00", "key": "e3"}
+    assert conn.session == {"readonly": True}
+
+
+def test_keyset_index_migration_runs_concurrently():
+    migrations = {m.version: m for m in MigrationRunner().discover()}
+
+    assert not migrations[9].transactional
+    assert all("CONCURRENTLY" in statement for statement in migrations[9].statements())
+    assert "email_engagement(updated_at, engagement_id)" in migrations[9].sql
@@ -0,0 +1,44 @@
+﻿from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+from agents.apollo_agent import ApolloAgent, retry_after_seconds
+from testing.fake_apollo import FakeApolloServer
+from workflows.outreach_workflow import OutreachWorkflow
+
+
+class RateLimitOnceServer(FakeApolloServer):
+    """Rate-limits the first request with an HTTP-date Retry-After, then serves normally"""
+
+    def handle(self, method, path, query, body):
+        if not self.requests["total"]:
+            self.requests["total"] += 1
+            return 429, {"error": "rate limit exceeded"}, {"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}
+        return super().handle(method, path, query, body)
+
+
+def test_retry_after_seconds_forms():
+    assert retry_after_seconds("2") == 2.0
+    assert retry_after_seconds(None) is None
+    assert retry_after_seconds("soon") is None
+    assert retry_after_seconds("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+    later = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=60), usegmt=True)
+    assert 55 < retry_after_seconds(later) <= 60
+
+
+def test_post_retries_http_date_retry_after():
+    with RateLimitOnceServer() as server:
+        agent = ApolloAgent(base_url=server.url, backoff=60)
+        response = agent._post("mixed_people/search", agent.search_url, params={"page": 1, "per_page": 5})
+
+    assert response.status_code == 200
+    assert len(response.json()["people"]) == 5
+
+
+def test_source_leads_without_params_or_manager():
+    workflow = OutreachWorkflow(apollo_agent=object())
+
+    with pytest.raises(ValueError, match="search_manager"):
+        workflow.source_leads({"batch_number": 1, "metrics": {}})
@@ -0,0 +1,144 @@
+﻿import json
+from datetime import date
+
+import pytest
+
+from testing.fake_db import FakeConnection
+from utils.budget import BudgetGovernor
+
+CONFIG = {
+    "soft_limit_ratio": 0.8,
+    "flush_interval_seconds": 3600,
+    "providers": {
+        "apollo": {
+            "daily_credit_limit": 10,
+            "cost_per_credit": 0.5,
+            "operation_credits": {"search": 0, "enrich_person": 1},
+            "workflow_cost_columns": {"enrich_person": "apollo_enrichments", "cost": "apollo_costs"},
+        }
+    },
+}
+
+
+@pytest.fixture
+def config_path(tmp_path):
+    path = tmp_path / "budget_config.json"
+    path.write_text(json.dumps(CONFIG))
+    return str(path)
+
+
+class FakeDatabase:
+    """api_usage_tracking totals plus an optional workflow_runs row"""
+
+    def __init__(self, run_exists=False, fail_costs=False):
+        self.credits = 0
+        self.run_exists = run_exists
+        self.fail_costs = fail_costs
+        self.connections = []
+
+    def handler(self, sql, params):
+        if "INSERT INTO api_usage_tracking" in sql:
+            self.credits += sum(row[-1] for row in params)
+        elif "FROM api_usage_tracking" in sql:
+            return [("apollo", self.credits)]
+        elif "INSERT INTO workflow_runs" in sql:
+            self.run_exists = True
+        elif "FROM workflow_runs" in sql:
+            return [(1,)] if self.run_exists else []
+        elif "workflow_costs" in sql:
+            if self.fail_costs:
+                raise RuntimeError("insert or update on workflow_costs violates foreign key")
+            return [("cost-1",)]
+
+    def connect(self):
+        conn = FakeConnection(self.handler)
+        self.connections.append(conn)
+        return conn
+
+    def statements(self, fragment):
+        return [stmt for conn in self.connections for stmt in conn.executed(fragment)]
+
+
+def spend(governor, units):
+    reservation = governor.reserve("apollo", "enrich_person", units)
+    governor.settle(reservation, units)
+
+
+def test_reserve_denies_past_daily_limit(config_path):
+    governor = BudgetGovernor(config_path, connection_factory=None)
+    spend(governor, 8)
+
+    assert governor.reserve("apollo", "enrich_person", 3) is None
+    assert governor.reserve("apollo", "search", 5) is not None  # searches cost no credits
+    assert governor.should_skip("apollo", priority=2) and not governor.should_skip("apollo", priority=1)
+    assert governor.recommended_concurrency("apollo", 8) == 8
+    spend(governor, 1)
+    assert governor.recommended_concurrency("apollo", 8) == 4
+
+
+def test_missing_run_row_keeps_usage_and_buffers_costs(config_path, fake_execute_values):
+    database = FakeDatabase(run_exists=False)
+    governor = BudgetGovernor(config_path, workflow_run_id="run-1", connection_factory=database.connect)
+    spend(governor, 3)
+
+    governor.flush()
+    governor.flush()
+
+    assert database.credits == 3
+    assert len(database.statements("INSERT INTO api_usage_tracking")) == 1
+    assert not database.statements("INSERT INTO workflow_costs")
+    assert governor.remaining_credits("apollo") == 7
+
+    database.run_exists = True
+    governor.flush()
+    (sql, params), = database.statements("INSERT INTO workflow_costs")
+    assert params[0] == "run-1" and 3 in params
+
+
+def test_workflow_costs_failure_does_not_roll_back_usage(config_path, fake_execute_values):
+    database = FakeDatabase(run_exists=True, fail_costs=True)
+    governor = BudgetGovernor(config_path, workflow_run_id="run-1", connection_factory=database.connect)
+    spend(governor, 2)
+
+    governor.flush()
+    governor.flush()
+
+    assert database.credits == 2
+    assert database.connections[0].commits == 1
+    assert len(database.statements("INSERT INTO api_usage_tracking")) == 1
+
+
+def test_record_adds_externally_metered_usage(config_path, fake_execute_values):
+    database = FakeDatabase()
+    governor = BudgetGovernor(config_path, connection_factory=database.connect)
+
+    governor.record("apollo", "enrich_person", 4, requests=2, failed=1)
+    governor.flush()
+
+    (_, rows), = database.statements("INSERT INTO api_usage_tracking")
+    assert rows == [(date.today(), "apollo", 2, 1, 1, 0, 4)]
+
+
+def test_first_reserve_sees_other_runs_usage(config_path):
+    database = FakeDatabase()
+    database.credits = 10  # another run already used today's budget
+    governor = BudgetGovernor(config_path, connection_factory=database.connect)
+
+    assert governor.reserve("apollo", "enrich_person", 1) is None
+    assert governor.denied["apollo"] == 1
+    assert len(database.connections) == 1
+
+
+def test_start_run_creates_row_so_costs_are_written(config_path, fake_execute_values):
+    database = FakeDatabase()
+    governor = BudgetGovernor(config_path, workflow_run_id="run-1", connection_factory=database.connect)
+    governor.start_run(batch_number=3)
+    spend(governor, 2)
+
+    governor.close()
+
+    (_, params), = database.statements("INSERT INTO workflow_runs")
+    assert params[:2] == ("run-1", 3)
+    assert database.statements("INSERT INTO workflow_costs")
+    (_, params), = database.statements("UPDATE workflow_runs")
+    assert params == ("completed", "run-1")
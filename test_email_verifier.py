@@ -0,0 +1,71 @@
+﻿import pytest
+
+from agents.email_verifier import EmailVerifier, NeverBounceBackend, normalize_email
+from testing.fake_neverbounce import FakeNeverBounceServer
+
+
+@pytest.fixture
+def server():
+    with FakeNeverBounceServer(job_latency=0.05) as server:
+        yield server
+
+
+def make_verifier(server, **kwargs):
+    backend = NeverBounceBackend(base_url=server.url, poll_interval=0.01)
+    return EmailVerifier(backend=backend, cache_file=None, **kwargs)
+
+
+def test_small_sets_use_single_checks(server):
+    verifier = make_verifier(server)
+
+    results = verifier.verify([" Owner@Acme.com", "bounce@acme.com", "owner@acme.com"])
+
+    assert results == {"owner@acme.com": "valid", "bounce@acme.com": "invalid"}
+    assert server.requests["single"] == 2
+    assert server.requests["create"] == 0
+
+
+def test_large_sets_use_bulk_jobs(server):
+    verifier = make_verifier(server, single_check_limit=2, job_size=3)
+
+    results = verifier.verify([f"owner{i}@acme.com" for i in range(5)])
+
+    assert set(results.values()) == {"valid"}
+    assert server.requests["create"] == 2
+    assert server.requests["single"] == 0
+
+
+def test_domain_results_and_cache_skip_lookups(server):
+    verifier = make_verifier(server)
+    verifier.verify(["a@catchall-co.com", "x@nomail.invalid", "unknown@acme.com"])
+
+    results = verifier.verify(["b@catchall-co.com", "y@nomail.invalid", "a@catchall-co.com", "unknown@acme.com"])
+
+    assert results["b@catchall-co.com"] == "catchall"
+    assert results["y@nomail.invalid"] == "invalid"
+    assert server.requests["single"] == 4  # only the unknown result is checked again
+    assert verifier.stats["domain_hits"] == 2 and verifier.stats["cache_hits"] == 1
+
+
+def test_bad_syntax_does_not_invalidate_the_domain(server):
+    verifier = make_verifier(server)
+    verifier.verify(["typo..owner@acme.com"])
+
+    assert verifier.verify(["sales@acme.com"]) == {"sales@acme.com": "valid"}
+    assert server.requests["single"] == 2 and verifier.stats["domain_hits"] == 0
+
+
+def test_denied_budget_leaves_emails_unknown(server):
+    class DenyingGovernor:
+        def reserve(self, provider, operation, units):
+            return None
+
+    verifier = make_verifier(server, governor=DenyingGovernor())
+
+    assert verifier.verify(["owner@acme.com"]) == {"owner@acme.com": "unknown"}
+    assert server.requests["single"] == 0
+
+
+def test_normalize_email():
+    assert normalize_email("  Bob.Smith@Example.COM ") == "bob.smith@example.com"
+    assert normalize_email(None) == ""
@@ -0,0 +1,125 @@
+﻿from testing.fake_db import FakeConnection
+from utils.entity_resolution import EntityResolver, domain_root, normalize_company, normalize_first_name
+from utils.lead_store import LeadStore
+
+KNOWN_ID = "00000000-0000-0000-0000-000000000001"
+CANONICAL_ID = "00000000-0000-0000-0000-000000000009"
+
+
+def lead(first, last, company, domain=None, email=None):
+    return {"first_name": first, "last_name": last, "company_name": company, "domain": domain, "email": email}
+
+
+def offline_resolver():
+    resolver = EntityResolver(connection_factory=None)
+    resolver.loaded = True
+    return resolver
+
+
+def test_normalizers():
+    assert normalize_company("Acme Tools, Inc.") == "acme tools"
+    assert normalize_first_name("Bob") == "robert"
+    assert domain_root("https://shop.acme.co.uk/about") == "acme.co.uk"
+    assert domain_root("dana@gmail.com") is None
+
+
+def test_first_names_must_match_exactly_or_by_nickname():
+    resolver = offline_resolver()
+    leads = [lead("Robert", "Smith", "Acme", "acme.com"), lead("Bob", "Smith", "Acme", "acme.com"),
+             lead("Al", "Jones", "Acme", "acme.com"), lead("Alan", "Jones", "Acme", "acme.com")]
+
+    duplicates = resolver.resolve_batch(leads)
+
+    assert [d["first_name"] for d in duplicates] == ["Bob"]
+    assert duplicates[0]["canonical_lead_id"] == leads[0]["lead_id"]
+
+
+def test_two_domains_never_merge_through_a_name_only_company():
+    resolver = offline_resolver()
+    acme = resolver.company_key("Acme Tools", "acme.com")
+    name_only = resolver.company_key("Acme Tools", None)
+    other = resolver.company_key("Acme Tool", "acmetool.com")
+
+    assert resolver.company_root(acme) == resolver.company_root(name_only)
+    assert resolver.company_root(other) != resolver.company_root(acme)
+
+    duplicates = resolver.resolve_batch([lead("Dana", "Lee", "Acme Tools", "acme.com"),
+                                         lead("Dana", "Lee", "Acme Tool", "acmetool.com")])
+    assert duplicates == []
+
+
+def test_candidates_are_blocked_in_sql():
+    queries = []
+
+    def handler(sql, params):
+        if "FROM leads" in sql:
+            queries.append(params)
+            return [(KNOWN_ID, "rob.smith@acme.com", "Rob", "Smith", "Acme Inc", "acme.com", CANONICAL_ID)]
+        return []
+
+    resolver = EntityResolver(connection_factory=lambda: FakeConnection(handler))
+    duplicates = resolver.resolve_batch([lead("Robert", "Smith", "Acme", "acme.com", "robert@acme.com")])
+
+    (emails, domains, names), = queries
+    assert "robert@acme.com" in emails and domains == ["acme.com"] and "Acme" in names
+    assert duplicates[0]["canonical_lead_id"] == CANONICAL_ID
+    assert duplicates[0]["match_reason"] == "name+company"
+
+
+def test_known_companies_are_blocked_in_sql():
+    queries = {}
+
+    def handler(sql, params):
+        table = "companies" if "FROM company_intelligence_cache" in sql else "leads"
+        queries.setdefault(table, []).append((sql, params))
+        return [("acme.com", "Acme Tools, Inc.")] if table == "companies" else []
+
+    resolver = EntityResolver(connection_factory=lambda: FakeConnection(handler))
+    resolver.resolve_batch([lead("Dana", "Lee", "Acme Tools", email="dana@gmail.com")])
+
+    (sql, (domains, names)), = queries["companies"]
+    assert "% n.name" in sql.replace("%%", "%") and domains == [] and names == ["acme tools"]
+    (_, (_, lead_domains, _)), = queries["leads"]
+    assert lead_domains == ["acme.com"]  # the name-only lead joined the cached company's cluster
+    assert not resolver.loaded
+
+
+def test_uncommitted_leads_are_not_remembered():
+    resolver = EntityResolver(connection_factory=lambda: FakeConnection(lambda sql, params: []))
+
+    resolver.resolve_batch([lead("Dana", "Lee", "Acme", "acme.com", "dana@acme.com")])
+
+    assert resolver.resolve_batch([lead("Dana", "Lee", "Acme", "acme.com", "dana@acme.com")]) == []
+
+
+def test_duplicates_of_a_dropped_lead_are_relinked(fake_execute_values):
+    canonical = {"lead_id": KNOWN_ID, "email": "dana@acme.com"}
+    duplicate = {"lead_id": CANONICAL_ID, "email": "d.lee@acme.com", "canonical_lead_id": KNOWN_ID,
+                 "sequence_status": "duplicate"}
+
+    def handler(sql, params):
+        if "INSERT INTO leads" in sql:
+            return [(CANONICAL_ID,)]  # dana@acme.com was inserted by another process meanwhile
+
+    conn = FakeConnection(handler)
+    LeadStore(connection_factory=lambda: conn).save_batch([canonical, duplicate], {})
+
+    (_, relink), = conn.executed("SET canonical_lead_id = COALESCE(e.canonical_lead_id, e.lead_id)")
+    assert relink == [(CANONICAL_ID, "dana@acme.com")]
+
+
+def test_backfill_links_historical_duplicates(fake_execute_values):
+    rows = [("a", "dana@acme.com", "Dana", "Lee", "Acme", "acme.com", None),
+            ("b", "dlee@acme.com", "Dana", "Lee", "Acme Inc", "acme.com", None),
+            ("c", "sam@acme.com", "Sam", "Lee", "Acme", "acme.com", None)]
+    connections = []
+
+    def connect():
+        connections.append(FakeConnection(lambda sql, params: rows if "FROM leads" in sql else []))
+        return connections[-1]
+
+    linked = EntityResolver(connection_factory=connect).backfill()
+
+    assert linked == 1
+    (_, links), = connections[-1].executed("UPDATE leads AS l")
+    assert links == [("b", "a")]
@@ -0,0 +1,99 @@
+﻿import pytest
+
+from testing.fake_db import FakeConnection
+from utils.migrations import MigrationError, MigrationRunner
+
+
+def write(directory, name, sql):
+    (directory / name).write_text(sql, encoding="utf-8")
+
+
+@pytest.fixture
+def migrations_dir(tmp_path):
+    write(tmp_path, "0001_tables.sql", "CREATE TABLE leads (lead_id UUID PRIMARY KEY);\n")
+    write(tmp_path, "0002_lead_index.sql",
+          "-- migrate: no-transaction\n"
+          "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_leads_email ON leads(email);\n"
+          "-- second statement\n"
+          "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_leads_domain ON leads(domain);\n")
+    write(tmp_path, "notes.sql", "SELECT 1;")
+    return tmp_path
+
+
+def database(applied=None, invalid_indexes=()):
+    """Handler for a database whose schema_migrations holds applied {version: checksum}"""
+    def handler(sql, params):
+        if "pg_try_advisory_lock" in sql:
+            return [(True,)]
+        if "to_regclass" in sql:
+            return [(None if applied is None else "schema_migrations",)]
+        if "FROM schema_migrations" in sql:
+            return list((applied or {}).items())
+        if "FROM pg_index" in sql:
+            return [(name,) for name in invalid_indexes]
+    return handler
+
+
+def test_discover_orders_versions_and_skips_misnamed_files(migrations_dir):
+    migrations = MigrationRunner(str(migrations_dir)).discover()
+
+    assert [(m.version, m.name, m.transactional) for m in migrations] == [
+        (1, "tables", True), (2, "lead_index", False)]
+    assert migrations[1].statements() == [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_leads_email ON leads(email)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_leads_domain ON leads(domain)",
+    ]
+
+
+def test_duplicate_versions_are_rejected(migrations_dir):
+    write(migrations_dir, "0002_other.sql", "SELECT 1;")
+
+    with pytest.raises(MigrationError, match="Duplicate"):
+        MigrationRunner(str(migrations_dir)).discover()
+
+
+def test_migrate_applies_only_pending(migrations_dir):
+    runner = MigrationRunner(str(migrations_dir))
+    first = runner.discover()[0]
+    conn = FakeConnection(database(applied={1: first.checksum}, invalid_indexes=["idx_leads_email"]))
+    runner.connection_factory = lambda: conn
+
+    applied = runner.migrate()
+
+    assert [m.version for m in applied] == [2]
+    assert not conn.executed("CREATE TABLE leads")
+    assert conn.executed("DROP INDEX CONCURRENTLY IF EXISTS idx_leads_email")
+    assert len(conn.executed("CREATE INDEX CONCURRENTLY")) == 2
+    (_, params), = conn.executed("INSERT INTO schema_migrations")
+    assert params[:2] == (2, "lead_index")
+    assert not conn.executed("BEGIN") and conn.closed
+
+
+def test_transactional_migration_runs_with_lock_timeout(migrations_dir):
+    conn = FakeConnection(database())
+    runner = MigrationRunner(str(migrations_dir), connection_factory=lambda: conn, lock_timeout="2s")
+
+    runner.migrate(target=1)
+
+    statements = [sql for sql, _ in conn.statements]
+    begin = statements.index("BEGIN")
+    assert statements[begin + 1] == "SET LOCAL lock_timeout = %s"
+    assert statements[begin + 2].startswith("CREATE TABLE leads")
+    assert statements[-1] == "COMMIT"
+
+
+def test_edited_applied_migration_is_refused(migrations_dir):
+    conn = FakeConnection(database(applied={1: "0" * 64}))
+    runner = MigrationRunner(str(migrations_dir), connection_factory=lambda: conn)
+
+    with pytest.raises(MigrationError, match="0001_tables.sql"):
+        runner.migrate()
+    assert not conn.executed("INSERT INTO schema_migrations")
+
+
+def test_dry_run_changes_nothing(migrations_dir):
+    conn = FakeConnection(database())
+    runner = MigrationRunner(str(migrations_dir), connection_factory=lambda: conn)
+
+    assert [m.version for m in runner.migrate(dry_run=True)] == [1, 2]
+    assert [sql for sql, _ in conn.statements] == ["SELECT to_regclass('schema_migrations')"]
@@ -0,0 +1,66 @@
+﻿import json
+from datetime import date
+
+from testing.fake_db import FakeConnection
+from testing.fake_notion import FakeNotionClient
+from utils.notion_sync import NotionSync
+
+DAILY_ROWS = [{"date": date(2026, 10, day), "total_emails_sent": day} for day in (1, 2, 3)]
+ALERT_ROW = {"alert_id": "a1", "alert_type": "error", "component": "apollo", "message": "Apollo 503",
+             "resolved": False}
+
+
+def make_sync(client, tmp_path, rows, **kwargs):
+    return NotionSync(client=client, state_file=str(tmp_path / "state.json"), rate_per_second=1000,
+                      connection_factory=lambda: FakeConnection(lambda sql, params: rows), **kwargs)
+
+
+def test_unchanged_rows_are_skipped_and_changed_rows_updated(tmp_path):
+    client = FakeNotionClient()
+    rows = [dict(row) for row in DAILY_ROWS]
+    make_sync(client, tmp_path, rows).sync(["daily_performance_summary"])
+
+    rows[0]["total_emails_sent"] = 50
+    summary = make_sync(client, tmp_path, rows).sync(["daily_performance_summary"])
+
+    assert summary["daily_performance_summary"] == {"rows": 3, "unchanged": 2, "updated": 1}
+    assert client.calls["pages.create"] == 3
+
+
+def test_timed_out_create_finds_the_page_instead_of_duplicating(tmp_path):
+    client = FakeNotionClient(timeout_rate=1.0)
+
+    summary = make_sync(client, tmp_path, DAILY_ROWS).sync(["daily_performance_summary"])
+
+    assert summary["daily_performance_summary"]["created"] == 3
+    assert len(client.pages_by_id) == 3
+    assert client.calls["databases.query"] == 3
+    state = json.loads((tmp_path / "state.json").read_text())["daily_performance_summary"]
+    assert {entry["page_id"] for entry in state.values()} == set(client.pages_by_id)
+
+
+def test_alert_creates_are_not_retried_blindly(tmp_path):
+    client = FakeNotionClient(timeout_rate=1.0)
+
+    summary = make_sync(client, tmp_path, [ALERT_ROW]).sync(["system_alerts"])
+
+    assert summary["system_alerts"]["failed"] == 1
+    assert client.calls["pages.create"] == 1 and len(client.pages_by_id) == 1
+    page, = client.pages_by_id.values()
+    assert set(page["properties"]) == {"Alert", "Type", "Component", "Message", "Resolved"}
+
+
+def test_state_is_saved_as_each_page_is_created(tmp_path):
+    client = FakeNotionClient()
+    create = client.pages.create
+    saved = []
+
+    async def create_and_check(**kwargs):
+        if client.calls["pages.create"]:
+            saved.append(len(json.loads((tmp_path / "state.json").read_text())["daily_performance_summary"]))
+        return await create(**kwargs)
+
+    client.pages.create = create_and_check
+    make_sync(client, tmp_path, DAILY_ROWS, workers=1).sync(["daily_performance_summary"])
+
+    assert saved == [1, 2]
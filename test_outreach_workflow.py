@@ -0,0 +1,68 @@
+﻿import subprocess
+import threading
+import time
+
+import pytest
+
+import cli
+from workflows import outreach_workflow
+from workflows.outreach_workflow import OutreachWorkflow, get_workflow
+
+
+@pytest.fixture
+def fresh_process_workflow(monkeypatch):
+    monkeypatch.setattr(outreach_workflow, "_process_workflow", None)
+    monkeypatch.setattr(outreach_workflow, "_process_workflow_kwargs", {})
+
+
+def test_get_workflow_rejects_different_kwargs(fresh_process_workflow):
+    store = object()
+    workflow = get_workflow(lead_store=store)
+
+    assert get_workflow() is workflow
+    assert get_workflow(lead_store=store) is workflow
+    with pytest.raises(ValueError):
+        get_workflow(lead_store=object())
+
+
+def test_concurrent_first_use_compiles_once(monkeypatch):
+    builds = []
+
+    def build(self):
+        builds.append(1)
+        time.sleep(0.05)
+        return object()
+
+    monkeypatch.setattr(OutreachWorkflow, "_build_workflow", build)
+    workflow = OutreachWorkflow()
+    compiled = []
+
+    threads = [threading.Thread(target=lambda: compiled.append(workflow.workflow)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(builds) == 1
+    assert len({id(graph) for graph in compiled}) == 1
+
+
+def test_import_profile_only_imports(monkeypatch, capsys):
+    calls = []
+
+    def run(cmd, **kwargs):
+        calls.append(cmd)
+        return subprocess.CompletedProcess(cmd, 0, stdout="", stderr=(
+            "import time: self [us] | cumulative | imported package\n"
+            "import time:       120 |       5000 | utils.migrations\n"
+            "import time:       300 |        300 |   utils.db\n"))
+
+    monkeypatch.setattr(cli.subprocess, "run", run)
+
+    assert cli.main(["--import-profile", "migrate", "--dry-run"]) == 0
+
+    (cmd,) = calls
+    assert cmd[1:4] == ["-X", "importtime", "-c"]
+    assert "cli.py" not in " ".join(cmd)
+    assert "utils.migrations" in cmd[4]
+    assert "Import profile: 5.0 ms across 2 modules" in capsys.readouterr().out
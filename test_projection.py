@@ -0,0 +1,64 @@
+﻿import pytest
+
+from utils.lead_store import LeadStore
+from utils.projection import LeadProjector, decompress_value
+from testing.fake_db import FakeConnection
+
+PERSON = {"id": "p1", "first_name": "Dana", "title": "Owner", "photo_url": "https://img/1.png",
+          "employment_history": [{"title": f"Role {i}", "organization_name": f"Org {i}"} for i in range(20)]}
+ORG = {"id": "o1", "name": "Acme", "primary_domain": "acme.com", "founded_year": 1990,
+       "short_description": "Valves", "raw_address": "1 Main St"}
+
+
+def test_projection_keeps_whitelist_and_compresses_large_fields():
+    projector = LeadProjector()
+
+    person = projector.project_person(PERSON)
+    org = projector.project_org(ORG)
+
+    assert "photo_url" not in person and "raw_address" not in org
+    assert set(person["employment_history"]) == {"_z"}
+    assert decompress_value(person["employment_history"]) == PERSON["employment_history"]
+    assert org["short_description"] == "Valves"  # under compress_min_bytes
+    assert LeadProjector.expand(person)["employment_history"] == PERSON["employment_history"]
+    assert projector.project_person(None) == {}
+
+
+def test_missing_config_keeps_ids_only(tmp_path):
+    projector = LeadProjector(str(tmp_path / "missing.json"))
+
+    assert projector.project_person(PERSON) == {"id": "p1"}
+    assert projector.project_org(ORG) == {"id": "o1", "primary_domain": "acme.com"}
+
+
+def test_save_batch_stores_orgs_once_per_domain(fake_execute_values):
+    def handler(sql, params):
+        if "INSERT INTO leads" in sql:
+            return [(row[0],) for row in params[:1]]  # the second email already exists
+
+    conn = FakeConnection(handler)
+    leads = [{"email": "dana@acme.com", "domain": "acme.com", "person_data": {"id": "p1"}},
+             {"email": "lee@acme.com", "domain": "acme.com", "person_data": {"id": "p2"}},
+             {"first_name": "No email"}]
+
+    inserted = LeadStore(connection_factory=lambda: conn).save_batch(leads, {"acme.com": ORG, "": ORG})
+
+    (_, orgs), = conn.executed("INSERT INTO company_intelligence_cache")
+    (_, rows), = conn.executed("INSERT INTO leads")
+    assert inserted == 1
+    assert [org[0] for org in orgs] == ["acme.com"]
+    assert [row[3] for row in rows] == ["dana@acme.com", "lee@acme.com"]
+    assert conn.commits == 1 and conn.closed
+
+
+def test_save_batch_rolls_back_on_error(fake_execute_values):
+    def handler(sql, params):
+        if "INSERT INTO leads" in sql:
+            raise RuntimeError("deadlock detected")
+
+    conn = FakeConnection(handler)
+
+    with pytest.raises(RuntimeError):
+        LeadStore(connection_factory=lambda: conn).save_batch([{"email": "dana@acme.com"}], {"acme.com": ORG})
+
+    assert conn.rollbacks == 1 and conn.commits == 0 and conn.closed
@@ -0,0 +1,68 @@
+﻿import json
+
+from agents.reply_classifier import KeywordClassifierBackend, ReplyClassifier, normalize_reply, reply_hash
+
+
+class RecordingBackend(KeywordClassifierBackend):
+    def __init__(self, name: str):
+        self.name = name
+        self.requests = []
+
+    def classify_batch(self, texts):
+        self.requests.append(list(texts))
+        return super().classify_batch(texts)
+
+
+def test_normalize_strips_quotes_and_signature():
+    text = "Sounds good, send me more.\n\nBest,\nDave\n\nOn Mon, Jan 5, 2026 Sam wrote:\n> Hi Dave"
+    assert normalize_reply(text) == "Sounds good, send me more."
+
+
+def test_leading_thanks_keeps_body():
+    text = "Thanks,\nI'm interested, can we schedule a call next week?\n\nThanks,\nDave"
+    assert normalize_reply(text) == "Thanks, I'm interested, can we schedule a call next week?"
+
+
+def test_hash_ignores_volatile_tokens():
+    first = normalize_reply("I'm out of the office until 3/14. Call 555-0100.")
+    second = normalize_reply("I'm out of the office until 4/2. Call 555-0199.")
+    assert reply_hash(first) == reply_hash(second)
+
+
+def test_cache_is_keyed_by_backend(tmp_path):
+    cache_file = tmp_path / "cache.jsonl"
+    fallback = RecordingBackend("keyword-local")
+    ReplyClassifier(backend=fallback, cache_file=str(cache_file)).classify_texts(["Not interested"])
+
+    model = RecordingBackend("openai:gpt-4o-mini")
+    classifier = ReplyClassifier(backend=model, cache_file=str(cache_file))
+    classifier.classify_texts(["Not interested"])
+
+    assert model.requests == [["Not interested"]]
+    assert classifier.stats["cache_hits"] == 0
+
+
+def test_cache_appends_only_new_entries(tmp_path):
+    cache_file = tmp_path / "cache.jsonl"
+    backend = RecordingBackend("keyword-local")
+    classifier = ReplyClassifier(backend=backend, cache_file=str(cache_file))
+
+    classifier.classify_texts(["Please unsubscribe me", "Tell me more"])
+    classifier.classify_texts(["Tell me more", "Let's talk next week"])
+
+    lines = [json.loads(line) for line in cache_file.read_text().splitlines()]
+    assert len(lines) == 3
+    assert backend.requests == [["Please unsubscribe me", "Tell me more"], ["Let's talk next week"]]
+
+    reloaded = ReplyClassifier(backend=backend, cache_file=str(cache_file))
+    assert reloaded.classify_texts(["Tell me more"])[0]["reply_type"] == "interested"
+    assert len(backend.requests) == 2
+
+
+def test_keyword_rules_put_negative_phrases_first():
+    backend = KeywordClassifierBackend()
+    results = backend.classify_batch(["Not interested", "I am not interested at this time", "I'm uninterested",
+                                      "Interested, tell me more"])
+
+    assert [result["reply_type"] for result in results] == ["not_interested", "not_interested", "other", "interested"]
+    assert results[0]["next_action"] == "nurture" and results[0]["priority_level"] == "low"
@@ -0,0 +1,102 @@
+﻿import threading
+import time
+from datetime import datetime, timedelta
+
+from agents.research_cache import RESEARCH_FIELDS, IndustryResearchCache
+from testing.fake_db import FakeConnection
+
+
+class CountingResearcher:
+    def __init__(self, fail_after: int = None, delay: float = 0.0):
+        self.calls = 0
+        self.fail_after = fail_after
+        self.delay = delay
+        self._lock = threading.Lock()
+
+    def __call__(self, industry, location):
+        with self._lock:
+            self.calls += 1
+            calls = self.calls
+        time.sleep(self.delay)
+        if self.fail_after is not None and calls > self.fail_after:
+            raise RuntimeError("perplexity unavailable")
+        return {"research_query": industry, "growth_outlook": f"call {calls}"}
+
+
+def wait_for_refreshes(cache: IndustryResearchCache):
+    cache._refresher.submit(lambda: None).result()
+
+
+def research_row(expires_at: datetime):
+    return {"research_query": "hvac", "perplexity_response": {}, "expires_at": expires_at,
+            **{field: None for field in RESEARCH_FIELDS}, "growth_outlook": "from db"}
+
+
+def test_concurrent_misses_share_one_fetch():
+    researcher = CountingResearcher(delay=0.05)
+    cache = IndustryResearchCache(researcher=researcher, connection_factory=None)
+
+    threads = [threading.Thread(target=cache.get, args=("HVAC", "Dallas")) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert researcher.calls == 1
+    assert cache.stats["coalesced"] == 7
+
+
+def test_failed_refresh_backs_off():
+    researcher = CountingResearcher(fail_after=1)
+    cache = IndustryResearchCache(researcher=researcher, connection_factory=None, refresh_workers=1,
+                                  ttl=timedelta(days=1), refresh_ahead=timedelta(days=2))
+
+    assert cache.get("hvac")["growth_outlook"] == "call 1"
+    cache.get("hvac")  # inside the refresh window: starts a refresh that fails
+    wait_for_refreshes(cache)
+    for _ in range(5):
+        assert cache.get("hvac")["growth_outlook"] == "call 1"
+    wait_for_refreshes(cache)
+
+    assert researcher.calls == 2
+    cache.close()
+
+
+def test_refresh_uses_row_refreshed_by_another_process(fake_execute_values):
+    reads = []
+
+    def handler(sql, params):
+        if "SELECT research_query" in sql:
+            reads.append(params)
+            # First read: nearly expired. Second: another process refreshed it.
+            days = 1 if len(reads) == 1 else 30
+            return [research_row(datetime.now() + timedelta(days=days))]
+
+    researcher = CountingResearcher()
+    cache = IndustryResearchCache(researcher=researcher, connection_factory=lambda: FakeConnection(handler),
+                                  refresh_workers=1, refresh_ahead=timedelta(days=2))
+
+    cache.get("hvac")
+    cache.get("hvac")
+    wait_for_refreshes(cache)
+
+    assert researcher.calls == 0
+    assert len(reads) == 2
+    assert cache._entries[cache.make_cache_key("hvac", None)].expires_at > datetime.now() + timedelta(days=29)
+
+
+def test_usage_is_flushed_off_the_get_path(fake_execute_values):
+    flush_threads = []
+
+    def handler(sql, params):
+        if "SET usage_count" in sql:
+            flush_threads.append(threading.current_thread().name)
+
+    cache = IndustryResearchCache(researcher=CountingResearcher(), usage_flush_size=3, refresh_workers=1,
+                                  connection_factory=lambda: FakeConnection(handler))
+    cache.get("hvac")  # miss: researched and stored
+    for _ in range(3):
+        cache.get("hvac")
+    wait_for_refreshes(cache)
+
+    assert flush_threads and all(name.startswith("research-refresh") for name in flush_threads)
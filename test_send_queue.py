@@ -0,0 +1,50 @@
+﻿from testing.fake_db import FakeConnection
+from workflows.send_queue import SendQueue
+
+
+def due_lead(n: int, position: int = 0):
+    return {"lead_id": f"00000000-0000-0000-0000-00000000000{n}", "email": f"owner{n}@example.com",
+            "sequence_position": position, "guidelines": None}
+
+
+def make_queue(leads, chunk_size=2):
+    def handler(sql, params):
+        if "FROM leads l" in sql:
+            return leads
+        if "UPDATE leads" in sql:
+            return len(params)
+
+    conn = FakeConnection(handler)
+    return SendQueue(chunk_size=chunk_size, max_workers=2, connection_factory=lambda: conn), conn
+
+
+def test_run_advances_only_sent_leads(fake_execute_values):
+    leads = [due_lead(1), due_lead(2, position=1), due_lead(3)]
+    queue, conn = make_queue(leads)
+
+    stats = queue.run(lambda lead: lead["email"] != "owner2@example.com")
+
+    assert stats == {"due": 3, "sent": 2, "failed": 1, "advanced": 2, "chunks": 2}
+    advanced = [row for _, params in conn.executed("UPDATE leads AS l") for row in params]
+    assert [(lead_id[-1], position) for lead_id, _, position in advanced] == [("1", 0), ("3", 0)]
+    assert conn.closed
+
+
+def test_send_errors_leave_lead_due(fake_execute_values):
+    queue, conn = make_queue([due_lead(1)])
+
+    def send(lead):
+        raise ConnectionError("smtp down")
+
+    stats = queue.run(send)
+
+    assert stats["failed"] == 1 and stats["advanced"] == 0
+    assert not conn.executed("UPDATE leads")
+
+
+def test_reader_is_streamed_in_chunks():
+    queue, conn = make_queue([due_lead(i) for i in range(1, 6)], chunk_size=2)
+
+    chunks = list(queue.iter_due_chunks(conn))
+
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
@@ -0,0 +1,91 @@
+﻿import json
+import threading
+
+import pytest
+
+from agents.apollo_agent import ApolloAgent
+from agents.apollo_search_manager import ApolloSearchManager
+from testing.fake_apollo import FakeApolloServer
+from workflows.sourcing_coordinator import SourcingCoordinator
+
+
+@pytest.fixture
+def server():
+    with FakeApolloServer() as server:
+        yield server
+
+
+@pytest.fixture
+def search_manager(tmp_path):
+    manager = ApolloSearchManager()
+    manager.progress_file = tmp_path / "apollo_progress.json"
+    return manager
+
+
+def test_search_sends_the_metro_and_titles(server, search_manager):
+    params = search_manager.get_search_params(industry="manufacturing", metro="texas")
+    agent = ApolloAgent(base_url=server.url)
+
+    people = agent.search_people({**params, "page": 1})
+
+    assert people and {person["city"] for person in people} <= {"Houston", "Dallas", "Austin"}
+
+
+def test_metro_shards_find_no_common_leads(server, search_manager):
+    # Two workers deal the combinations into one shard per metro
+    coordinator = SourcingCoordinator(workers=2, rate_per_second=200, credit_limit=1000,
+                                      search_manager=search_manager,
+                                      agent_options={"base_url": server.url, "backoff": 0.01})
+
+    report = coordinator.run()
+
+    assert not report["errors"]
+    assert report["unique_leads"] > 0
+    assert report["cross_shard_duplicates"] == 0
+    assert report["pages_released"] == 0
+
+
+def test_pages_not_searched_are_released(server, search_manager):
+    coordinator = SourcingCoordinator(workers=2, pages_per_combo=2, rate_per_second=200, credit_limit=0,
+                                      search_manager=search_manager,
+                                      agent_options={"base_url": server.url, "backoff": 0.01})
+
+    report = coordinator.run()
+
+    progress = json.loads(search_manager.progress_file.read_text())
+    assert report["pages_released"] == 16
+    assert set(progress["pages"].values()) == {0}
+    assert server.requests["total"] == 0
+
+
+def test_release_skips_pages_claimed_since(search_manager):
+    search_manager.claim_pages("saas", "texas", 3)
+    search_manager.claim_pages("saas", "texas", 2)
+
+    assert not search_manager.release_pages("saas", "texas", 3, 2)
+    assert search_manager.release_pages("saas", "texas", 5, 4)
+    assert search_manager.claim_pages("saas", "texas", 1) == [4]
+
+
+def test_concurrent_claims_never_share_a_page(search_manager):
+    claimed = []
+
+    def claim():
+        manager = ApolloSearchManager()
+        manager.progress_file = search_manager.progress_file
+        for _ in range(10):
+            claimed.extend(manager.claim_pages("manufacturing", "texas", 2))
+            _, metadata = manager.get_next_search_params()
+            if (metadata["industry"], metadata["metro"]) == ("manufacturing", "texas"):
+                claimed.append(metadata["page"])
+
+    threads = [threading.Thread(target=claim) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    progress = json.loads(search_manager.progress_file.read_text())
+    assert sorted(claimed) == list(range(1, len(claimed) + 1))
+    assert progress["pages"]["manufacturing_texas"] == len(claimed)
+    assert progress["industry_index"] == 40 % len(search_manager.config["us_industries"])
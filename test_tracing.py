@@ -0,0 +1,102 @@
+﻿import json
+import threading
+import tracemalloc
+from datetime import date
+
+import pytest
+
+from agents.apollo_agent import ApolloAgent
+from agents.apollo_search_manager import ApolloSearchManager
+from agents.email_verifier import NeverBounceBackend
+from testing.fake_apollo import FakeApolloServer
+from testing.fake_db import FakeConnection
+from testing.fake_neverbounce import FakeNeverBounceServer
+from testing.fake_notion import FakeNotionClient
+from utils import tracing
+from utils.notion_sync import NotionSync
+from workflows.sourcing_coordinator import SourcingCoordinator
+
+
+@pytest.fixture
+def trace_file(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    tracing.configure(trace_file=str(path))
+    yield path
+    tracing.configure()
+
+
+def read_spans(path, name=None):
+    spans = [json.loads(line) for line in path.read_text().splitlines()]
+    return [span for span in spans if name is None or span["name"] == name]
+
+
+def test_apollo_spans_use_endpoint_names(trace_file):
+    with FakeApolloServer() as server:
+        agent = ApolloAgent(base_url=server.url)
+        agent.search_people({}, limit=3)
+        agent.enrich_organizations(["acme.com"])
+
+    endpoints = [span["attrs"]["endpoint"] for span in read_spans(trace_file, "apollo.post")]
+    assert endpoints == ["mixed_people/search", "organizations/bulk_enrich"]
+
+
+def test_sourcing_worker_spans_carry_the_run_id(trace_file, tmp_path):
+    manager = ApolloSearchManager()
+    manager.progress_file = tmp_path / "apollo_progress.json"
+    with FakeApolloServer() as server:
+        coordinator = SourcingCoordinator(workers=2, rate_per_second=200, credit_limit=1000, search_manager=manager,
+                                          agent_options={"base_url": server.url})
+        report = coordinator.run(workflow_run_id="run-1")
+
+    pages = read_spans(trace_file, "sourcing.page")
+    posts = read_spans(trace_file, "apollo.post")
+    assert not report["errors"] and len(pages) == report["shards"][0]["batches"] + report["shards"][1]["batches"]
+    assert posts and {span["workflow_run_id"] for span in pages + posts} == {"run-1"}
+    assert {span["parent_id"] for span in posts} <= {span["span_id"] for span in pages}
+
+
+def test_neverbounce_spans_per_request(trace_file):
+    with FakeNeverBounceServer(job_latency=0.02) as server:
+        backend = NeverBounceBackend(base_url=server.url, poll_interval=0.01)
+        backend.verify_single("owner@acme.com")
+        backend.verify_bulk(["a@acme.com", "b@acme.com"])
+
+    spans = read_spans(trace_file, "neverbounce.request")
+    endpoints = [span["attrs"]["endpoint"] for span in spans]
+    assert endpoints[:2] == ["single/check", "jobs/create"] and endpoints[-1] == "jobs/results"
+    assert "jobs/status" in endpoints
+    assert spans[1]["attrs"]["emails"] == 2 and all(span["attrs"]["status"] == 200 for span in spans)
+
+
+def test_notion_spans_record_each_attempt(trace_file, tmp_path):
+    rows = [{"date": date(2026, 10, 1), "total_emails_sent": 1}]
+    sync = NotionSync(client=FakeNotionClient(timeout_rate=1.0), state_file=str(tmp_path / "state.json"),
+                      rate_per_second=1000, connection_factory=lambda: FakeConnection(lambda sql, params: rows))
+
+    sync.sync(["daily_performance_summary"])
+
+    spans = read_spans(trace_file, "notion.request")
+    assert [(span["attrs"]["operation"], span["status"]) for span in spans] == [
+        ("pages.create", "error"), ("databases.query", "ok")]
+
+
+def test_concurrent_nodes_share_one_profiler(trace_file):
+    tracing.configure(trace_file=str(trace_file), profile="tracemalloc")
+    both_running = threading.Barrier(2)
+
+    def work(state):
+        both_running.wait(timeout=5)
+        return {"rows": [bytearray(1024) for _ in range(100)]}
+
+    node = tracing.traced_node("work", work)
+    threads = [threading.Thread(target=node, args=({"batch_number": n},)) for n in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    spans = read_spans(trace_file, "node.work")
+    assert len(spans) == 2 and all(span["status"] == "ok" for span in spans)
+    assert sorted("peak_kb" in span["attrs"] for span in spans) == [False, True]
+    assert sum("profile_skipped" in span["attrs"] for span in spans) == 1
+    assert not tracemalloc.is_tracing()
@@ -0,0 +1,190 @@
+﻿import random
+import time
+import zlib
+from collections import Counter
+from typing import Dict, List, Optional
+
+from testing.fake_server import FakeJSONServer
+
+FIRST_NAMES = ["James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda",
+               "David", "Elizabeth", "William", "Susan", "Richard", "Karen", "Thomas", "Nancy"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis",
+              "Rodriguez", "Martinez", "Wilson", "Anderson", "Taylor", "Moore", "Jackson", "Lee"]
+TITLES = ["Owner", "Founder", "CEO", "President", "Managing Director", "Managing Partner"]
+COMPANY_WORDS = ["Precision", "Summit", "Allied", "Pioneer", "Keystone", "Atlas", "Harbor",
+                 "Sterling", "Frontier", "Granite", "Liberty", "Evergreen", "Beacon", "Union"]
+COMPANY_SUFFIXES = ["Manufacturing", "Industries", "Supply", "Logistics", "Group", "Partners", "Works"]
+INDUSTRIES = ["machinery", "wholesale", "logistics & supply chain", "management consulting",
+              "computer software", "industrial automation"]
+CITIES = [("New York", "NY"), ("Boston", "MA"), ("Houston", "TX"), ("Dallas", "TX"),
+          ("Chicago", "IL"), ("Atlanta", "GA"), ("Denver", "CO"), ("Phoenix", "AZ")]
+
+
+class FakeApolloServer(FakeJSONServer):
+    """Seeded synthetic stand-in for the Apollo endpoints ApolloAgent uses
+
+    Serves mixed_people/search, people/bulk_match and organizations/bulk_enrich.
+    The same seed, query and page always return the same people, drawn from a
+    fixed pool of companies so several contacts share an org. person_locations[]
+    limits the pool to companies in those cities, so searches for different
+    metros never return the same people. Latency, 5xx
+    error rate and 429 injection are configurable. Point the agent at it with
+    ApolloAgent(base_url=server.url).
+    """
+
+    def __init__(self, seed: int = 42, companies: int = 500, latency: float = 0.0,
+                 latency_jitter: float = 0.0, error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 email_rate: float = 0.85, retry_after: float = 0.05, **kwargs):
+        super().__init__(**kwargs)
+        self.seed = seed
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.email_rate = email_rate
+        self.retry_after = retry_after
+        self.requests = Counter()
+        self._faults = random.Random(seed + 1)
+        self._companies = [self._make_company(i) for i in range(companies)]
+        self._companies_by_domain = {c["primary_domain"]: c for c in self._companies}
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests.clear()
+
+    def handle(self, method, path, query, body):
+        # Control endpoints, used when the server runs in a child process
+        if path == "/__stats":
+            with self._lock:
+                return 200, dict(self.requests)
+        if path == "/__reset":
+            self.reset_counters()
+            return 200, {}
+
+        endpoint = path.rstrip("/").rsplit("/", 2)
+        endpoint = "/".join(endpoint[-2:])
+        with self._lock:
+            self.requests[endpoint] += 1
+            self.requests["total"] += 1
+            roll = self._faults.random()
+            delay = self.latency + self._faults.uniform(0, self.latency_jitter)
+
+        if delay:
+            time.sleep(delay)
+        if roll < self.rate_limit_rate:
+            with self._lock:
+                self.requests["rate_limited"] += 1
+            return 429, {"error": "rate limit exceeded"}, {"Retry-After": self.retry_after}
+        if roll < self.rate_limit_rate + self.error_rate:
+            with self._lock:
+                self.requests["errors"] += 1
+            return 500, {"error": "internal server error"}
+
+        if method == "POST" and endpoint == "mixed_people/search":
+            return 200, self._search(query)
+        if method == "POST" and endpoint == "people/bulk_match":
+            return self._bulk_match(body)
+        if method == "POST" and endpoint == "organizations/bulk_enrich":
+            return self._bulk_enrich(query.get("domains[]", []))
+        return 404, {"error": f"unknown endpoint {path}"}
+
+    def _search(self, query: Dict[str, List[str]]) -> Dict:
+        page = int(query.get("page", ["1"])[0])
+        per_page = min(int(query.get("per_page", ["10"])[0]), 100)
+        keywords = " ".join(query.get("q_keywords", [""]))
+        locations = query.get("person_locations[]", [])
+        rng = random.Random(f"{self.seed}:{keywords}:{','.join(locations)}:{page}")
+        companies = [c for c in self._companies if c["city"] in locations] or self._companies
+
+        people = []
+        for i in range(per_page):
+            company = rng.choice(companies)
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            people.append({
+                "id": f"p{zlib.crc32(f'{keywords}:{locations}:{page}:{i}'.encode()):08x}",
+                "first_name": first,
+                "last_name": last,
+                "name": f"{first} {last}",
+                "title": rng.choice(TITLES),
+                "city": company["city"],
+                "state": company["state"],
+                "organization_id": company["id"],
+                "organization": {"id": company["id"], "name": company["name"],
+                                 "domain": company["primary_domain"]},
+            })
+
+        return {"people": people,
+                "pagination": {"page": page, "per_page": per_page, "total_entries": per_page * 100}}
+
+    def _bulk_match(self, body: Dict):
+        details = body.get("details", [])
+        if len(details) > 10:
+            return 422, {"error": "details may contain at most 10 records"}
+
+        matches = [self._enrich_person(detail) for detail in details]
+        return 200, {"matches": matches, "credits_consumed": sum(1 for m in matches if m)}
+
+    def _bulk_enrich(self, domains: List[str]):
+        if len(domains) > 10:
+            return 422, {"error": "domains may contain at most 10 entries"}
+
+        orgs = [self._companies_by_domain.get(domain) for domain in domains]
+        return 200, {"organizations": [org for org in orgs if org]}
+
+    def _enrich_person(self, detail: Dict) -> Optional[Dict]:
+        rng = random.Random(f"{self.seed}:{detail.get('id')}")
+        if rng.random() > 0.95:
+            return None
+
+        company = self._companies_by_domain.get(detail.get("company_domain"), self._companies[0])
+        first, last = detail.get("first_name") or "", detail.get("last_name") or ""
+        has_email = rng.random() < self.email_rate
+        return {
+            "id": detail.get("id"),
+            "first_name": first,
+            "last_name": last,
+            "name": f"{first} {last}",
+            "title": rng.choice(TITLES),
+            "email": f"{first.lower()}.{last.lower()}@{company['primary_domain']}" if has_email else None,
+            "email_status": "verified" if has_email else "unavailable",
+            "linkedin_url": f"http://www.linkedin.com/in/{first.lower()}-{last.lower()}-{rng.randint(1000, 9999)}",
+            "city": company["city"],
+            "state": company["state"],
+            "country": "United States",
+            "seniority": "owner",
+            "departments": ["master_executive"],
+            "employment_history": [
+                {"organization_name": rng.choice(COMPANY_WORDS) + " " + rng.choice(COMPANY_SUFFIXES),
+                 "title": rng.choice(TITLES), "start_date": f"{2000 + j * 4}-01-01",
+                 "end_date": None if j == 0 else f"{2004 + j * 4}-01-01", "current": j == 0}
+                for j in range(rng.randint(1, 5))
+            ],
+            "organization": {"id": company["id"], "name": company["name"],
+                             "domain": company["primary_domain"]},
+        }
+
+    def _make_company(self, index: int) -> Dict:
+        rng = random.Random(f"{self.seed}:company:{index}")
+        name = f"{rng.choice(COMPANY_WORDS)} {rng.choice(COMPANY_SUFFIXES)}"
+        domain = f"{name.lower().replace(' ', '')}{index}.com"
+        city, state = rng.choice(CITIES)
+        employees = rng.randint(5, 200)
+        return {
+            "id": f"o{index:06d}",
+            "name": name,
+            "website_url": f"http://www.{domain}",
+            "primary_domain": domain,
+            "industry": rng.choice(INDUSTRIES),
+            "estimated_num_employees": employees,
+            "estimated_annual_revenue": employees * rng.randint(80, 250) * 1000,
+            "founded_year": rng.randint(1950, 2018),
+            "city": city,
+            "state": state,
+            "country": "United States",
+            "linkedin_url": f"http://www.linkedin.com/company/{domain.split('.')[0]}",
+            "keywords": [rng.choice(INDUSTRIES) for _ in range(rng.randint(5, 30))],
+            "technology_names": [f"tech-{rng.randint(1, 400)}" for _ in range(rng.randint(5, 40))],
+            "departmental_head_count": {dept: rng.randint(0, 20) for dept in
+                                        ["engineering", "sales", "operations", "finance", "support"]},
+            "short_description": " ".join(rng.choice(COMPANY_WORDS).lower() for _ in range(60)),
+        }
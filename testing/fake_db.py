@@ -0,0 +1,92 @@
+﻿import re
+from typing import Callable, List, Optional, Tuple
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+class FakeCursor:
+    """Cursor over rows returned by the connection's handler
+
+    The handler receives (sql, params) for every statement and returns the
+    result rows, an int rowcount, or None.
+    """
+
+    def __init__(self, conn: "FakeConnection", name: Optional[str] = None, cursor_factory=None):
+        self.connection = conn
+        self.name = name
+        self.cursor_factory = cursor_factory
+        self.itersize = 2000
+        self.rowcount = -1
+        self._rows: List = []
+
+    def execute(self, query, vars=None):
+        if self.connection.closed:
+            raise RuntimeError("connection already closed")
+        self.connection.statements.append((_WHITESPACE.sub(" ", str(query)).strip(), vars))
+        result = self.connection.handler(query, vars) if self.connection.handler else None
+        if isinstance(result, int):
+            self._rows, self.rowcount = [], result
+        else:
+            self._rows = list(result or [])
+            self.rowcount = len(self._rows)
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchmany(self, size: int = 1):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def close(self):
+        pass
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class FakeConnection:
+    """In-memory stand-in for a psycopg2 connection that records every statement"""
+
+    def __init__(self, handler: Optional[Callable] = None):
+        self.handler = handler
+        self.statements: List[Tuple[str, object]] = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.closed = False
+        self.autocommit = False
+        self.session = {}
+
+    def cursor(self, name: Optional[str] = None, cursor_factory=None) -> FakeCursor:
+        return FakeCursor(self, name, cursor_factory)
+
+    def set_session(self, **kwargs):
+        self.session.update(kwargs)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+    def executed(self, fragment: str) -> List[Tuple[str, object]]:
+        """Recorded (sql, params) whose whitespace-collapsed SQL contains fragment"""
+        return [(sql, params) for sql, params in self.statements if fragment in sql]
+
+
+def execute_values(cur, sql, argslist, template=None, page_size=100, fetch=False):
+    """Drop-in for psycopg2.extras.execute_values that passes the rows as params"""
+    cur.execute(sql, list(argslist))
+    return cur.fetchall() if fetch else None
@@ -0,0 +1,92 @@
+﻿import time
+import uuid
+from typing import Dict, List
+
+from testing.fake_server import FakeJSONServer
+
+
+def fake_verification(email: str) -> Dict:
+    """Deterministic NeverBounce-style result for a synthetic address
+
+    *.invalid domains have no MX, catchall* domains accept everything,
+    local parts containing 'bounce' or 'invalid' are rejected, 'typo' ones
+    fail syntax checks, and local parts containing 'unknown' time out.
+    Everything else is valid.
+    """
+    local, _, domain = email.lower().partition("@")
+    if domain.endswith(".invalid"):
+        return {"result": "invalid", "flags": ["bad_dns"]}
+    if domain.startswith("catchall"):
+        return {"result": "catchall", "flags": ["has_dns", "has_dns_mx", "accepts_all"]}
+    if "typo" in local:
+        return {"result": "invalid", "flags": ["bad_syntax"]}
+    if "bounce" in local or "invalid" in local:
+        return {"result": "invalid", "flags": ["has_dns", "has_dns_mx"]}
+    if "unknown" in local:
+        return {"result": "unknown", "flags": ["has_dns", "has_dns_mx", "timeout"]}
+    return {"result": "valid", "flags": ["has_dns", "has_dns_mx", "smtp_connectable"]}
+
+
+class FakeNeverBounceServer(FakeJSONServer):
+    """Local stand-in for the NeverBounce v4 jobs and single check APIs
+
+    Jobs report 'running' until job_latency seconds after creation. Use as a
+    context manager and point NeverBounceBackend(base_url=server.url) at it.
+    """
+
+    url_prefix = "/v4"
+
+    def __init__(self, job_latency: float = 0.1, **kwargs):
+        super().__init__(**kwargs)
+        self.job_latency = job_latency
+        self.jobs: Dict[str, Dict] = {}
+        self.requests = {"create": 0, "status": 0, "results": 0, "single": 0}
+
+    def handle(self, method, path, query, body):
+        query = {key: values[0] for key, values in query.items()}
+        if method == "GET" and path.endswith("/single/check"):
+            with self._lock:
+                self.requests["single"] += 1
+            return 200, {"status": "success", **fake_verification(query.get("email", ""))}
+        if method == "POST" and path.endswith("/jobs/create"):
+            return 200, self._create(body)
+        if method == "GET" and path.endswith("/jobs/status"):
+            return 200, self._status(query.get("job_id"))
+        if method == "GET" and path.endswith("/jobs/results"):
+            return 200, self._results(query.get("job_id"), int(query.get("page", 1)),
+                                      int(query.get("items_per_page", 1000)))
+        return 404, {"status": "general_failure", "message": "not found"}
+
+    def _create(self, body: Dict) -> Dict:
+        emails: List[str] = [row[0] if isinstance(row, list) else row["email"] for row in body.get("input", [])]
+        job_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self.requests["create"] += 1
+            self.jobs[job_id] = {"emails": emails, "ready_at": time.monotonic() + self.job_latency}
+        return {"status": "success", "job_id": job_id}
+
+    def _status(self, job_id: str) -> Dict:
+        with self._lock:
+            self.requests["status"] += 1
+            job = self.jobs.get(job_id)
+        if not job:
+            return {"status": "general_failure", "message": "job not found"}
+        done = time.monotonic() >= job["ready_at"]
+        return {"status": "success", "job_id": job_id, "job_status": "complete" if done else "running",
+                "total": {"records": len(job["emails"])}}
+
+    def _results(self, job_id: str, page: int, per_page: int) -> Dict:
+        with self._lock:
+            self.requests["results"] += 1
+            job = self.jobs.get(job_id)
+        if not job:
+            return {"status": "general_failure", "message": "job not found"}
+        emails = job["emails"]
+        total_pages = max(1, -(-len(emails) // per_page))
+        page_emails = emails[(page - 1) * per_page:page * per_page]
+        return {
+            "status": "success",
+            "total_pages": total_pages,
+            "results": [{"data": {"email": email}, "verification": fake_verification(email)}
+                        for email in page_emails]
+        }
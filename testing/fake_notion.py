@@ -0,0 +1,85 @@
+﻿import asyncio
+import random
+import uuid
+from collections import Counter
+from typing import Dict
+
+
+class FakeNotionError(Exception):
+    """Mirrors the status/code attributes of notion_client.APIResponseError"""
+
+    def __init__(self, status: int, code: str, message: str = ""):
+        super().__init__(message or code)
+        self.status = status
+        self.code = code
+
+
+class _FakePages:
+    def __init__(self, client: "FakeNotionClient"):
+        self._client = client
+
+    async def create(self, parent: Dict, properties: Dict) -> Dict:
+        await self._client._request("pages.create")
+        page_id = str(uuid.uuid4())
+        self._client.pages_by_id[page_id] = {"id": page_id, "parent": parent, "properties": properties}
+        if self._client._random.random() < self._client.timeout_rate:
+            # The page exists, but the response never arrives
+            self._client.calls["timed_out"] += 1
+            raise asyncio.TimeoutError("request timed out")
+        return self._client.pages_by_id[page_id]
+
+    async def update(self, page_id: str, properties: Dict) -> Dict:
+        await self._client._request("pages.update")
+        page = self._client.pages_by_id.get(page_id)
+        if not page:
+            raise FakeNotionError(404, "object_not_found", f"page {page_id} not found")
+        page["properties"].update(properties)
+        return page
+
+
+class _FakeDatabases:
+    def __init__(self, client: "FakeNotionClient"):
+        self._client = client
+
+    async def query(self, database_id: str, filter: Dict = None, page_size: int = 100) -> Dict:
+        """Supports a single title/rich_text "equals" filter"""
+        await self._client._request("databases.query")
+        results = []
+        for page in self._client.pages_by_id.values():
+            if page["parent"].get("database_id") != database_id:
+                continue
+            if filter:
+                kind = "title" if "title" in filter else "rich_text"
+                value = page["properties"].get(filter["property"], {}).get(kind) or []
+                if "".join(part["text"]["content"] for part in value) != filter[kind]["equals"]:
+                    continue
+            results.append(page)
+        return {"results": results[:page_size], "has_more": len(results) > page_size}
+
+
+class FakeNotionClient:
+    """In-memory stand-in for notion_client.AsyncClient's pages and databases.query APIs
+
+    Records every page and call. rate_limit_rate injects 429 rate_limited
+    errors, timeout_rate makes creates time out after the page was made, and
+    latency simulates the API round trip.
+    """
+
+    def __init__(self, latency: float = 0.0, rate_limit_rate: float = 0.0, timeout_rate: float = 0.0,
+                 seed: int = 7):
+        self.latency = latency
+        self.rate_limit_rate = rate_limit_rate
+        self.timeout_rate = timeout_rate
+        self.pages_by_id: Dict[str, Dict] = {}
+        self.calls = Counter()
+        self.pages = _FakePages(self)
+        self.databases = _FakeDatabases(self)
+        self._random = random.Random(seed)
+
+    async def _request(self, method: str):
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self._random.random() < self.rate_limit_rate:
+            self.calls["rate_limited"] += 1
+            raise FakeNotionError(429, "rate_limited", "Rate limited")
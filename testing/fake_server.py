@@ -0,0 +1,117 @@
+﻿import json
+import multiprocessing
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeJSONServer:
+    """Threaded local HTTP server for JSON API stand-ins
+
+    Subclasses implement handle(method, path, query, body) and return
+    (status, payload) or (status, payload, headers). Query values are lists,
+    as parsed by urllib, so repeated keys like domains[] are preserved.
+    """
+
+    url_prefix = ""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{self.url_prefix}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def handle(self, method: str, path: str, query: Dict[str, List[str]], body: Dict) -> Tuple:
+        raise NotImplementedError
+
+    @classmethod
+    def spawn(cls, **kwargs) -> "ServerProcess":
+        """Run the server in a child process so it doesn't compete for the caller's GIL"""
+        ready = multiprocessing.Queue()
+        process = multiprocessing.Process(target=_serve, args=(cls, kwargs, ready), daemon=True)
+        process.start()
+        return ServerProcess(process, ready.get(timeout=30))
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like the real APIs
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+            def do_PATCH(self):
+                self._dispatch("PATCH")
+
+            def _dispatch(self, method: str):
+                parsed = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                body = json.loads(raw) if raw else {}
+
+                status, payload, *rest = server.handle(method, parsed.path, parse_qs(parsed.query), body)
+                headers = rest[0] if rest else {}
+
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in headers.items():
+                    self.send_header(key, str(value))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class ServerProcess:
+    """Handle for a FakeJSONServer running in a child process"""
+
+    def __init__(self, process: multiprocessing.Process, url: str):
+        self.process = process
+        self.url = url
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _serve(cls, kwargs: Dict, ready: multiprocessing.Queue):
+    server = cls(**kwargs)
+    ready.put(server.url)
+    server._server.serve_forever()
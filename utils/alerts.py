@@ -0,0 +1,291 @@
+﻿import re
+import queue
+import hashlib
+import threading
+from typing import Callable, Dict, Optional
+from datetime import datetime, timedelta
+from loguru import logger
+
+from utils import db
+from utils.db import get_connection
+
+SEVERITY_ORDER = {"low": 0, "medium": 1, "high": 2, "critical": 3}
+
+_MASKS = [
+    (re.compile(r"https?://\S+"), "<url>"),
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+"), "<email>"),
+    (re.compile(r"\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b"), "<uuid>"),
+    (re.compile(r"\b0x[0-9a-f]+\b|\b[0-9a-f]{8,}\b"), "<hex>"),
+    (re.compile(r"\d+(\.\d+)?"), "<n>"),
+    (re.compile(r"\s+"), " "),
+]
+
+
+def normalize_message(message: str) -> str:
+    """Mask the variable parts of an error message (ids, numbers, urls)"""
+    text = str(message).lower()
+    for pattern, replacement in _MASKS:
+        text = pattern.sub(replacement, text)
+    return text.strip()[:300]
+
+
+def alert_fingerprint(alert_type: str, component: str, message: str) -> str:
+    key = f"{alert_type}|{component}|{normalize_message(message)}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+class _OpenAlert:
+    """In-memory aggregate of one alert fingerprint"""
+
+    __slots__ = ("alert_type", "component", "severity", "message", "details",
+                 "alert_id", "count", "unflushed", "first_seen", "last_seen")
+
+    def __init__(self, alert_type, component, severity, message, details, seen):
+        self.alert_type = alert_type
+        self.component = component
+        self.severity = severity
+        self.message = message
+        self.details = details
+        self.alert_id = None
+        self.count = 0
+        self.unflushed = 0
+        self.first_seen = seen
+        self.last_seen = seen
+
+
+class AlertManager:
+    """Deduplicating, non-blocking producer for system_alerts
+
+    report() only does a put_nowait on a bounded queue; when the queue is
+    full the alert is counted as dropped instead of waiting. A background
+    thread folds reports into one aggregate per fingerprint (type, component
+    and normalized message) and periodically writes them, so a storm of
+    identical errors becomes a single row whose details carry the count,
+    first_seen and last_seen. An open alert that sees no repeats for
+    resolve_after seconds is marked resolved.
+
+    Processes often exit long before resolve_after, so the worker also
+    sweeps the table every sweep_interval seconds and on close(), resolving
+    any quiet alert whose last_seen is older than resolve_after, whichever
+    process opened it.
+    """
+
+    def __init__(self, flush_interval: float = 10, resolve_after: float = 600,
+                 max_queue: int = 10000, connection_factory: Optional[Callable] = get_connection,
+                 sweep_interval: float = 300):
+        self.flush_interval = flush_interval
+        self.resolve_after = timedelta(seconds=resolve_after)
+        self.sweep_interval = timedelta(seconds=sweep_interval)
+        self.connection_factory = connection_factory
+        self.dropped = 0
+
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._open: Dict[str, _OpenAlert] = {}  # only touched by the worker thread
+        self._stop = threading.Event()
+        self._worker = None
+        self._start_lock = threading.Lock()
+        self._next_sweep = datetime.min  # first flush sweeps
+
+    def report(self, alert_type: str, component: str, message: str,
+               severity: str = "medium", details: Optional[Dict] = None):
+        """Queue an alert; never blocks and never raises"""
+        try:
+            self._queue.put_nowait((alert_type, component, severity, str(message), details, datetime.now()))
+        except queue.Full:
+            self.dropped += 1
+            return
+        self._ensure_worker()
+
+    def close(self, timeout: float = 10):
+        """Stop the worker after a final drain, flush and sweep"""
+        self._next_sweep = datetime.min
+        self._stop.set()
+        if self._worker:
+            self._worker.join(timeout)
+        else:
+            self._drain()
+            self.flush()
+
+    def flush(self):
+        """Write pending aggregates and auto-resolve quiet alerts (worker thread only)"""
+        if not self.connection_factory:
+            return
+
+        now = datetime.now()
+        sweep = now >= self._next_sweep
+        quiet = [fp for fp, alert in self._open.items()
+                 if alert.alert_id and not alert.unflushed and now - alert.last_seen >= self.resolve_after]
+        if not sweep and not quiet and not any(alert.unflushed for alert in self._open.values()):
+            return
+
+        known_ids = {fp: alert.alert_id for fp, alert in self._open.items()}
+        conn = None
+        try:
+            conn = self.connection_factory()
+            with conn.cursor() as cur:
+                self._attach_existing(cur)
+                inserted = self._insert_new(cur)
+                self._update_counts(cur, skip=inserted)
+                self._resolve(cur, quiet, now)
+                if sweep:
+                    self._sweep(cur, now)
+            conn.commit()
+            if sweep:
+                self._next_sweep = now + self.sweep_interval
+
+            for alert in self._open.values():
+                alert.unflushed = 0
+            for fp in quiet:
+                del self._open[fp]
+
+        except Exception as e:
+            if conn:
+                conn.rollback()
+            # Unwritten counts stay pending and go out with the next flush
+            for fp, alert_id in known_ids.items():
+                self._open[fp].alert_id = alert_id
+            logger.error(f"Alert flush failed: {e}")
+
+        finally:
+            if conn:
+                conn.close()
+
+    def _attach_existing(self, cur):
+        """Reuse unresolved rows for fingerprints another process already opened"""
+        unattached = [fp for fp, alert in self._open.items() if not alert.alert_id]
+        if not unattached:
+            return
+        cur.execute("""
+            SELECT details->>'fingerprint', alert_id
+            FROM system_alerts
+            WHERE resolved = FALSE AND details->>'fingerprint' = ANY(%s)
+        """, (unattached,))
+        for fp, alert_id in cur.fetchall():
+            self._open[fp].alert_id = str(alert_id)
+
+    def _insert_new(self, cur) -> set:
+        new = [(fp, alert) for fp, alert in self._open.items() if not alert.alert_id]
+        if not new:
+            return set()
+        rows = [
+            (alert.alert_type, alert.component, alert.severity, alert.message,
+             db.Json({**(alert.details or {}), **self._counters(fp, alert, alert.unflushed)}))
+            for fp, alert in new
+        ]
+        inserted = db.execute_values(cur, """
+            INSERT INTO system_alerts (alert_type, component, severity, message, details)
+            VALUES %s
+            RETURNING details->>'fingerprint', alert_id
+        """, rows, fetch=True)
+        for fp, alert_id in inserted:
+            self._open[fp].alert_id = str(alert_id)
+        return {fp for fp, _ in inserted}
+
+    def _update_counts(self, cur, skip: set):
+        rows = [
+            (alert.alert_id, alert.unflushed, alert.last_seen.isoformat(), alert.severity)
+            for fp, alert in self._open.items()
+            if alert.alert_id and alert.unflushed and fp not in skip
+        ]
+        if not rows:
+            return
+        db.execute_values(cur, """
+            UPDATE system_alerts AS a SET
+                details = a.details || jsonb_build_object(
+                    'count', COALESCE((a.details->>'count')::int, 0) + v.count,
+                    'last_seen', GREATEST(a.details->>'last_seen', v.last_seen)
+                ),
+                severity = v.severity
+            FROM (VALUES %s) AS v(alert_id, count, last_seen, severity)
+            WHERE a.alert_id = v.alert_id::uuid
+        """, rows)
+
+    def _resolve(self, cur, quiet, now: datetime):
+        if not quiet:
+            return
+        # The last_seen guard keeps alerts open while another process still sees them
+        cur.execute("""
+            UPDATE system_alerts SET
+                resolved = TRUE,
+                resolved_at = NOW(),
+                resolution_notes = %s
+            WHERE alert_id = ANY(%s::uuid[])
+              AND resolved = FALSE
+              AND (details->>'last_seen')::timestamp <= %s
+        """, (
+            self._resolution_note(),
+            [self._open[fp].alert_id for fp in quiet],
+            now - self.resolve_after,
+        ))
+        logger.info(f"Auto-resolved {cur.rowcount} alert(s)")
+
+    def _sweep(self, cur, now: datetime):
+        """Resolve quiet alerts left open by processes that exited before resolving them"""
+        cur.execute("""
+            UPDATE system_alerts SET
+                resolved = TRUE,
+                resolved_at = NOW(),
+                resolution_notes = %s
+            WHERE resolved = FALSE
+              AND details ? 'fingerprint'
+              AND (details->>'last_seen')::timestamp <= %s
+        """, (self._resolution_note(), now - self.resolve_after))
+        if cur.rowcount > 0:
+            logger.info(f"Auto-resolved {cur.rowcount} stale alert(s)")
+
+    def _resolution_note(self) -> str:
+        return f"Auto-resolved: no occurrences for {int(self.resolve_after.total_seconds())}s"
+
+    @staticmethod
+    def _counters(fp: str, alert: _OpenAlert, count: int) -> Dict:
+        return {
+            "fingerprint": fp,
+            "count": count,
+            "first_seen": alert.first_seen.isoformat(),
+            "last_seen": alert.last_seen.isoformat(),
+        }
+
+    def _add(self, alert_type, component, severity, message, details, seen):
+        fp = alert_fingerprint(alert_type, component, message)
+        alert = self._open.get(fp)
+        if alert is None:
+            alert = self._open[fp] = _OpenAlert(alert_type, component, severity, message, details, seen)
+            logger.warning(f"New alert [{severity}] {component}/{alert_type}: {message}")
+        elif SEVERITY_ORDER.get(severity, 1) > SEVERITY_ORDER.get(alert.severity, 1):
+            alert.severity = severity
+        alert.count += 1
+        alert.unflushed += 1
+        alert.last_seen = max(alert.last_seen, seen)
+
+    def _drain(self):
+        while True:
+            try:
+                self._add(*self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if self.dropped:
+            logger.warning(f"Alert queue full, dropped {self.dropped} report(s)")
+            self.dropped = 0
+
+    def _ensure_worker(self):
+        if self._worker:
+            return
+        with self._start_lock:
+            if self._worker:
+                return
+            self._worker = threading.Thread(target=self._run, name="alert-flush", daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        next_flush = datetime.now() + timedelta(seconds=self.flush_interval)
+        while not self._stop.is_set():
+            try:
+                self._add(*self._queue.get(timeout=min(self.flush_interval, 1)))
+            except queue.Empty:
+                pass
+            if datetime.now() >= next_flush:
+                self._drain()
+                self.flush()
+                next_flush = datetime.now() + timedelta(seconds=self.flush_interval)
+        self._drain()
+        self.flush()
@@ -0,0 +1,219 @@
+﻿import json
+import uuid
+from typing import Callable, Dict, List, Optional, Tuple
+from datetime import date, datetime
+from pathlib import Path
+from loguru import logger
+
+from utils.db import get_connection
+
+# config type -> (Postgres cast, pyarrow type factory name)
+COLUMN_TYPES = {
+    "string": ("text", "string"),
+    "int": ("bigint", "int64"),
+    "float": ("float8", "float64"),
+    "bool": ("boolean", "bool_"),
+    "date": ("date", "date32"),
+    "timestamp": ("timestamp", "timestamp"),
+}
+NUMBER_PATTERN = r"^-?[0-9]+(\.[0-9]+)?([eE][-+]?[0-9]+)?$"
+
+
+def _json_field_sql(column: str, path: str, kind: str) -> str:
+    """Extract a JSONB path as text, casting only values that parse as the target type"""
+    keys = ",".join(path.split("."))
+    text = f"({column} #>> '{{{keys}}}')"
+    if kind in ("int", "float"):
+        value = f"CASE WHEN {text} ~ '{NUMBER_PATTERN}' THEN {text}::numeric END"
+        return f"({value})::{COLUMN_TYPES[kind][0]}"
+    if kind == "bool":
+        return f"CASE {text} WHEN 'true' THEN TRUE WHEN 'false' THEN FALSE END"
+    if kind in ("date", "timestamp"):
+        return f"CASE WHEN {text} ~ '^[0-9]{{4}}-[0-9]{{2}}-[0-9]{{2}}' THEN {text}::{COLUMN_TYPES[kind][0]} END"
+    return text
+
+
+class _PartitionWriter:
+    """One Parquet file per date partition, written as .tmp until commit()"""
+
+    def __init__(self, root: Path, schema, compression: str, run_id: str):
+        self.root = root
+        self.schema = schema
+        self.compression = compression
+        self.run_id = run_id
+        self.written: List[Path] = []
+        self._partition = None
+        self._writer = None
+
+    def write(self, partition: str, batch):
+        if partition != self._partition:
+            self._close_current()
+            import pyarrow.parquet as pq
+
+            path = self.root / f"dt={partition}" / f"part-{self.run_id}.parquet.tmp"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._writer = pq.ParquetWriter(str(path), self.schema, compression=self.compression)
+            self._partition = partition
+            self.written.append(path)
+        self._writer.write_batch(batch)
+
+    def commit(self) -> List[Path]:
+        self._close_current()
+        final = []
+        for path in self.written:
+            target = path.with_suffix("")  # drop .tmp
+            path.rename(target)
+            final.append(target)
+        return final
+
+    def abort(self):
+        self._close_current()
+        for path in self.written:
+            path.unlink(missing_ok=True)
+
+    def _close_current(self):
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+            self._partition = None
+
+
+class AnalyticsExporter:
+    """Incremental Parquet export of leads and email_engagement for analysis
+
+    Rows are streamed from a server-side cursor in batches of batch_size,
+    converted to Arrow record batches and appended to a Parquet file per
+    day of the watermark column (exports/<table>/dt=YYYY-MM-DD/), so memory
+    stays bounded by one batch. Selected JSONB fields are flattened in SQL
+    into typed columns. Each table's watermark (last exported timestamp and
+    key) is saved only after its files are complete, and rows newer than
+    safety_lag_seconds are left for the next run so slow-committing
+    transactions are not skipped. Both tables are watermarked on updated_at,
+    so changed leads and engagements (opens, replies) are exported again;
+    readers keep the latest updated_at per key.
+    """
+
+    def __init__(self, config_path: str = "config/analytics_export.json", output_dir: str = "exports",
+                 watermark_file: str = "data/export_watermarks.json",
+                 connection_factory: Callable = get_connection):
+        self.config = self._load_json(Path(config_path), {"tables": {}})
+        self.output_dir = Path(output_dir)
+        self.watermark_file = Path(watermark_file)
+        self.watermarks: Dict[str, Dict] = self._load_json(self.watermark_file, {})
+        self.batch_size = self.config.get("batch_size", 10000)
+        self.safety_lag_seconds = self.config.get("safety_lag_seconds", 300)
+        self.compression = self.config.get("compression", "zstd")
+        self.connection_factory = connection_factory
+
+    def export(self, tables: Optional[List[str]] = None, full: bool = False) -> Dict[str, int]:
+        """Export new rows of each table (all rows when full); returns rows written per table"""
+        return {table: self.export_table(table, full=full) for table in tables or list(self.config["tables"])}
+
+    def export_table(self, table: str, full: bool = False) -> int:
+        spec = self.config["tables"][table]
+        watermark = None if full else self.watermarks.get(table)
+        query, params = self.build_query(table, spec, watermark)
+        schema = self.arrow_schema(spec)
+        names = schema.names
+        key_index = names.index(spec["key"])
+        watermark_index = names.index(spec["watermark"])
+
+        run_id = datetime.now().strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:6]
+        writer = _PartitionWriter(self.output_dir / table, schema, self.compression, run_id)
+        rows_written, last = 0, None
+
+        conn = self.connection_factory()
+        try:
+            conn.set_session(readonly=True)
+            with conn.cursor(name=f"export_{table}") as cur:
+                cur.itersize = self.batch_size
+                cur.execute(query, params)
+                while True:
+                    rows = cur.fetchmany(self.batch_size)
+                    if not rows:
+                        break
+                    for partition, chunk in self._split_by_day(rows, watermark_index):
+                        writer.write(partition, self._to_batch(schema, chunk))
+                    rows_written += len(rows)
+                    last = rows[-1]
+            conn.rollback()
+            files = writer.commit()
+        except Exception:
+            writer.abort()
+            raise
+        finally:
+            conn.close()
+
+        if last is not None:
+            self.watermarks[table] = {"value": last[watermark_index].isoformat(), "key": str(last[key_index])}
+            self._save_watermarks()
+        logger.info(f"Exported {rows_written} {table} rows to {len(files)} Parquet file(s)")
+        return rows_written
+
+    def build_query(self, table: str, spec: Dict, watermark: Optional[Dict]) -> Tuple[str, tuple]:
+        select = [f"{column}::{COLUMN_TYPES[kind][0]} AS {column}" for column, kind in spec["columns"].items()]
+        select += [f"{_json_field_sql(column, path, kind)} AS {name}"
+                   for name, (column, path, kind) in spec.get("json_fields", {}).items()]
+
+        # Qualified: a bare name in ORDER BY means the output column, i.e. the ::text cast
+        mark, key = f"{table}.{spec['watermark']}", f"{table}.{spec['key']}"
+        where = [f"{mark} < LOCALTIMESTAMP - %s * INTERVAL '1 second'"]
+        params = [self.safety_lag_seconds]
+        if watermark:
+            # Keyset on (watermark, key) so rows sharing a timestamp are neither skipped nor repeated.
+            # The key keeps its native type, so the (mark, key) index serves the range and the order.
+            where.append(f"({mark}, {key}) > (%s::timestamp, %s)")
+            params += [watermark["value"], watermark["key"]]
+
+        query = f"""
+            SELECT {', '.join(select)}
+            FROM {table}
+            WHERE {' AND '.join(where)}
+            ORDER BY {mark}, {key}
+        """
+        return query, tuple(params)
+
+    def arrow_schema(self, spec: Dict):
+        import pyarrow as pa
+
+        def arrow_type(kind: str):
+            factory = getattr(pa, COLUMN_TYPES[kind][1])
+            return factory("us") if kind == "timestamp" else factory()
+
+        fields = [pa.field(column, arrow_type(kind)) for column, kind in spec["columns"].items()]
+        fields += [pa.field(name, arrow_type(kind)) for name, (_, _, kind) in spec.get("json_fields", {}).items()]
+        return pa.schema(fields)
+
+    @staticmethod
+    def _split_by_day(rows: List[tuple], watermark_index: int):
+        """Consecutive runs of rows sharing a watermark date (rows arrive ordered by it)"""
+        def day(row) -> date:
+            value = row[watermark_index]
+            return value.date() if isinstance(value, datetime) else value
+
+        start = 0
+        for i in range(1, len(rows) + 1):
+            if i == len(rows) or day(rows[i]) != day(rows[start]):
+                yield day(rows[start]).isoformat(), rows[start:i]
+                start = i
+
+    @staticmethod
+    def _to_batch(schema, rows: List[tuple]):
+        import pyarrow as pa
+
+        columns = list(zip(*rows))
+        return pa.RecordBatch.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema
+        )
+
+    def _save_watermarks(self):
+        self.watermark_file.parent.mkdir(exist_ok=True)
+        with open(self.watermark_file, 'w') as f:
+            json.dump(self.watermarks, f, indent=2)
+
+    @staticmethod
+    def _load_json(path: Path, default: Dict) -> Dict:
+        if path.exists():
+            with open(path, 'r') as f:
+                return json.load(f)
+        return default
@@ -0,0 +1,334 @@
+﻿import json
+import threading
+from typing import Callable, Dict, Optional, Tuple
+from datetime import date
+from pathlib import Path
+from collections import Counter, defaultdict
+from loguru import logger
+
+from utils import db
+from utils.db import get_connection
+
+USAGE_FIELDS = ["requests_made", "requests_successful", "requests_failed", "rate_limit_hits", "credits_used"]
+
+
+class Reservation:
+    """Credits held against a provider's daily budget for one API call"""
+
+    __slots__ = ("provider", "operation", "credits", "day")
+
+    def __init__(self, provider: str, operation: str, credits: int, day: date):
+        self.provider = provider
+        self.operation = operation
+        self.credits = credits
+        self.day = day
+
+
+class BudgetGovernor:
+    """Live per-provider daily credit and cost budget
+
+    Callers reserve credits before an API call and settle the reservation
+    with what was actually used afterwards. Usage is kept in memory and flushed
+    periodically to api_usage_tracking. The day's totals are read before the
+    first reservation of the day, and each flush upserts increments and reads
+    them back, so spend from other concurrent runs is picked up within one
+    flush interval. When a run id is given, start_run() creates its
+    workflow_runs row and per-run costs go to workflow_costs in a separate
+    transaction; until the row exists they stay buffered.
+    """
+
+    def __init__(self, config_path: str = "config/budget_config.json",
+                 workflow_run_id: Optional[str] = None,
+                 connection_factory: Optional[Callable] = get_connection):
+        self.config = self._load_config(config_path)
+        self.providers = self.config["providers"]
+        self.soft_limit_ratio = self.config.get("soft_limit_ratio", 0.8)
+        self.flush_interval = self.config.get("flush_interval_seconds", 30)
+        self.workflow_run_id = workflow_run_id
+        self.connection_factory = connection_factory
+
+        self._lock = threading.Lock()
+        self._global_credits: Dict[Tuple[date, str], int] = defaultdict(int)  # all runs, as of last flush
+        self._pending: Dict[Tuple[date, str], Counter] = defaultdict(Counter)  # not yet flushed
+        self._flushing: Dict[Tuple[date, str], int] = defaultdict(int)  # credits in an in-progress flush
+        self._reserved: Dict[Tuple[date, str], int] = defaultdict(int)
+        self._run_costs = Counter()  # workflow_costs column -> increment
+        self._cost_id = None
+        self._totals_day = None  # day whose totals from other runs have been read
+        self._totals_lock = threading.Lock()
+        self._run_started = False
+        self.denied = Counter()
+
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher = None
+
+    def reserve(self, provider: str, operation: str, units: int = 1) -> Optional[Reservation]:
+        """Hold credits for a call, or return None if it would exceed the daily budget"""
+        credits = units * self._operation_credits(provider, operation)
+        key = (date.today(), provider)
+        limit = self._credit_limit(provider)
+        if self._totals_day != key[0]:
+            self._load_totals(key[0])
+
+        with self._lock:
+            if credits and self._used(key) + credits > limit:
+                self.denied[provider] += 1
+                logger.warning(
+                    f"{provider} budget exhausted: {self._used(key)}/{limit} credits used, "
+                    f"denied {operation} needing {credits}"
+                )
+                return None
+            self._reserved[key] += credits
+
+        self._ensure_flusher()
+        return Reservation(provider, operation, credits, key[0])
+
+    def settle(self, reservation: Reservation, units_used: int, success: bool = True,
+               rate_limited: bool = False):
+        """Record what a call actually used and release the rest of its reservation"""
+        with self._lock:
+            self._reserved[(reservation.day, reservation.provider)] -= reservation.credits
+            self._add_usage(reservation.provider, reservation.operation, units_used, reservation.day,
+                            requests=1, failed=0 if success else 1, rate_limited=int(rate_limited))
+
+    def record(self, provider: str, operation: str, units_used: int, requests: int = 1,
+               failed: int = 0, rate_limited: int = 0):
+        """Add usage that was metered elsewhere, e.g. by sourcing worker processes"""
+        with self._lock:
+            self._add_usage(provider, operation, units_used, date.today(), requests, failed, rate_limited)
+
+    def release(self, reservation: Reservation):
+        """Drop a reservation for a call that was never made"""
+        with self._lock:
+            self._reserved[(reservation.day, reservation.provider)] -= reservation.credits
+
+    def utilization(self, provider: str) -> float:
+        """Fraction of today's credit budget used or reserved across all runs"""
+        with self._lock:
+            used = self._used((date.today(), provider))
+        return used / max(self._credit_limit(provider), 1)
+
+    def should_skip(self, provider: str, priority: int = 1) -> bool:
+        """Past the soft limit only priority-1 work still runs; at the hard limit nothing does"""
+        utilization = self.utilization(provider)
+        if utilization >= 1:
+            return True
+        return utilization >= self.soft_limit_ratio and priority > 1
+
+    def remaining_credits(self, provider: str) -> float:
+        """Credits left today across all runs, as of the last flush"""
+        with self._lock:
+            used = self._used((date.today(), provider))
+        return max(0, self._credit_limit(provider) - used)
+
+    def recommended_concurrency(self, provider: str, max_concurrency: int) -> int:
+        """Scale concurrency down linearly between the soft and hard limits"""
+        utilization = self.utilization(provider)
+        if utilization < self.soft_limit_ratio:
+            return max_concurrency
+        headroom = max(0.0, 1 - utilization) / (1 - self.soft_limit_ratio)
+        return max(1, int(max_concurrency * headroom))
+
+    def start_run(self, batch_number: int = 1, status: str = "running"):
+        """Create the workflow_runs row this run's workflow_costs reference"""
+        if not self.workflow_run_id:
+            return
+        self._run_started = self._write_run("""
+            INSERT INTO workflow_runs (workflow_run_id, batch_number, date, started_at, status)
+            VALUES (%s, %s, CURRENT_DATE, NOW(), %s)
+            ON CONFLICT (workflow_run_id) DO NOTHING
+        """, (self.workflow_run_id, batch_number, status))
+
+    def flush(self):
+        """Push buffered usage to the tracking tables and refresh global totals"""
+        if not self.connection_factory:
+            return
+
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, defaultdict(Counter)
+                run_costs, self._run_costs = self._run_costs, Counter()
+                for key, usage in pending.items():
+                    self._flushing[key] += usage["credits_used"]
+
+            conn = None
+            try:
+                conn = self.connection_factory()
+                totals = self._write_usage(conn, pending)
+                conn.commit()
+
+                with self._lock:
+                    self._global_credits.update(totals)
+                    for key, usage in pending.items():
+                        self._flushing[key] -= usage["credits_used"]
+                pending = {}
+
+                # Separate transaction: a missing run row must not roll back usage
+                if self.workflow_run_id and run_costs:
+                    if self._write_workflow_costs(conn, run_costs):
+                        conn.commit()
+                        run_costs = Counter()
+                    else:
+                        conn.rollback()
+
+            except Exception as e:
+                if conn:
+                    conn.rollback()
+                logger.error(f"Budget flush failed: {e}")
+                with self._lock:
+                    for key, usage in pending.items():
+                        self._flushing[key] -= usage["credits_used"]
+                        self._pending[key].update(usage)
+
+            finally:
+                if run_costs:
+                    with self._lock:
+                        self._run_costs.update(run_costs)
+                if conn:
+                    conn.close()
+
+    def close(self, status: str = "completed"):
+        self._stop.set()
+        if self._flusher:
+            self._flusher.join()
+        self.flush()
+        if self._run_costs:
+            logger.warning(f"Run costs for {self.workflow_run_id} not written: no workflow_runs row")
+        if self._run_started:
+            self._write_run("""
+                UPDATE workflow_runs SET status = %s, completed_at = NOW()
+                WHERE workflow_run_id = %s
+            """, (status, self.workflow_run_id))
+
+    def _load_totals(self, day: date):
+        """Read the day's totals from all runs once, before its first reservation is approved"""
+        with self._totals_lock:
+            if self._totals_day != day:
+                self.flush()
+                self._totals_day = day
+
+    def _write_run(self, sql: str, params: tuple) -> bool:
+        if not self.connection_factory:
+            return False
+        conn = None
+        try:
+            conn = self.connection_factory()
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+            conn.commit()
+            return True
+        except Exception as e:
+            if conn:
+                conn.rollback()
+            logger.error(f"Could not write workflow_runs row {self.workflow_run_id}: {e}")
+            return False
+        finally:
+            if conn:
+                conn.close()
+
+    def _write_usage(self, conn, pending: Dict[Tuple[date, str], Counter]) -> Dict[Tuple[date, str], int]:
+        today = date.today()
+        with conn.cursor() as cur:
+            if pending:
+                rows = [
+                    (day, provider, *[usage[field] for field in USAGE_FIELDS])
+                    for (day, provider), usage in pending.items()
+                ]
+                db.execute_values(cur, f"""
+                    INSERT INTO api_usage_tracking (date, api_provider, {', '.join(USAGE_FIELDS)})
+                    VALUES %s
+                    ON CONFLICT (date, api_provider) DO UPDATE SET
+                        {', '.join(f'{field} = COALESCE(api_usage_tracking.{field}, 0) + EXCLUDED.{field}'
+                                   for field in USAGE_FIELDS)}
+                """, rows)
+
+            # Read back today's totals, which include other runs' flushes
+            cur.execute("""
+                SELECT api_provider, COALESCE(credits_used, 0)
+                FROM api_usage_tracking
+                WHERE date = %s
+            """, (today,))
+            return {(today, provider): credits for provider, credits in cur.fetchall()}
+
+    def _write_workflow_costs(self, conn, run_costs: Counter) -> bool:
+        """Add run costs to workflow_costs; False while the workflow_runs row doesn't exist"""
+        total = sum(value for column, value in run_costs.items() if column.endswith("_costs"))
+        columns = list(run_costs)
+
+        with conn.cursor() as cur:
+            if self._cost_id is None:
+                cur.execute("SELECT 1 FROM workflow_runs WHERE workflow_run_id = %s", (self.workflow_run_id,))
+                if cur.fetchone() is None:
+                    return False
+                cur.execute(f"""
+                    INSERT INTO workflow_costs (workflow_run_id, date, total_cost, {', '.join(columns)})
+                    VALUES (%s, CURRENT_DATE, %s, {', '.join(['%s'] * len(columns))})
+                    RETURNING cost_id
+                """, (self.workflow_run_id, total, *[run_costs[column] for column in columns]))
+                self._cost_id = cur.fetchone()[0]
+            else:
+                cur.execute(f"""
+                    UPDATE workflow_costs SET
+                        total_cost = COALESCE(total_cost, 0) + %s,
+                        {', '.join(f'{column} = COALESCE({column}, 0) + %s' for column in columns)}
+                    WHERE cost_id = %s
+                """, (total, *[run_costs[column] for column in columns], self._cost_id))
+        return True
+
+    def _add_usage(self, provider: str, operation: str, units_used: int, day: date,
+                   requests: int, failed: int, rate_limited: int):
+        """Buffer usage for the next flush (caller holds the lock)"""
+        credits = units_used * self._operation_credits(provider, operation)
+        settings = self.providers.get(provider, {})
+        columns = settings.get("workflow_cost_columns", {})
+
+        usage = self._pending[(day, provider)]
+        usage["requests_made"] += requests
+        usage["requests_successful"] += requests - failed
+        usage["requests_failed"] += failed
+        usage["rate_limit_hits"] += rate_limited
+        usage["credits_used"] += credits
+
+        if operation in columns:
+            self._run_costs[columns[operation]] += units_used
+        if "cost" in columns:
+            self._run_costs[columns["cost"]] += credits * settings.get("cost_per_credit", 0)
+
+    def _used(self, key: Tuple[date, str]) -> int:
+        """Credits used or held for key (caller holds the lock)"""
+        return (self._global_credits[key] + self._flushing[key]
+                + self._pending[key]["credits_used"] + self._reserved[key])
+
+    def _credit_limit(self, provider: str) -> int:
+        settings = self.providers.get(provider, {})
+        limit = settings.get("daily_credit_limit", float("inf"))
+        cost_per_credit = settings.get("cost_per_credit", 0)
+        if cost_per_credit and "daily_cost_limit" in settings:
+            limit = min(limit, settings["daily_cost_limit"] / cost_per_credit)
+        return limit
+
+    def _operation_credits(self, provider: str, operation: str) -> int:
+        return self.providers.get(provider, {}).get("operation_credits", {}).get(operation, 1)
+
+    def _ensure_flusher(self):
+        if self._flusher or not self.connection_factory:
+            return
+        with self._lock:
+            if self._flusher:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name="budget-flush", daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def _load_config(self, config_path: str) -> dict:
+        path = Path(config_path)
+        if not path.exists():
+            logger.error(f"Budget config not found: {config_path}")
+            return {"providers": {}}
+
+        with open(path, 'r') as f:
+            return json.load(f)
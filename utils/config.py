@@ -0,0 +1,12 @@
+﻿from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def load_env() -> bool:
+    """Load .env into os.environ once per process
+
+    Called from constructors instead of at import time, so importing a module
+    never touches the filesystem and repeated calls are free.
+    """
+    from dotenv import load_dotenv
+    return load_dotenv()
@@ -0,0 +1,32 @@
+﻿import os
+
+from utils import tracing
+from utils.config import load_env
+
+# psycopg2.extras helpers, resolved on first use so importing this module
+# (or anything that only needs get_connection) doesn't load psycopg2
+_LAZY_EXTRAS = {"Json", "RealDictCursor", "execute_values"}
+
+def get_connection(**overrides):
+    """Open a PostgreSQL connection using the DB_* environment variables"""
+    import psycopg2
+
+    load_env()
+    config = {
+        'host': os.getenv('DB_HOST', 'localhost'),
+        'port': os.getenv('DB_PORT', '5432'),
+        'database': os.getenv('DB_NAME', 'onpulse_outreach'),
+        'user': os.getenv('DB_USER', 'postgres'),
+        'password': os.getenv('DB_PASSWORD', '')
+    }
+    config.update(overrides)
+    if tracing.enabled():
+        # Every cursor on the connection records a span per statement
+        config.setdefault('connection_factory', tracing.traced_connection_class())
+    return psycopg2.connect(**config)
+
+def __getattr__(name):
+    if name in _LAZY_EXTRAS:
+        import psycopg2.extras
+        return getattr(psycopg2.extras, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
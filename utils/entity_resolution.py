@@ -0,0 +1,424 @@
+﻿import re
+import uuid
+import zlib
+import random
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from collections import Counter, defaultdict
+from loguru import logger
+
+from utils import db
+from utils.db import get_connection
+
+LEGAL_SUFFIXES = {
+    "inc", "incorporated", "llc", "llp", "ltd", "limited", "co", "corp", "corporation",
+    "company", "pc", "pllc", "plc", "lp", "the",
+}
+FREE_MAIL_DOMAINS = {
+    "gmail.com", "googlemail.com", "yahoo.com", "hotmail.com", "outlook.com", "live.com",
+    "msn.com", "aol.com", "icloud.com", "me.com", "mac.com", "protonmail.com", "comcast.net",
+    "att.net", "verizon.net", "sbcglobal.net",
+}
+SECOND_LEVEL_SUFFIXES = {"co.uk", "com.au", "co.nz", "co.za", "com.br", "com.mx", "co.jp"}
+NICKNAMES = {
+    "bob": "robert", "rob": "robert", "bobby": "robert", "bill": "william", "will": "william",
+    "billy": "william", "jim": "james", "jimmy": "james", "mike": "michael", "dave": "david",
+    "dan": "daniel", "danny": "daniel", "tom": "thomas", "tony": "anthony", "joe": "joseph",
+    "chris": "christopher", "matt": "matthew", "nick": "nicholas", "steve": "steven",
+    "rick": "richard", "dick": "richard", "rich": "richard", "ed": "edward", "ted": "edward",
+    "jeff": "jeffrey", "greg": "gregory", "ken": "kenneth", "larry": "lawrence", "andy": "andrew",
+    "liz": "elizabeth", "beth": "elizabeth", "kate": "katherine", "katie": "katherine",
+    "jen": "jennifer", "jenny": "jennifer", "sue": "susan", "pat": "patricia", "patty": "patricia",
+}
+_NON_ALNUM = re.compile(r"[^a-z0-9 ]+")
+_MERSENNE = (1 << 61) - 1
+
+
+def normalize_company(name: Optional[str]) -> str:
+    """Lowercase, drop punctuation and legal suffixes: 'Acme Tools, Inc.' -> 'acme tools'"""
+    text = _NON_ALNUM.sub(" ", (name or "").lower().replace("&", " and "))
+    return " ".join(word for word in text.split() if word not in LEGAL_SUFFIXES)
+
+
+def normalize_first_name(name: Optional[str]) -> str:
+    first = _NON_ALNUM.sub("", (name or "").lower().split(" ")[0] if name else "")
+    return NICKNAMES.get(first, first)
+
+
+def normalize_last_name(name: Optional[str]) -> str:
+    words = _NON_ALNUM.sub(" ", (name or "").lower()).split()
+    words = [w for w in words if w not in {"jr", "sr", "ii", "iii", "iv"}]
+    return "".join(words)
+
+
+def domain_root(value: Optional[str]) -> Optional[str]:
+    """Registrable domain of a URL, domain or email; None for free-mail providers"""
+    if not value:
+        return None
+    host = value.lower().strip().rsplit("@", 1)[-1]
+    host = re.sub(r"^[a-z]+://", "", host).split("/")[0].split(":")[0]
+    labels = [label for label in host.split(".") if label]
+    if len(labels) < 2:
+        return None
+    keep = 3 if ".".join(labels[-2:]) in SECOND_LEVEL_SUFFIXES else 2
+    root = ".".join(labels[-keep:])
+    return None if root in FREE_MAIL_DOMAINS else root
+
+
+def shingles(text: str, size: int = 3) -> Set[str]:
+    padded = f" {text} "
+    return {padded[i:i + size] for i in range(max(1, len(padded) - size + 1))}
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+class MinHasher:
+    """MinHash signatures over string shingles, stable across processes (crc32-based)"""
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        rng = random.Random(seed)
+        self.params = [(rng.randrange(1, _MERSENNE), rng.randrange(0, _MERSENNE)) for _ in range(num_perm)]
+
+    def signature(self, tokens: Set[str]) -> Tuple[int, ...]:
+        hashes = [zlib.crc32(token.encode("utf-8")) for token in tokens]
+        return tuple(min((a * h + b) % _MERSENNE for h in hashes) for a, b in self.params)
+
+
+class _Person:
+    __slots__ = ("lead_id", "canonical", "first")
+
+    def __init__(self, lead_id: str, canonical: str, first: str):
+        self.lead_id = lead_id
+        self.canonical = canonical
+        self.first = first
+
+
+class _UnionFind:
+    def __init__(self):
+        self.parent: Dict[str, str] = {}
+
+    def add(self, item: str):
+        self.parent.setdefault(item, item)
+
+    def find(self, item: str) -> str:
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, keep: str, other: str) -> Tuple[str, str]:
+        """Merge other's set into keep's; returns (surviving root, absorbed root)"""
+        keep_root, other_root = self.find(keep), self.find(other)
+        if keep_root != other_root:
+            self.parent[other_root] = keep_root
+        return keep_root, other_root
+
+
+class _PeopleIndex:
+    """Known people by email and by (company cluster, last name), each with its canonical id"""
+
+    def __init__(self, resolver: "EntityResolver"):
+        self.resolver = resolver
+        self.by_email: Dict[str, _Person] = {}
+        self.by_company_last: Dict[Tuple[str, str], List[_Person]] = defaultdict(list)
+
+    def find(self, lead: Dict) -> Tuple[Optional[_Person], Optional[str]]:
+        email = (lead.get("email") or "").lower()
+        if email in self.by_email:
+            return self.by_email[email], "email"
+
+        first, last = normalize_first_name(lead.get("first_name")), normalize_last_name(lead.get("last_name"))
+        company = self.resolver.company_key(lead.get("company_name"), lead.get("domain") or email)
+        if not (first and last and company):
+            return None, None
+        # Exact first name after folding nicknames; "Al" is not "Alan" or "Alice"
+        for person in self.by_company_last.get((self.resolver.company_root(company), last), ()):
+            if person.first == first:
+                return person, "name+company"
+        return None, None
+
+    def add(self, lead_id: str, canonical: str, email, first, last, company_name, domain):
+        email = (email or "").lower()
+        person = _Person(lead_id, canonical, normalize_first_name(first))
+        if email:
+            self.by_email.setdefault(email, person)
+
+        last = normalize_last_name(last)
+        company = self.resolver.company_key(company_name, domain or email)
+        if company and last:
+            self.by_company_last[(self.resolver.company_root(company), last)].append(person)
+
+
+class EntityResolver:
+    """Entity resolution for leads against the leads table
+
+    Companies are keyed by domain root (work domain or website) or, without
+    one, by normalized name. Name variants are found through MinHash/LSH
+    buckets over character trigrams and confirmed by exact trigram Jaccard,
+    then merged into one company cluster; a cluster never holds two real
+    domains, even through name-only intermediates. Known companies
+    (company_intelligence_cache) are blocked in SQL as well: each batch
+    indexes only those sharing a domain with it or with a trigram-similar
+    name (pg_trgm), so no process rebuilds the index for the whole table.
+    backfill() is the exception and loads every company once.
+
+    For each batch, candidate leads are blocked in SQL: those sharing an
+    email, a domain of the batch's company clusters or, for companies known
+    only by name, one of the cluster's names. A lead is a duplicate when it
+    shares an email with a candidate, or its first name (nicknames folded)
+    and last name match a candidate at the same company; it then takes that
+    candidate's canonical id. Nothing from a batch is remembered after
+    resolve_batch, so the next batch only sees leads that were committed.
+    """
+
+    def __init__(self, connection_factory: Optional[Callable] = get_connection,
+                 name_threshold: float = 0.7, num_perm: int = 64, bands: int = 16,
+                 max_candidates: int = 20):
+        self.connection_factory = connection_factory
+        self.name_threshold = name_threshold
+        self.max_candidates = max_candidates
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.minhasher = MinHasher(num_perm)
+        self.loaded = False  # every known company indexed (backfill)
+
+        self._companies = _UnionFind()
+        self._lsh: Dict[Tuple[int, Tuple[int, ...]], List[str]] = defaultdict(list)  # band -> names
+        self._name_keys: Dict[str, str] = {}  # normalized name -> company key it was first seen with
+        self._members: Dict[str, Set[str]] = {}  # cluster root -> company keys
+        self._domains: Dict[str, Set[str]] = {}  # cluster root -> real domains (at most one)
+        self._raw_names: Dict[str, Set[str]] = defaultdict(set)  # company key -> names as stored
+
+    def load(self) -> int:
+        """Stream every known company into the company index (backfill); returns companies read"""
+        count = 0
+        conn = self.connection_factory()
+        try:
+            with conn.cursor(name="entity_companies") as cur:
+                cur.itersize = 5000
+                cur.execute("SELECT domain, company_name FROM company_intelligence_cache")
+                for domain, company_name in cur:
+                    self.company_key(company_name, domain)
+                    count += 1
+            conn.rollback()
+        finally:
+            conn.close()
+
+        self.loaded = True
+        logger.info(f"Entity index loaded: {count} companies, {len(self._companies.parent)} company keys")
+        return count
+
+    def resolve_batch(self, leads: List[Dict]) -> List[Dict]:
+        """Assign lead_id/canonical_lead_id to each lead and return the duplicates
+
+        canonical_lead_id stays None for leads that are their own canonical
+        record; duplicates also get match_reason. Later leads in the same
+        batch are resolved against earlier ones.
+        """
+        if not self.loaded and self.connection_factory:
+            self._load_companies(leads)
+
+        index = _PeopleIndex(self)
+        for lead in leads:
+            lead.setdefault("lead_id", str(uuid.uuid4()))
+            self.company_key(lead.get("company_name"), lead.get("domain") or lead.get("email"))
+        if self.connection_factory:
+            for row in self._fetch_candidates(leads):
+                lead_id, email, first, last, company_name, domain, canonical = row
+                index.add(str(lead_id), str(canonical or lead_id), email, first, last, company_name, domain)
+
+        duplicates = []
+        for lead in leads:
+            match, reason = index.find(lead)
+            if match:
+                lead["canonical_lead_id"] = match.canonical
+                lead["match_reason"] = reason
+                duplicates.append(lead)
+            else:
+                lead["canonical_lead_id"] = None
+            index.add(lead["lead_id"], lead["canonical_lead_id"] or lead["lead_id"], lead.get("email"),
+                      lead.get("first_name"), lead.get("last_name"), lead.get("company_name"), lead.get("domain"))
+
+        if duplicates:
+            logger.info(f"Entity resolution: {len(duplicates)}/{len(leads)} leads are duplicates")
+        return duplicates
+
+    def company_key(self, company_name: Optional[str], domain_or_email: Optional[str]) -> Optional[str]:
+        """Company key for a name/domain pair, indexing and merging it into its cluster"""
+        root = domain_root(domain_or_email)
+        name = normalize_company(company_name)
+        key = root or (f"name:{name}" if name else None)
+        if key is None:
+            return None
+
+        if key not in self._companies.parent:
+            self._companies.add(key)
+            self._members[key] = {key}
+            self._domains[key] = {root} if root else set()
+        if company_name:
+            self._raw_names[key].add(company_name)
+        if not name:
+            return key
+        if name in self._name_keys:
+            other = self._name_keys[name]
+        else:
+            tokens = shingles(name)
+            bands = self._bands(tokens)
+            similar = self._similar_name(tokens, bands)
+            other = self._name_keys[similar] if similar else None
+            self._name_keys[name] = key
+            for band in bands:
+                self._lsh[band].append(name)
+        if other and other != key:
+            self._merge_companies(other, key)
+        return key
+
+    def company_root(self, key: str) -> str:
+        return self._companies.find(key)
+
+    def backfill(self, batch_size: int = 1000) -> int:
+        """Write canonical ids for historical duplicates, streaming every lead once in creation order"""
+        if not self.loaded:
+            self.load()
+
+        index = _PeopleIndex(self)
+        links = []
+        conn = self.connection_factory()
+        try:
+            with conn.cursor(name="entity_leads") as cur:
+                cur.itersize = 5000
+                cur.execute("""
+                    SELECT lead_id, email, first_name, last_name, company_name, domain, canonical_lead_id
+                    FROM leads
+                    ORDER BY created_at, lead_id
+                """)
+                for lead_id, email, first, last, company_name, domain, stored in cur:
+                    lead_id = str(lead_id)
+                    canonical = str(stored) if stored else None
+                    if canonical is None:
+                        match, _ = index.find({"email": email, "first_name": first, "last_name": last,
+                                               "company_name": company_name, "domain": domain})
+                        if match:
+                            canonical = match.canonical
+                            links.append((lead_id, canonical))
+                    index.add(lead_id, canonical or lead_id, email, first, last, company_name, domain)
+            conn.rollback()
+
+            with conn.cursor() as cur:
+                for i in range(0, len(links), batch_size):
+                    db.execute_values(cur, """
+                        UPDATE leads AS l
+                        SET canonical_lead_id = v.canonical_lead_id::uuid
+                        FROM (VALUES %s) AS v(lead_id, canonical_lead_id)
+                        WHERE l.lead_id = v.lead_id::uuid
+                            AND l.canonical_lead_id IS DISTINCT FROM v.canonical_lead_id::uuid
+                    """, links[i:i + batch_size])
+            conn.commit()
+        finally:
+            conn.close()
+
+        logger.info(f"Linked {len(links)} historical duplicate leads")
+        return len(links)
+
+    def _load_companies(self, leads: List[Dict]) -> int:
+        """Index the known companies a batch could belong to: same domain, or a similar name"""
+        domains, names = set(), set()
+        for lead in leads:
+            domain = lead.get("domain") or lead.get("email")
+            root = domain_root(domain)
+            if root:
+                domains.update({root, domain.lower().strip()})
+            name = normalize_company(lead.get("company_name"))
+            if name:
+                names.add(name)
+        if not (domains or names):
+            return 0
+
+        count = 0
+        conn = self.connection_factory()
+        try:
+            with conn.cursor() as cur:
+                # One trigram index probe (idx_company_name_trgm) per batch name
+                cur.execute("""
+                    SELECT domain, company_name
+                    FROM company_intelligence_cache
+                    WHERE domain = ANY(%s)
+                    UNION
+                    SELECT c.domain, c.company_name
+                    FROM unnest(%s::text[]) AS n(name)
+                    JOIN company_intelligence_cache c ON lower(c.company_name) %% n.name
+                """, (sorted(domains), sorted(names)))
+                for domain, company_name in cur.fetchall():
+                    self.company_key(company_name, domain)
+                    count += 1
+            conn.rollback()
+        finally:
+            conn.close()
+        return count
+
+    def _fetch_candidates(self, leads: List[Dict]) -> List[tuple]:
+        """Known leads that could match the batch: same email, cluster domain or cluster name"""
+        emails, domains, names = set(), set(), set()
+        for lead in leads:
+            if lead.get("email"):
+                emails.update({lead["email"], lead["email"].lower()})
+            key = self.company_key(lead.get("company_name"), lead.get("domain") or lead.get("email"))
+            if key is None:
+                continue
+            root = self.company_root(key)
+            domains.update(self._domains[root])
+            for member in self._members[root]:
+                names.update(self._raw_names.get(member, ()))
+        if not (emails or domains or names):
+            return []
+
+        conn = self.connection_factory()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT lead_id, email, first_name, last_name, company_name, domain, canonical_lead_id
+                    FROM leads
+                    WHERE email = ANY(%s)
+                       OR domain = ANY(%s)
+                       OR (domain IS NULL AND company_name = ANY(%s))
+                    ORDER BY created_at, lead_id
+                """, (sorted(emails), sorted(domains), sorted(names)))
+                rows = cur.fetchall()
+            conn.rollback()
+        finally:
+            conn.close()
+        return rows
+
+    def _similar_name(self, tokens: Set[str], bands: List[tuple]) -> Optional[str]:
+        """Known company name within name_threshold trigram Jaccard, via LSH candidates"""
+        hits = Counter()
+        for band in bands:
+            hits.update(self._lsh.get(band, ()))
+
+        # Names sharing the most bands are the likeliest matches; only those are verified
+        best, best_score = None, self.name_threshold
+        for candidate, _ in hits.most_common(self.max_candidates):
+            score = jaccard(tokens, shingles(candidate))
+            if score >= best_score:
+                best, best_score = candidate, score
+        return best
+
+    def _bands(self, tokens: Set[str]):
+        signature = self.minhasher.signature(tokens)
+        rows = self.rows_per_band
+        return [(i, signature[i * rows:(i + 1) * rows]) for i in range(self.bands)]
+
+    def _merge_companies(self, keep: str, other: str):
+        keep_root, other_root = self._companies.find(keep), self._companies.find(other)
+        if keep_root == other_root:
+            return
+        # Two different real domains are two companies, however alike the names, also
+        # when the link runs through name-only keys already merged into either side
+        if self._domains[keep_root] and self._domains[other_root]:
+            return
+        self._companies.union(keep_root, other_root)
+        self._members[keep_root] |= self._members.pop(other_root)
+        self._domains[keep_root] |= self._domains.pop(other_root)
@@ -0,0 +1,133 @@
+﻿import uuid
+from typing import Callable, Dict, List, Optional
+from loguru import logger
+
+from utils import db
+from utils.db import get_connection
+
+LEAD_COLUMNS = [
+    "lead_id", "canonical_lead_id", "sequence_status", "email", "first_name", "last_name", "title", "company_name", "domain", "revenue",
+    "employees", "industry", "icp_score", "apollo_person_data", "workflow_run_id", "batch_number"
+]
+
+
+class LeadStore:
+    """Writes sourced leads, with org data stored once per domain
+
+    Orgs go to company_intelligence_cache keyed by domain, and leads reference
+    them through leads.domain instead of carrying their own copy in
+    apollo_org_data.
+    """
+
+    def __init__(self, connection_factory: Callable = get_connection, org_ttl_days: int = 90):
+        self.connection_factory = connection_factory
+        self.org_ttl_days = org_ttl_days
+
+    def save_batch(self, leads: List[Dict], orgs_by_domain: Dict[str, Dict],
+                   workflow_run_id: Optional[str] = None, batch_number: Optional[int] = None) -> int:
+        """Upsert the batch's orgs and insert its new leads in one transaction"""
+        conn = self.connection_factory()
+        try:
+            self.save_orgs(conn, orgs_by_domain)
+            inserted = self.save_leads(conn, leads, workflow_run_id, batch_number)
+            conn.commit()
+            return inserted
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def save_orgs(self, conn, orgs_by_domain: Dict[str, Dict]):
+        rows = [
+            (
+                domain,
+                org.get("name"),
+                db.Json(org),
+                org.get("estimated_annual_revenue"),
+                org.get("estimated_num_employees"),
+                org.get("industry"),
+                org.get("founded_year"),
+            )
+            for domain, org in orgs_by_domain.items()
+            if domain and org
+        ]
+        if not rows:
+            return
+
+        with conn.cursor() as cur:
+            db.execute_values(cur, f"""
+                INSERT INTO company_intelligence_cache (
+                    domain, company_name, apollo_data, revenue, employees, industry,
+                    years_in_business, last_updated, expires_at
+                )
+                SELECT v.domain, v.company_name, v.apollo_data, v.revenue, v.employees, v.industry,
+                       EXTRACT(YEAR FROM NOW())::int - v.founded_year,
+                       NOW(), NOW() + INTERVAL '{int(self.org_ttl_days)} days'
+                FROM (VALUES %s) AS v(domain, company_name, apollo_data, revenue, employees,
+                                      industry, founded_year)
+                ON CONFLICT (domain) DO UPDATE SET
+                    company_name = EXCLUDED.company_name,
+                    apollo_data = EXCLUDED.apollo_data,
+                    revenue = EXCLUDED.revenue,
+                    employees = EXCLUDED.employees,
+                    industry = EXCLUDED.industry,
+                    years_in_business = EXCLUDED.years_in_business,
+                    last_updated = EXCLUDED.last_updated,
+                    expires_at = EXCLUDED.expires_at
+            """, rows, template="(%s, %s, %s::jsonb, %s::bigint, %s::int, %s, %s::int)")
+        logger.info(f"Stored {len(rows)} organizations in company_intelligence_cache")
+
+    def save_leads(self, conn, leads: List[Dict], workflow_run_id: Optional[str],
+                   batch_number: Optional[int]) -> int:
+        rows = [
+            (
+                lead.get("lead_id") or str(uuid.uuid4()),
+                lead.get("canonical_lead_id"),
+                lead.get("sequence_status") or "active",
+                lead["email"],
+                lead.get("first_name"),
+                lead.get("last_name"),
+                lead.get("title"),
+                lead.get("company_name"),
+                lead.get("domain"),
+                lead.get("revenue"),
+                lead.get("company_size") or lead.get("employees"),
+                lead.get("industry"),
+                lead.get("icp_score"),
+                db.Json(lead.get("person_data") or {}),
+                workflow_run_id,
+                batch_number,
+            )
+            for lead in leads
+            if lead.get("email")
+        ]
+        if not rows:
+            return 0
+
+        with conn.cursor() as cur:
+            inserted_ids = {str(lead_id) for lead_id, in db.execute_values(cur, f"""
+                INSERT INTO leads ({', '.join(LEAD_COLUMNS)})
+                VALUES %s
+                ON CONFLICT (email) DO NOTHING
+                RETURNING lead_id
+            """, rows, fetch=True)}
+            self._relink_dropped_canonicals(cur, rows, inserted_ids)
+        logger.info(f"Inserted {len(inserted_ids)}/{len(rows)} leads")
+        return len(inserted_ids)
+
+    @staticmethod
+    def _relink_dropped_canonicals(cur, rows: List[tuple], inserted_ids: set):
+        """Point duplicates whose canonical lead lost an email conflict at the row that won it"""
+        dropped = {row[0]: row[3] for row in rows if row[0] not in inserted_ids}
+        relink = [(row[0], dropped[row[1]]) for row in rows if row[0] in inserted_ids and row[1] in dropped]
+        if not relink:
+            return
+        db.execute_values(cur, """
+            UPDATE leads AS l
+            SET canonical_lead_id = COALESCE(e.canonical_lead_id, e.lead_id)
+            FROM (VALUES %s) AS v(lead_id, email)
+            JOIN leads AS e ON e.email = v.email
+            WHERE l.lead_id = v.lead_id::uuid
+        """, relink)
+        logger.info(f"Relinked {len(relink)} duplicate(s) whose canonical lead already existed")
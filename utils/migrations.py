@@ -0,0 +1,233 @@
+﻿import re
+import time
+import hashlib
+from typing import Callable, List, Optional, Tuple
+from pathlib import Path
+from loguru import logger
+
+from utils.db import get_connection
+
+NO_TRANSACTION_MARKER = "-- migrate: no-transaction"
+MIGRATION_FILE = re.compile(r"^(\d+)_([\w-]+)\.sql$")
+INDEX_NAME = re.compile(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.I)
+ADVISORY_LOCK_ID = 72_811_036  # arbitrary, shared by every runner against the database
+
+
+class MigrationError(Exception):
+    pass
+
+
+class Migration:
+    """One versioned SQL file from the migrations directory"""
+
+    __slots__ = ("version", "name", "path", "sql", "checksum", "transactional")
+
+    def __init__(self, version: int, name: str, path: Path):
+        self.version = version
+        self.name = name
+        self.path = path
+        self.sql = path.read_text(encoding="utf-8")
+        self.checksum = hashlib.sha256(self.sql.encode("utf-8")).hexdigest()
+        self.transactional = NO_TRANSACTION_MARKER not in self.sql
+
+    def statements(self) -> List[str]:
+        """Split on statement-ending semicolons (only used for no-transaction files, which hold no $$ bodies)"""
+        without_comments = "\n".join(line for line in self.sql.splitlines() if not line.strip().startswith("--"))
+        return [stmt.strip() for stmt in re.split(r";\s*(?:\n|$)", without_comments) if stmt.strip()]
+
+
+class MigrationRunner:
+    """Applies pending migrations from database/migrations in version order
+
+    Applied versions and their checksums are kept in schema_migrations, so
+    a deploy only runs what is new and refuses to continue if an applied
+    file was edited afterwards. Each migration runs in its own transaction
+    with a lock_timeout, so a deploy gives up rather than queueing behind
+    (and in front of) traffic on hot tables. Files marked
+    "-- migrate: no-transaction" run statement by statement in autocommit,
+    which CREATE INDEX CONCURRENTLY requires.
+    """
+
+    def __init__(self, migrations_dir: str = "database/migrations",
+                 connection_factory: Callable = get_connection, lock_timeout: str = "5s"):
+        self.migrations_dir = Path(migrations_dir)
+        self.connection_factory = connection_factory
+        self.lock_timeout = lock_timeout
+
+    def discover(self) -> List[Migration]:
+        migrations = []
+        for path in sorted(self.migrations_dir.glob("*.sql")):
+            match = MIGRATION_FILE.match(path.name)
+            if not match:
+                logger.warning(f"Ignoring {path.name}: migration files are named NNNN_description.sql")
+                continue
+            migrations.append(Migration(int(match.group(1)), match.group(2), path))
+
+        versions = [m.version for m in migrations]
+        duplicates = {v for v in versions if versions.count(v) > 1}
+        if duplicates:
+            raise MigrationError(f"Duplicate migration versions: {sorted(duplicates)}")
+        return sorted(migrations, key=lambda m: m.version)
+
+    def plan(self, target: Optional[int] = None, conn=None) -> List[Tuple[Migration, str]]:
+        """(migration, status) for every file; status is applied, pending or changed"""
+        own_conn = conn is None
+        conn = conn or self.connection_factory()
+        try:
+            applied = self._applied(conn)
+        finally:
+            if own_conn:
+                conn.close()
+
+        plan = []
+        for migration in self.discover():
+            if target is not None and migration.version > target:
+                break
+            checksum = applied.get(migration.version)
+            if checksum is None:
+                status = "pending"
+            elif checksum != migration.checksum:
+                status = "changed"
+            else:
+                status = "applied"
+            plan.append((migration, status))
+        return plan
+
+    def migrate(self, target: Optional[int] = None, dry_run: bool = False) -> List[Migration]:
+        """Apply pending migrations up to target; returns the ones applied (or that would be)"""
+        conn = self.connection_factory()
+        try:
+            conn.autocommit = True
+            if not dry_run:
+                self._acquire_lock(conn)
+                self._ensure_table(conn)
+
+            plan = self.plan(target, conn=conn)
+            changed = [m for m, status in plan if status == "changed"]
+            if changed:
+                raise MigrationError(
+                    "Applied migrations were modified after they ran: "
+                    + ", ".join(m.path.name for m in changed)
+                    + ". Add a new migration instead of editing an applied one."
+                )
+
+            pending = [m for m, status in plan if status == "pending"]
+            for migration in pending:
+                mode = "transaction" if migration.transactional else "autocommit, statement by statement"
+                if dry_run:
+                    logger.info(f"Would apply {migration.path.name} ({mode})")
+                    continue
+
+                logger.info(f"Applying {migration.path.name} ({mode})")
+                start = time.perf_counter()
+                if migration.transactional:
+                    self._apply_transactional(conn, migration, start)
+                else:
+                    self._apply_autocommit(conn, migration, start)
+
+            if not pending:
+                logger.info("Database schema is up to date")
+            return pending
+
+        finally:
+            conn.close()
+
+    def baseline(self, target: int) -> List[Migration]:
+        """Record migrations up to target as applied without running them
+
+        For databases created from the old single-file schema.
+        """
+        conn = self.connection_factory()
+        try:
+            conn.autocommit = True
+            self._acquire_lock(conn)
+            self._ensure_table(conn)
+            pending = [m for m, status in self.plan(target, conn=conn) if status == "pending"]
+            with conn.cursor() as cur:
+                for migration in pending:
+                    self._record(cur, migration, 0)
+            logger.info(f"Baselined {len(pending)} migration(s) up to version {target}")
+            return pending
+        finally:
+            conn.close()
+
+    def _apply_transactional(self, conn, migration: Migration, start: float):
+        with conn.cursor() as cur:
+            cur.execute("BEGIN")
+            try:
+                cur.execute("SET LOCAL lock_timeout = %s", (self.lock_timeout,))
+                cur.execute(migration.sql)
+                self._record(cur, migration, start)
+                cur.execute("COMMIT")
+            except Exception as e:
+                cur.execute("ROLLBACK")
+                raise MigrationError(f"{migration.path.name} failed and was rolled back: {e}") from e
+
+    def _apply_autocommit(self, conn, migration: Migration, start: float):
+        # No lock_timeout here: CONCURRENTLY only waits for older transactions
+        # to finish and does not block writes while it waits
+        with conn.cursor() as cur:
+            self._drop_invalid_indexes(cur, migration)
+            for statement in migration.statements():
+                try:
+                    cur.execute(statement)
+                except Exception as e:
+                    raise MigrationError(
+                        f"{migration.path.name} failed at: {statement.splitlines()[0]} ({e}). "
+                        "Earlier statements were kept; fix and rerun to continue."
+                    ) from e
+            self._record(cur, migration, start)
+
+    def _drop_invalid_indexes(self, cur, migration: Migration):
+        """A failed CONCURRENTLY build leaves an INVALID index that IF NOT EXISTS would skip"""
+        names = INDEX_NAME.findall(migration.sql)
+        if not names:
+            return
+        cur.execute("""
+            SELECT c.relname
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE NOT i.indisvalid AND c.relname = ANY(%s)
+        """, (names,))
+        for (name,) in cur.fetchall():
+            logger.warning(f"Dropping invalid index {name} left by an earlier failed build")
+            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+    def _acquire_lock(self, conn):
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (ADVISORY_LOCK_ID,))
+            if not cur.fetchone()[0]:
+                raise MigrationError("Another migration run holds the migration lock")
+
+    def _applied(self, conn) -> dict:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('schema_migrations')")
+            if cur.fetchone()[0] is None:
+                applied = {}
+            else:
+                cur.execute("SELECT version, checksum FROM schema_migrations")
+                applied = dict(cur.fetchall())
+        if not conn.autocommit:
+            conn.commit()
+        return applied
+
+    @staticmethod
+    def _ensure_table(conn):
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    name VARCHAR(255) NOT NULL,
+                    checksum VARCHAR(64) NOT NULL,
+                    execution_ms INTEGER,
+                    applied_at TIMESTAMP DEFAULT NOW()
+                )
+            """)
+
+    @staticmethod
+    def _record(cur, migration: Migration, start: float):
+        elapsed_ms = int((time.perf_counter() - start) * 1000) if start else 0
+        cur.execute("""
+            INSERT INTO schema_migrations (version, name, checksum, execution_ms)
+            VALUES (%s, %s, %s, %s)
+        """, (migration.version, migration.name, migration.checksum, elapsed_ms))
@@ -0,0 +1,278 @@
+﻿import os
+import json
+import time
+import asyncio
+import hashlib
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from datetime import date, datetime
+from decimal import Decimal
+from pathlib import Path
+from uuid import UUID
+from collections import Counter
+from loguru import logger
+
+from utils import db, tracing
+from utils.config import load_env
+from utils.db import get_connection
+
+RETRY_STATUSES = {409, 429, 500, 502, 503, 504}
+RETRY_CODES = {"rate_limited", "conflict_error", "notionhq_client_request_timeout"}
+# Failures after which the write may still have gone through on Notion's side
+AMBIGUOUS_STATUSES = {500, 502, 503, 504}
+AMBIGUOUS_CODES = {"notionhq_client_request_timeout"}
+RICH_TEXT_LIMIT = 2000
+
+
+class AsyncRateLimiter:
+    """Spaces acquisitions at least 1/rate seconds apart across all workers"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+def _plain(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    return value
+
+
+def build_property(kind: str, value: Any) -> Dict:
+    """Notion property payload for a column value"""
+    value = _plain(value)
+    if kind == "title":
+        return {"title": [{"text": {"content": str(value or "")[:RICH_TEXT_LIMIT]}}]}
+    if kind == "rich_text":
+        return {"rich_text": [{"text": {"content": str(value or "")[:RICH_TEXT_LIMIT]}}]}
+    if kind == "number":
+        return {"number": value}
+    if kind == "select":
+        # Notion rejects commas in select option names
+        return {"select": {"name": str(value).replace(",", " ")[:100]} if value else None}
+    if kind == "date":
+        return {"date": {"start": value} if value else None}
+    if kind == "checkbox":
+        return {"checkbox": bool(value)}
+    raise ValueError(f"Unsupported Notion property type: {kind}")
+
+
+def _ambiguous(error: Exception) -> bool:
+    return (getattr(error, "status", None) in AMBIGUOUS_STATUSES
+            or getattr(error, "code", None) in AMBIGUOUS_CODES
+            or isinstance(error, (OSError, asyncio.TimeoutError)))
+
+
+class NotionSync:
+    """Pushes dashboard tables to their Notion databases, sending only changed rows
+
+    A local state file keeps each synced row's property hash and page id, so
+    unchanged rows cost nothing and changed rows become page updates rather
+    than duplicate pages. The state is saved as each page is created. Writes
+    go through a pool of async workers sharing one rate limiter (Notion allows
+    about 3 requests/second per integration) and are retried with backoff on
+    rate limits and server errors.
+
+    A create that times out or fails with a 5xx may still have made the page,
+    so before retrying it the database is queried for the row's key: the
+    table's key_property if configured, else the title when it holds the key.
+    Tables with neither don't retry such creates; the next sync picks them up.
+    """
+
+    def __init__(self, client=None, config_path: str = "config/notion_sync_config.json",
+                 state_file: str = "data/notion_sync_state.json", workers: int = 3,
+                 rate_per_second: float = 2.5, max_retries: int = 5,
+                 connection_factory: Callable = get_connection):
+        self.client = client
+        self.config = self._load_json(Path(config_path), {"databases": {}, "tables": {}})
+        self.state_file = Path(state_file)
+        self.state: Dict[str, Dict[str, Dict]] = self._load_json(self.state_file, {})
+        self.workers = workers
+        self.rate_per_second = rate_per_second
+        self.max_retries = max_retries
+        self.connection_factory = connection_factory
+
+    def sync(self, tables: Optional[List[str]] = None) -> Dict[str, Dict[str, int]]:
+        """Sync the given tables (default: all configured) and return per-table counts"""
+        return asyncio.run(self.sync_async(tables))
+
+    async def sync_async(self, tables: Optional[List[str]] = None) -> Dict[str, Dict[str, int]]:
+        client = self.client or self._default_client()
+        limiter = AsyncRateLimiter(self.rate_per_second)
+        summary = {}
+
+        for table in tables or list(self.config["tables"]):
+            mapping = self.config["tables"][table]
+            rows = await asyncio.to_thread(self._fetch_rows, table, mapping)
+            operations = self._diff(table, mapping, rows)
+
+            stats = Counter(rows=len(rows), unchanged=len(rows) - len(operations))
+            await self._run_operations(client, limiter, table, operations, stats)
+            self._save_state()
+
+            summary[table] = dict(stats)
+            logger.info(
+                f"Notion sync {table}: {stats['created']} created, {stats['updated']} updated, "
+                f"{stats['unchanged']} unchanged, {stats['failed']} failed"
+            )
+        return summary
+
+    def build_properties(self, mapping: Dict, row: Dict) -> Dict[str, Dict]:
+        title = mapping["title"]
+        properties = {title["property"]: build_property("title", row.get(title["column"]))}
+        for name, (column, kind) in mapping["properties"].items():
+            properties[name] = build_property(kind, row.get(column))
+        if mapping.get("key_property"):
+            properties[mapping["key_property"]] = build_property("rich_text", row.get(mapping["key"]))
+        return properties
+
+    def _diff(self, table: str, mapping: Dict, rows: List[Dict]) -> List[Tuple[str, str, Dict, Optional[str]]]:
+        """Return (row_key, hash, properties, page_id) for rows whose properties changed"""
+        table_state = self.state.setdefault(table, {})
+        operations = []
+        for row in rows:
+            key = str(_plain(row[mapping["key"]]))
+            properties = self.build_properties(mapping, row)
+            digest = hashlib.sha1(json.dumps(properties, sort_keys=True).encode("utf-8")).hexdigest()
+
+            known = table_state.get(key)
+            if known and known["hash"] == digest:
+                continue
+            operations.append((key, digest, properties, known["page_id"] if known else None))
+        return operations
+
+    async def _run_operations(self, client, limiter: AsyncRateLimiter, table: str,
+                              operations: List[Tuple], stats: Counter):
+        mapping = self.config["tables"][table]
+        database_id = self.config["databases"][mapping["database"]]
+        table_state = self.state[table]
+        queue: asyncio.Queue = asyncio.Queue()
+        for operation in operations:
+            queue.put_nowait(operation)
+
+        async def worker():
+            while True:
+                try:
+                    key, digest, properties, page_id = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+
+                try:
+                    if page_id:
+                        await self._with_retry(limiter, "pages.update", client.pages.update,
+                                               page_id=page_id, properties=properties)
+                        stats["updated"] += 1
+                        table_state[key] = {"hash": digest, "page_id": page_id}
+                    else:
+                        lookup = self._key_filter(mapping, key)
+                        find = partial(self._find_page, client, limiter, database_id, lookup) if lookup else None
+                        page = await self._with_retry(limiter, "pages.create", client.pages.create, idempotent=False,
+                                                      recover=find, parent={"database_id": database_id},
+                                                      properties=properties)
+                        stats["created"] += 1
+                        table_state[key] = {"hash": digest, "page_id": page["id"]}
+                        self._save_state()  # a crash before the table finishes must not re-create it
+                except Exception as e:
+                    stats["failed"] += 1
+                    logger.error(f"Notion sync failed for {table} row {key}: {e}")
+
+        await asyncio.gather(*(worker() for _ in range(self.workers)))
+
+    @staticmethod
+    def _key_filter(mapping: Dict, key: str) -> Optional[Dict]:
+        """Database query filter matching the page for a row key, None if no property holds it"""
+        if mapping.get("key_property"):
+            return {"property": mapping["key_property"], "rich_text": {"equals": key}}
+        if mapping["title"]["column"] == mapping["key"]:
+            return {"property": mapping["title"]["property"], "title": {"equals": key}}
+        return None
+
+    async def _find_page(self, client, limiter: AsyncRateLimiter, database_id: str,
+                         lookup: Dict) -> Optional[Dict]:
+        response = await self._with_retry(limiter, "databases.query", client.databases.query,
+                                          database_id=database_id, filter=lookup, page_size=1)
+        results = response.get("results") or []
+        return results[0] if results else None
+
+    async def _with_retry(self, limiter: AsyncRateLimiter, operation: str, call, idempotent: bool = True,
+                          recover: Optional[Callable] = None, **kwargs):
+        """Call with backoff on retryable errors, one notion.request span per attempt
+
+        A non-idempotent call is only retried after an ambiguous failure if
+        recover() (awaited first) finds no result of the earlier attempt.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                with tracing.span("notion.request", operation=operation, attempt=attempt) as span:
+                    waited = time.perf_counter()
+                    await limiter.acquire()
+                    span.set(rate_limit_wait_ms=round((time.perf_counter() - waited) * 1000, 1))
+                    return await call(**kwargs)
+            except Exception as e:
+                status = getattr(e, "status", None)
+                retryable = (status in RETRY_STATUSES
+                             or getattr(e, "code", None) in RETRY_CODES
+                             or isinstance(e, (OSError, asyncio.TimeoutError)))
+                if not retryable or attempt == self.max_retries:
+                    raise
+                if not idempotent and _ambiguous(e):
+                    if recover is None:
+                        raise
+                    found = await recover()
+                    if found:
+                        logger.info(f"Notion call failed with {status or type(e).__name__} but had gone through")
+                        return found
+                retry_after = getattr(e, "retry_after", None)
+                delay = float(retry_after) if retry_after else min(2 ** attempt * 0.5, 30)
+                logger.warning(f"Notion returned {status or type(e).__name__}, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    def _fetch_rows(self, table: str, mapping: Dict) -> List[Dict]:
+        columns = {mapping["key"], mapping["title"]["column"]}
+        columns.update(column for column, _ in mapping["properties"].values())
+        where, params = "", ()
+        if mapping.get("lookback_column"):
+            where = f"WHERE {mapping['lookback_column']} >= CURRENT_DATE - %s"
+            params = (mapping.get("lookback_days", 30),)
+
+        conn = self.connection_factory()
+        try:
+            with conn.cursor(cursor_factory=db.RealDictCursor) as cur:
+                cur.execute(f"SELECT {', '.join(sorted(columns))} FROM {table} {where}", params)
+                return cur.fetchall()
+        finally:
+            conn.close()
+
+    def _default_client(self):
+        from notion_client import AsyncClient
+
+        load_env()
+        return AsyncClient(auth=os.getenv("NOTION_API_KEY"))
+
+    def _save_state(self):
+        # Write then rename, so a crash mid-save can't leave a truncated state file
+        self.state_file.parent.mkdir(exist_ok=True)
+        partial = self.state_file.with_suffix(".tmp")
+        with open(partial, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(partial, self.state_file)
+
+    @staticmethod
+    def _load_json(path: Path, default: Dict) -> Dict:
+        if path.exists():
+            with open(path, 'r') as f:
+                return json.load(f)
+        return default
@@ -0,0 +1,70 @@
+﻿import json
+import zlib
+import base64
+from typing import Any, Dict, Optional
+from pathlib import Path
+from loguru import logger
+
+COMPRESSED_KEY = "_z"
+
+
+def compress_value(value: Any) -> Dict[str, str]:
+    """Pack a JSON value as zlib + base64 so it still fits in a JSONB column"""
+    raw = json.dumps(value, separators=(",", ":")).encode("utf-8")
+    return {COMPRESSED_KEY: base64.b64encode(zlib.compress(raw, 9)).decode("ascii")}
+
+
+def decompress_value(value: Any) -> Any:
+    """Inverse of compress_value; returns anything else unchanged"""
+    if isinstance(value, dict) and set(value) == {COMPRESSED_KEY}:
+        return json.loads(zlib.decompress(base64.b64decode(value[COMPRESSED_KEY])))
+    return value
+
+
+class LeadProjector:
+    """Trims Apollo person/org payloads to a configured whitelist
+
+    Whitelisted fields are kept as-is. Large optional fields listed under
+    compressed_fields are kept only in compressed form once their JSON
+    exceeds compress_min_bytes. Everything else is dropped.
+    """
+
+    def __init__(self, config_path: str = "config/apollo_projection.json"):
+        self.config = self._load_config(config_path)
+        self.person_fields = self.config.get("person_fields", [])
+        self.org_fields = self.config.get("org_fields", [])
+        self.compressed_fields = self.config.get("compressed_fields", {})
+        self.compress_min_bytes = self.config.get("compress_min_bytes", 256)
+
+    def project_person(self, person: Optional[Dict]) -> Dict:
+        return self._project(person, self.person_fields, self.compressed_fields.get("person", []))
+
+    def project_org(self, org: Optional[Dict]) -> Dict:
+        return self._project(org, self.org_fields, self.compressed_fields.get("org", []))
+
+    @staticmethod
+    def expand(record: Optional[Dict]) -> Dict:
+        """Decompress every compressed field of a stored projection"""
+        return {key: decompress_value(value) for key, value in (record or {}).items()}
+
+    def _project(self, source: Optional[Dict], fields: list, compressed: list) -> Dict:
+        if not source:
+            return {}
+
+        projected = {field: source[field] for field in fields if source.get(field) is not None}
+        for field in compressed:
+            value = source.get(field)
+            if not value:
+                continue
+            size = len(json.dumps(value, separators=(",", ":")))
+            projected[field] = compress_value(value) if size >= self.compress_min_bytes else value
+        return projected
+
+    def _load_config(self, config_path: str) -> dict:
+        path = Path(config_path)
+        if not path.exists():
+            logger.warning(f"Projection config not found: {config_path}, keeping ids only")
+            return {"person_fields": ["id"], "org_fields": ["id", "primary_domain"]}
+
+        with open(path, 'r') as f:
+            return json.load(f)
@@ -0,0 +1,323 @@
+﻿import os
+import re
+import json
+import time
+import uuid
+import threading
+import contextvars
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from datetime import datetime
+from pathlib import Path
+from functools import lru_cache
+from contextlib import contextmanager
+from loguru import logger
+
+from utils.config import load_env
+
+TRACE_FILE_ENV = "OUTREACH_TRACE_FILE"
+PROFILE_ENV = "OUTREACH_PROFILE"  # cprofile | tracemalloc
+PROFILE_DIR_ENV = "OUTREACH_PROFILE_DIR"
+MAX_STATEMENT_CHARS = 200
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+_run_context: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar("run_context", default={})
+_WHITESPACE = re.compile(r"\s+")
+# cProfile and tracemalloc are process-wide, so only one node is profiled at a time
+_profile_lock = threading.Lock()
+
+
+class _JsonlExporter:
+    """Appends one JSON line per finished span; each line is a single write"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._path = None
+        self._file = None
+
+    def write(self, path: str, record: Dict):
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            if path != self._path:
+                if self._file:
+                    self._file.close()
+                Path(path).parent.mkdir(parents=True, exist_ok=True)
+                self._file = open(path, "a", buffering=1)
+                self._path = path
+            self._file.write(line)
+
+
+_exporter = _JsonlExporter()
+
+
+class Span:
+    """One timed operation; attributes set while it runs are exported with it"""
+
+    __slots__ = ("name", "span_id", "parent_id", "attrs", "started_at", "_start", "_token")
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        parent = _current_span.get()
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.attrs = attrs
+        self.started_at = None
+        self._start = 0.0
+        self._token = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.started_at = datetime.now()
+        self._start = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration_ms = (time.perf_counter() - self._start) * 1000
+        _current_span.reset(self._token)
+        path = _settings()[0]
+        if not path:
+            return False
+        record = {
+            "ts": self.started_at.isoformat(),
+            "name": self.name,
+            "duration_ms": round(duration_ms, 3),
+            "status": "error" if exc_type else "ok",
+            **_run_context.get(),
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "pid": os.getpid(),
+            "attrs": self.attrs,
+        }
+        if exc_type:
+            record["error"] = f"{exc_type.__name__}: {exc}"
+        try:
+            _exporter.write(path, record)
+        except OSError as e:
+            logger.warning(f"Could not write trace span to {path}: {e}")
+        return False
+
+
+class _NoopSpan:
+    """Stand-in returned when tracing is off, so call sites need no checks"""
+
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+@lru_cache(maxsize=None)
+def _settings() -> Tuple[Optional[str], str]:
+    """(trace file, profile mode) from the environment, read once per process"""
+    load_env()
+    return os.environ.get(TRACE_FILE_ENV) or None, os.environ.get(PROFILE_ENV, "").lower()
+
+
+def configure(trace_file: Optional[str] = None, profile: Optional[str] = None):
+    """Switch tracing/profiling at runtime; also exported to the environment for child processes"""
+    for name, value in ((TRACE_FILE_ENV, trace_file), (PROFILE_ENV, profile)):
+        if value:
+            os.environ[name] = value
+        else:
+            os.environ.pop(name, None)
+    _settings.cache_clear()
+
+
+def enabled() -> bool:
+    """Tracing is on while OUTREACH_TRACE_FILE names a file"""
+    return _settings()[0] is not None
+
+
+def span(name: str, **attrs):
+    """Context manager timing a block as a span; a shared no-op when tracing is off"""
+    if _settings()[0] is None:
+        return _NOOP_SPAN
+    return Span(name, attrs)
+
+
+@contextmanager
+def run_context(workflow_run_id: Optional[str] = None, batch_number: Optional[int] = None):
+    """Stamp every span inside the block with the run id and batch number"""
+    token = _run_context.set({"workflow_run_id": workflow_run_id, "batch_number": batch_number})
+    try:
+        yield
+    finally:
+        _run_context.reset(token)
+
+
+def traced_node(name: str, fn: Callable) -> Callable:
+    """Wrap a graph node in a span (and a profiler when OUTREACH_PROFILE is set)
+
+    The run id and batch number are taken from the workflow state, so node
+    spans are correlated even when the graph runs nodes on another thread.
+    """
+    def node(state):
+        trace_file, profile = _settings()
+        if trace_file is None and not profile:
+            return fn(state)
+        with run_context(state.get("workflow_run_id"), state.get("batch_number")):
+            with span(f"node.{name}") as node_span:
+                with _profile(profile, name, node_span):
+                    return fn(state)
+
+    node.__name__ = name
+    return node
+
+
+@contextmanager
+def _profile(mode: str, name: str, node_span):
+    """Profile the block unless another node already is; that node's span says which ran unprofiled"""
+    if mode not in ("cprofile", "tracemalloc"):
+        yield
+        return
+    if not _profile_lock.acquire(blocking=False):
+        node_span.set(profile_skipped="another node was being profiled")
+        yield
+        return
+    try:
+        with (_cprofile if mode == "cprofile" else _tracemalloc)(name, node_span):
+            yield
+    finally:
+        _profile_lock.release()
+
+
+def _profile_path(name: str, suffix: str) -> Path:
+    context = _run_context.get()
+    run_id = (context.get("workflow_run_id") or "run")[:8]
+    stamp = datetime.now().strftime("%Y%m%dT%H%M%S")
+    directory = Path(os.environ.get(PROFILE_DIR_ENV, "data/profiles"))
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory / f"{stamp}-{run_id}-b{context.get('batch_number')}-{name}.{suffix}"
+
+
+@contextmanager
+def _cprofile(name: str, node_span):
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        path = _profile_path(name, "prof")
+        profiler.dump_stats(str(path))
+        stats = pstats.Stats(profiler).sort_stats("cumulative")
+        top = [
+            {"function": f"{Path(file).name}:{line}({func})", "calls": calls, "cumulative_ms": round(cumulative * 1000, 2)}
+            for (file, line, func), (_, calls, _, cumulative, _) in
+            sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:10]
+        ]
+        node_span.set(profile=str(path), profile_top=top)
+        logger.info(f"cProfile for {name} written to {path}")
+
+
+@contextmanager
+def _tracemalloc(name: str, node_span):
+    import tracemalloc
+
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(10)
+    tracemalloc.reset_peak()
+    before = tracemalloc.take_snapshot()
+    try:
+        yield
+    finally:
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        if started:
+            tracemalloc.stop()
+        growth = after.compare_to(before, "lineno")[:10]
+        node_span.set(
+            peak_kb=round(peak / 1024, 1),
+            allocated_kb=round(sum(stat.size_diff for stat in growth) / 1024, 1),
+            top_allocations=[str(stat) for stat in growth],
+        )
+        logger.info(f"{name}: peak traced memory {peak / 1024:.0f} KiB")
+
+
+def statement_summary(query) -> str:
+    """First MAX_STATEMENT_CHARS of a statement, whitespace collapsed; parameters are never recorded"""
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    return _WHITESPACE.sub(" ", str(query)).strip()[:MAX_STATEMENT_CHARS]
+
+
+@lru_cache(maxsize=None)
+def traced_cursor_class(base: type) -> type:
+    """Subclass of a psycopg2 cursor class that records a span per execute"""
+    class TracedCursor(base):
+        def execute(self, query, vars=None):
+            with span("db.execute", statement=statement_summary(query)) as db_span:
+                result = super().execute(query, vars)
+                db_span.set(rowcount=self.rowcount)
+                return result
+
+        def executemany(self, query, vars_list):
+            with span("db.executemany", statement=statement_summary(query)) as db_span:
+                result = super().executemany(query, vars_list)
+                db_span.set(rowcount=self.rowcount)
+                return result
+
+    TracedCursor.__name__ = f"Traced{base.__name__}"
+    return TracedCursor
+
+
+@lru_cache(maxsize=None)
+def traced_connection_class() -> type:
+    """psycopg2 connection class whose cursors, of any cursor_factory, are traced
+
+    execute_values and server-side (named) cursors go through execute(), so
+    they are covered too.
+    """
+    import psycopg2.extensions
+
+    class TracedConnection(psycopg2.extensions.connection):
+        def cursor(self, *args, **kwargs):
+            kwargs["cursor_factory"] = traced_cursor_class(
+                kwargs.get("cursor_factory") or self.cursor_factory or psycopg2.extensions.cursor
+            )
+            return super().cursor(*args, **kwargs)
+
+    return TracedConnection
+
+
+def summarize(path: str, workflow_run_id: Optional[str] = None, top: int = 10) -> Dict[str, List[Dict]]:
+    """Per-span-name totals and the slowest individual spans from a trace file"""
+    by_name: Dict[str, List[float]] = {}
+    slowest = []
+    with open(path, "r") as f:
+        for line in f:
+            record = json.loads(line)
+            if workflow_run_id and record.get("workflow_run_id") != workflow_run_id:
+                continue
+            by_name.setdefault(record["name"], []).append(record["duration_ms"])
+            slowest.append(record)
+
+    stages = []
+    for name, durations in by_name.items():
+        durations.sort()
+        stages.append({
+            "name": name,
+            "count": len(durations),
+            "total_ms": round(sum(durations), 1),
+            "p50_ms": round(durations[len(durations) // 2], 1),
+            "p95_ms": round(durations[min(len(durations) - 1, int(len(durations) * 0.95))], 1),
+            "max_ms": round(durations[-1], 1),
+        })
+    stages.sort(key=lambda stage: stage["total_ms"], reverse=True)
+    slowest.sort(key=lambda record: record["duration_ms"], reverse=True)
+    return {"stages": stages, "slowest": slowest[:top]}
@@ -1,9 +1,10 @@
 ﻿from typing import TypedDict, List, Dict, Any, Optional
 from datetime import datetime
 import uuid
-from langgraph.graph import StateGraph, END
+import threading
 from loguru import logger
-import asyncio
+
+from utils import tracing
 
 class WorkflowState(TypedDict):
     """State management for the workflow"""
@@ -11,11 +12,14 @@ class WorkflowState(TypedDict):
     workflow_run_id: str
     batch_number: int
     timestamp: datetime
+    search_params: Dict[str, Any]
     
     # Lead data
     leads: List[Dict[str, Any]]
+    duplicate_leads: List[Dict[str, Any]]
     enriched_leads: List[Dict[str, Any]]
     qualified_leads: List[Dict[str, Any]]
+    orgs_by_domain: Dict[str, Dict[str, Any]]
     
     # Processing state
     current_step: str
@@ -25,23 +29,46 @@ class WorkflowState(TypedDict):
 class OutreachWorkflow:
     """Main workflow orchestrator"""
     
-    def __init__(self):
-        self.workflow = self._build_workflow()
+    def __init__(self, apollo_agent=None, search_manager=None, lead_store=None, entity_resolver=None):
+        # Without an agent the workflow runs on dummy leads
+        self.apollo_agent = apollo_agent
+        self.search_manager = search_manager
+        self.lead_store = lead_store
+        self.entity_resolver = entity_resolver  # optional EntityResolver; flags cross-source duplicates
+        self._compiled = None
+        self._compile_lock = threading.Lock()
         logger.info("Outreach workflow initialized")
     
-    def _build_workflow(self) -> StateGraph:
+    @property
+    def workflow(self):
+        """Compiled graph, built on first use"""
+        if self._compiled is None:
+            with self._compile_lock:
+                if self._compiled is None:
+                    self._compiled = self._build_workflow()
+        return self._compiled
+    
+    def _build_workflow(self):
         """Build the workflow graph"""
+        # langgraph is heavy to import; only pay for it when a graph is needed
+        from langgraph.graph import StateGraph, END
+        
         workflow = StateGraph(WorkflowState)
         
-        # Add nodes (each agent is a node)
-        workflow.add_node("source_leads", self.source_leads)
-        workflow.add_node("enrich_leads", self.enrich_leads)
-        workflow.add_node("score_leads", self.score_leads)
-        workflow.add_node("persist_state", self.persist_state)
+        # Add nodes (each agent is a node); each runs inside a tracing span
+        for name, node in [
+            ("source_leads", self.source_leads),
+            ("dedupe_leads", self.dedupe_leads),
+            ("enrich_leads", self.enrich_leads),
+            ("score_leads", self.score_leads),
+            ("persist_state", self.persist_state),
+        ]:
+            workflow.add_node(name, tracing.traced_node(name, node))
         
         # Define the flow
         workflow.set_entry_point("source_leads")
-        workflow.add_edge("source_leads", "enrich_leads")
+        workflow.add_edge("source_leads", "dedupe_leads")
+        workflow.add_edge("dedupe_leads", "enrich_leads")
         workflow.add_edge("enrich_leads", "score_leads")
         workflow.add_edge("score_leads", "persist_state")
         workflow.add_edge("persist_state", END)
@@ -53,6 +80,21 @@ class OutreachWorkflow:
         logger.info(f"Sourcing leads for batch {state['batch_number']}")
         state['current_step'] = 'sourcing'
         
+        if self.apollo_agent:
+            search_params = state.get('search_params')
+            if not search_params:
+                if not self.search_manager:
+                    raise ValueError("source_leads needs search_params or a search_manager to pick them")
+                search_params, metadata = self.search_manager.get_next_search_params()
+                state['metrics']['search'] = metadata
+            results = self.apollo_agent.process_batch_of_10(search_params)
+            state['leads'] = results['qualified_leads']
+            state['orgs_by_domain'] = results['orgs_by_domain']
+            state['metrics']['people_found'] = len(results['raw_people'])
+            state['metrics']['people_enriched'] = len(results['enriched_people'])
+            logger.info(f"Sourced {len(state['leads'])} leads")
+            return state
+        
         # For now, use dummy data
         state['leads'] = [
             {
@@ -66,6 +108,22 @@ class OutreachWorkflow:
         logger.info(f"Sourced {len(state['leads'])} leads")
         return state
     
+    def dedupe_leads(self, state: WorkflowState) -> WorkflowState:
+        """Set aside leads that are the same person as a known lead"""
+        state['current_step'] = 'deduplicating'
+        if not self.entity_resolver:
+            return state
+        
+        duplicates = self.entity_resolver.resolve_batch(state['leads'])
+        duplicate_ids = {lead['lead_id'] for lead in duplicates}
+        for lead in duplicates:
+            lead['sequence_status'] = 'duplicate'  # stored and linked, never sequenced
+        state['duplicate_leads'] = duplicates
+        state['leads'] = [lead for lead in state['leads'] if lead['lead_id'] not in duplicate_ids]
+        state['metrics']['duplicates_found'] = len(duplicates)
+        logger.info(f"{len(duplicates)} duplicate leads set aside, {len(state['leads'])} remain")
+        return state
+    
     def enrich_leads(self, state: WorkflowState) -> WorkflowState:
         """Enrich lead data"""
         logger.info("Enriching leads")
@@ -75,8 +133,11 @@ class OutreachWorkflow:
         state['enriched_leads'] = []
         for lead in state['leads']:
             enriched = lead.copy()
-            enriched['revenue'] = 5000000
-            enriched['employees'] = 50
+            # Placeholder values until real enrichment; keep anything Apollo provided
+            if enriched.get('revenue') is None:
+                enriched['revenue'] = 5000000
+            if enriched.get('employees') is None:
+                enriched['employees'] = enriched.get('company_size') or 50
             state['enriched_leads'].append(enriched)
         
         logger.info(f"Enriched {len(state['enriched_leads'])} leads")
@@ -101,30 +162,66 @@ class OutreachWorkflow:
         logger.info("Persisting state to database")
         state['current_step'] = 'complete'
         
-        # We'll add actual database saving next
+        if self.lead_store:
+            inserted = self.lead_store.save_batch(
+                state['qualified_leads'] + state['duplicate_leads'],
+                state['orgs_by_domain'],
+                workflow_run_id=state['workflow_run_id'],
+                batch_number=state['batch_number']
+            )
+            state['metrics']['leads_inserted'] = inserted
+        
         logger.info("Workflow complete!")
         return state
     
-    def run(self, batch_number: int = 1) -> WorkflowState:
-        """Run the workflow for a batch"""
+    def run(self, batch_number: int = 1, search_params: Optional[Dict] = None,
+            workflow_run_id: Optional[str] = None) -> WorkflowState:
+        """Run the workflow for a batch, under the caller's run id if given"""
         initial_state = WorkflowState(
-            workflow_run_id=str(uuid.uuid4()),
+            workflow_run_id=workflow_run_id or str(uuid.uuid4()),
             batch_number=batch_number,
             timestamp=datetime.now(),
+            search_params=search_params or {},
             leads=[],
+            duplicate_leads=[],
             enriched_leads=[],
             qualified_leads=[],
+            orgs_by_domain={},
             current_step="starting",
             errors=[],
             metrics={}
         )
         
         logger.info(f"Starting workflow run {initial_state['workflow_run_id']}")
-        result = self.workflow.invoke(initial_state)
+        graph = self.workflow  # compile outside the span
+        with tracing.run_context(initial_state['workflow_run_id'], batch_number):
+            with tracing.span("workflow.run") as span:
+                result = graph.invoke(initial_state)
+                span.set(qualified_leads=len(result['qualified_leads']), metrics=result['metrics'])
         return result
 
+_process_workflow = None
+_process_workflow_kwargs = {}
+_process_workflow_lock = threading.Lock()
+
+def get_workflow(**kwargs) -> OutreachWorkflow:
+    """Process-wide OutreachWorkflow, so the graph is compiled once per worker
+    
+    The first call's kwargs build it. Later calls may pass no kwargs or the
+    same ones; different kwargs raise ValueError instead of being ignored.
+    """
+    global _process_workflow, _process_workflow_kwargs
+    with _process_workflow_lock:
+        if _process_workflow is None:
+            _process_workflow = OutreachWorkflow(**kwargs)
+            _process_workflow_kwargs = kwargs
+        elif kwargs and kwargs != _process_workflow_kwargs:
+            raise ValueError("get_workflow() was already called with different arguments; "
+                             "construct OutreachWorkflow directly for a differently configured workflow")
+    return _process_workflow
+
 if __name__ == "__main__":
-    workflow = OutreachWorkflow()
+    workflow = get_workflow()
     result = workflow.run(batch_number=1)
     print(f"\n✅ Workflow completed!")
     print(f"Run ID: {result['workflow_run_id']}")
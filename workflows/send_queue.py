@@ -0,0 +1,136 @@
+﻿from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+
+from utils import db
+from utils.db import get_connection
+
+# Same selection as the active_sequence_leads view, plus the lead fields the
+# sender needs to personalise the email. Ordered by lead_id so chunks are stable.
+DUE_LEADS_QUERY = """
+    SELECT
+        l.lead_id,
+        l.email,
+        l.first_name,
+        l.last_name,
+        l.title,
+        l.company_name,
+        l.persona,
+        l.industry,
+        l.campaign_angle,
+        l.sequence_position,
+        l.next_email_date,
+        cp.playbook_id,
+        cp.variant,
+        cp.guidelines
+    FROM leads l
+    LEFT JOIN campaign_playbooks cp ON
+        cp.campaign_angle = l.campaign_angle
+        AND cp.email_position = l.sequence_position + 1
+        AND cp.status = 'validated'
+    WHERE l.sequence_status = 'active'
+        AND l.next_email_date <= CURRENT_DATE
+    ORDER BY l.lead_id
+"""
+
+# One statement per chunk. The position guard makes a re-run of the same
+# chunk a no-op instead of skipping a lead ahead two steps.
+ADVANCE_SEQUENCE_SQL = """
+    UPDATE leads AS l
+    SET sequence_position = v.sequence_position + 1,
+        last_email_sent = v.sent_at,
+        next_email_date = calculate_next_email_date(v.sequence_position + 1, v.sent_at)
+    FROM (VALUES %s) AS v(lead_id, sent_at, sequence_position)
+    WHERE l.lead_id = v.lead_id
+        AND l.sequence_position = v.sequence_position
+"""
+
+ADVANCE_TEMPLATE = "(%s::uuid, %s::timestamp, %s::integer)"
+
+
+class SendQueue:
+    """Streams today's due leads in chunks and advances their sequences in bulk"""
+
+    def __init__(self, chunk_size: int = 500, max_workers: int = 8,
+                 connection_factory: Callable = get_connection):
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.connection_factory = connection_factory
+
+    def iter_due_chunks(self, conn) -> Iterator[List[Dict]]:
+        """Yield due leads in chunks of chunk_size from a server-side cursor"""
+        with conn.cursor(name="send_queue_reader", cursor_factory=db.RealDictCursor) as cur:
+            cur.itersize = self.chunk_size
+            cur.execute(DUE_LEADS_QUERY)
+            while True:
+                chunk = cur.fetchmany(self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def advance_sequences(self, conn, sent: List[Tuple[str, datetime, int]]) -> int:
+        """Advance position, last_email_sent and next_email_date for sent leads"""
+        if not sent:
+            return 0
+
+        with conn.cursor() as cur:
+            db.execute_values(cur, ADVANCE_SEQUENCE_SQL, sent,
+                           template=ADVANCE_TEMPLATE, page_size=len(sent))
+            updated = cur.rowcount
+        conn.commit()
+        return updated
+
+    def run(self, send_fn: Callable[[Dict], bool]) -> Dict[str, int]:
+        """Dispatch the whole due queue through send_fn, one chunk at a time
+
+        send_fn receives a lead row (with guidelines) and returns True when the
+        email was handed off successfully. Failed leads stay due and are picked
+        up again on the next run.
+        """
+        stats = {"due": 0, "sent": 0, "failed": 0, "advanced": 0, "chunks": 0}
+
+        # Reader holds a snapshot for the cursor; writer commits per chunk so
+        # progress survives a crash halfway through the day's queue.
+        reader = self.connection_factory()
+        writer = self.connection_factory()
+        reader.set_session(readonly=True)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                for chunk in self.iter_due_chunks(reader):
+                    stats["chunks"] += 1
+                    stats["due"] += len(chunk)
+
+                    sent = self._dispatch_chunk(pool, chunk, send_fn)
+                    stats["sent"] += len(sent)
+                    stats["failed"] += len(chunk) - len(sent)
+                    stats["advanced"] += self.advance_sequences(writer, sent)
+
+                    logger.info(
+                        f"Send queue chunk {stats['chunks']}: "
+                        f"{len(sent)}/{len(chunk)} sent, {stats['due']} processed so far"
+                    )
+        finally:
+            reader.close()
+            writer.close()
+
+        logger.info(
+            f"Send queue complete: {stats['sent']} sent, {stats['failed']} failed, "
+            f"{stats['advanced']} sequences advanced in {stats['chunks']} chunks"
+        )
+        return stats
+
+    def _dispatch_chunk(self, pool: ThreadPoolExecutor, chunk: List[Dict],
+                        send_fn: Callable[[Dict], bool]) -> List[Tuple[str, datetime, int]]:
+        """Send every lead in the chunk concurrently and collect the successes"""
+
+        def send_one(lead: Dict) -> Optional[Tuple[str, datetime, int]]:
+            try:
+                if send_fn(lead):
+                    return (str(lead["lead_id"]), datetime.now(), lead["sequence_position"])
+            except Exception as e:
+                logger.error(f"Send failed for {lead.get('email')}: {e}")
+            return None
+
+        return [result for result in pool.map(send_one, chunk) if result]
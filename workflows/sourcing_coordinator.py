@@ -0,0 +1,341 @@
+﻿import json
+import time
+import queue
+import multiprocessing as mp
+from typing import Dict, List, Optional, Tuple
+from datetime import date
+from pathlib import Path
+from collections import Counter
+from loguru import logger
+
+from agents.email_verifier import normalize_email
+from utils import tracing
+from utils.budget import Reservation
+
+Combo = Tuple[str, str, int, List[int]]  # industry, metro, priority, pages
+
+
+class SharedRateLimiter:
+    """Request pacing shared by every worker process
+
+    Each acquire() takes the next free slot from a shared "next slot" time,
+    so the combined request rate of all workers stays at rate_per_second.
+    """
+
+    def __init__(self, rate_per_second: float, ctx=mp):
+        self.interval = 1.0 / rate_per_second
+        self._next = ctx.Value("d", 0.0, lock=False)
+        self._lock = ctx.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._next.value)
+            self._next.value = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class SharedCreditBudget:
+    """Apollo credit cap for one sourcing run, shared across worker processes
+
+    Implements the reserve/settle/release/should_skip subset of BudgetGovernor
+    that ApolloAgent uses, backed by shared counters instead of in-process state.
+    Per-operation units and calls are kept so the parent can record the run's
+    usage with its BudgetGovernor.
+    """
+
+    def __init__(self, credit_limit: int, operation_credits: Dict[str, int], ctx=mp):
+        self.credit_limit = credit_limit
+        self.operation_credits = operation_credits
+        self._used = ctx.Value("q", 0, lock=False)
+        self._reserved = ctx.Value("q", 0, lock=False)
+        self._denied = ctx.Value("q", 0, lock=False)
+        # operation -> [units, calls, failed calls, rate-limited calls]
+        self._operations = {operation: ctx.Array("q", 4, lock=False) for operation in operation_credits}
+        self._lock = ctx.Lock()
+
+    def reserve(self, provider: str, operation: str, units: int = 1) -> Optional[Reservation]:
+        credits = units * self.operation_credits.get(operation, 1)
+        with self._lock:
+            if credits and self._used.value + self._reserved.value + credits > self.credit_limit:
+                self._denied.value += 1
+                return None
+            self._reserved.value += credits
+        return Reservation(provider, operation, credits, date.today())
+
+    def settle(self, reservation: Reservation, units_used: int, success: bool = True,
+               rate_limited: bool = False):
+        credits = units_used * self.operation_credits.get(reservation.operation, 1)
+        counters = self._operations.get(reservation.operation)
+        with self._lock:
+            self._reserved.value -= reservation.credits
+            self._used.value += credits
+            if counters is not None:
+                counters[0] += units_used
+                counters[1] += 1
+                counters[2] += int(not success)
+                counters[3] += int(rate_limited)
+
+    def release(self, reservation: Reservation):
+        with self._lock:
+            self._reserved.value -= reservation.credits
+
+    def should_skip(self, provider: str, priority: int = 1) -> bool:
+        return self.exhausted()
+
+    def exhausted(self) -> bool:
+        """True once the cap is reached or any call has been denied for lack of credits"""
+        with self._lock:
+            return self._denied.value > 0 or self._used.value + self._reserved.value >= self.credit_limit
+
+    def usage(self) -> Dict[str, Tuple[int, int, int, int]]:
+        """operation -> (units, calls, failed calls, rate-limited calls)"""
+        with self._lock:
+            return {operation: tuple(counters) for operation, counters in self._operations.items()}
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {"credits_used": self._used.value, "credit_limit": self.credit_limit,
+                    "denied": self._denied.value}
+
+
+def _source_shard(shard_id: int, combos: List[Combo], agent_options: Dict,
+                  limiter: SharedRateLimiter, budget: SharedCreditBudget, results: mp.Queue,
+                  verify_emails: bool = False, workflow_run_id: Optional[str] = None):
+    """Worker process: source every page of its combos and stream leads to the writer
+
+    Each page runs in a sourcing.page span under the run id, numbered as the
+    shard's batch, so its Apollo, NeverBounce and database spans join the run.
+    """
+    from agents.apollo_agent import ApolloAgent
+    from agents.apollo_search_manager import ApolloSearchManager
+    from agents.email_verifier import EmailVerifier
+    from utils.budget import BudgetGovernor
+
+    stats = Counter()
+    verifier = None
+    try:
+        # Each process gets its own session and connection pool. NeverBounce spend
+        # goes through a per-process governor, which sees other processes' usage on flush.
+        if verify_emails:
+            verifier = EmailVerifier(governor=BudgetGovernor(workflow_run_id=workflow_run_id))
+        agent = ApolloAgent(governor=budget, rate_limiter=limiter, verifier=verifier, **agent_options)
+        manager = ApolloSearchManager()
+        seen = set()
+
+        for industry, metro, priority, pages in combos:
+            params = manager.get_search_params(industry=industry, metro=metro, strategy="broad")
+            for page in pages:
+                if budget.exhausted():
+                    logger.warning(f"Shard {shard_id}: credit budget exhausted, stopping")
+                    results.put(("done", shard_id, dict(stats)))
+                    return
+
+                denied = budget.snapshot()["denied"]
+                with tracing.run_context(workflow_run_id, stats["batches"] + 1), tracing.span("sourcing.page") as span:
+                    span.set(shard=shard_id, industry=industry, metro=metro, page=page)
+                    batch = agent.process_batch_of_10({**params, "page": page}, priority=priority)
+                    leads = []
+                    for lead in batch["qualified_leads"]:
+                        email = normalize_email(lead.get("email"))
+                        if email and email not in seen:
+                            seen.add(email)
+                            leads.append(lead)
+                    span.set(leads=len(leads))
+
+                stats["batches"] += 1
+                stats["leads"] += len(leads)
+                stats["shard_duplicates"] += len(batch["qualified_leads"]) - len(leads)
+                # A page is only done if no call was denied meanwhile; otherwise it is searched again later
+                complete = budget.snapshot()["denied"] == denied
+                metadata = {"industry": industry, "metro": metro, "page": page, "complete": complete}
+                results.put(("batch", shard_id, metadata, leads, batch["orgs_by_domain"]))
+
+        results.put(("done", shard_id, dict(stats)))
+
+    except Exception as e:
+        logger.exception(f"Shard {shard_id} failed")
+        results.put(("error", shard_id, f"{type(e).__name__}: {e}"))
+
+    finally:
+        if verifier and verifier.governor:
+            verifier.governor.close()
+
+
+class SourcingCoordinator:
+    """Multi-process Apollo sourcing sharded over industry x metro
+
+    Every industry/metro combination in the search config is one unit of
+    work; combinations are dealt round-robin (in priority order) into one
+    shard per worker process. Workers share a request rate limiter and a
+    credit budget, and stream deduplicated leads back over a queue to this
+    process, which is the only one that writes (through a LeadStore) and the
+    only one that advances the page cursor in data/apollo_progress.json.
+    Pages are claimed up front; pages a shard did not finish (budget stop,
+    errors) are released again at the end of the run so the next run
+    searches them.
+    With a BudgetGovernor, the run's credit cap is limited to what is left of
+    today's Apollo budget, the worker count follows its recommended
+    concurrency, and the credits the workers used are recorded with it.
+    """
+
+    def __init__(self, workers: int = 4, pages_per_combo: int = 1, rate_per_second: float = 5.0,
+                 credit_limit: Optional[int] = None, lead_store=None, search_manager=None,
+                 agent_options: Optional[Dict] = None, write_batch_size: int = 200,
+                 budget_config_path: str = "config/budget_config.json", governor=None,
+                 verify_emails: bool = False):
+        from agents.apollo_search_manager import ApolloSearchManager
+
+        self.workers = workers
+        self.pages_per_combo = pages_per_combo
+        self.rate_per_second = rate_per_second
+        self.lead_store = lead_store
+        self.search_manager = search_manager or ApolloSearchManager()
+        self.agent_options = agent_options or {}
+        self.write_batch_size = write_batch_size
+        self.governor = governor
+        self.verify_emails = verify_emails  # each worker builds its own EmailVerifier
+
+        apollo = self._load_apollo_budget(budget_config_path)
+        self.operation_credits = apollo.get("operation_credits", {})
+        self.credit_limit = credit_limit if credit_limit is not None else apollo.get("daily_credit_limit", 2000)
+
+    def plan_shards(self, workers: Optional[int] = None) -> List[List[Combo]]:
+        """Claim pages for every combination and deal them into shards"""
+        industries = sorted(self.search_manager.config["us_industries"].items(),
+                            key=lambda item: item[1].get("priority", 99))
+        metros = list(self.search_manager.config["us_metro_areas"])
+
+        combos = []
+        for industry, settings in industries:
+            for metro in metros:
+                pages = self.search_manager.claim_pages(industry, metro, self.pages_per_combo)
+                combos.append((industry, metro, settings.get("priority", 1), pages))
+
+        shard_count = max(1, min(workers or self.workers, len(combos)))
+        return [combos[i::shard_count] for i in range(shard_count)]
+
+    def run(self, workflow_run_id: Optional[str] = None) -> Dict:
+        credit_limit, workers = self.credit_limit, self.workers
+        if self.governor:
+            self.governor.flush()  # pick up today's spend from other runs
+            credit_limit = min(credit_limit, int(self.governor.remaining_credits("apollo")))
+            workers = self.governor.recommended_concurrency("apollo", self.workers)
+            logger.info(f"Apollo budget allows {credit_limit} credits across {workers} workers")
+
+        ctx = mp.get_context("spawn")
+        limiter = SharedRateLimiter(self.rate_per_second, ctx)
+        budget = SharedCreditBudget(credit_limit, self.operation_credits, ctx)
+        results = ctx.Queue(maxsize=workers * 8)  # backpressure if the writer falls behind
+
+        shards = self.plan_shards(workers)
+        processes = {
+            shard_id: ctx.Process(target=_source_shard, name=f"sourcing-{shard_id}", daemon=True,
+                                  args=(shard_id, combos, self.agent_options, limiter, budget, results,
+                                        self.verify_emails, workflow_run_id))
+            for shard_id, combos in enumerate(shards)
+        }
+        started = time.perf_counter()
+        for process in processes.values():
+            process.start()
+        logger.info(f"Sourcing {sum(len(s) for s in shards)} combinations across {len(shards)} workers")
+
+        summary = Counter(leads_received=0, duplicates=0, cross_shard_duplicates=0, stored=0)
+        shard_stats, errors = {}, {}
+        seen_emails = {}  # email -> shard that sent it first
+        completed = set()  # (industry, metro, page)
+        pending_leads, pending_orgs = [], {}
+        running = set(processes)
+
+        while running:
+            try:
+                message = results.get(timeout=1)
+            except queue.Empty:
+                for shard_id in list(running):
+                    if not processes[shard_id].is_alive():
+                        errors[shard_id] = f"exited with code {processes[shard_id].exitcode}"
+                        running.discard(shard_id)
+                continue
+
+            kind, shard_id = message[0], message[1]
+            if kind == "batch":
+                _, _, metadata, leads, orgs = message
+                if metadata["complete"]:
+                    completed.add((metadata["industry"], metadata["metro"], metadata["page"]))
+                summary["leads_received"] += len(leads)
+                for lead in leads:
+                    email = normalize_email(lead["email"])
+                    if email in seen_emails:
+                        summary["duplicates"] += 1
+                        summary["cross_shard_duplicates"] += int(seen_emails[email] != shard_id)
+                        continue
+                    seen_emails[email] = shard_id
+                    pending_leads.append(lead)
+                pending_orgs.update(orgs)
+                if len(pending_leads) >= self.write_batch_size:
+                    summary["stored"] += self._write(pending_leads, pending_orgs, workflow_run_id)
+                    pending_leads, pending_orgs = [], {}
+            elif kind == "done":
+                shard_stats[shard_id] = message[2]
+                summary["duplicates"] += message[2].get("shard_duplicates", 0)
+                running.discard(shard_id)
+            elif kind == "error":
+                errors[shard_id] = message[2]
+                running.discard(shard_id)
+
+        if pending_leads:
+            summary["stored"] += self._write(pending_leads, pending_orgs, workflow_run_id)
+        for process in processes.values():
+            process.join(timeout=5)
+        summary["pages_released"] = self._release_unfinished(shards, completed)
+        if self.governor:
+            for operation, (units, calls, failed, rate_limited) in budget.usage().items():
+                if calls:
+                    self.governor.record("apollo", operation, units, requests=calls,
+                                         failed=failed, rate_limited=rate_limited)
+
+        elapsed = time.perf_counter() - started
+        summary["unique_leads"] = len(seen_emails)
+        report = {
+            **summary,
+            "elapsed_s": round(elapsed, 2),
+            "leads_per_sec": round(len(seen_emails) / elapsed, 2) if elapsed else 0.0,
+            "budget": budget.snapshot(),
+            "shards": shard_stats,
+            "errors": errors,
+        }
+        logger.info(
+            f"Sourcing complete: {report['unique_leads']} unique leads, {summary['duplicates']} duplicates, "
+            f"{summary['stored']} stored, {report['budget']['credits_used']} credits in {elapsed:.1f}s"
+        )
+        return report
+
+    def _release_unfinished(self, shards: List[List[Combo]], completed: set) -> int:
+        """Hand back each combination's pages from its first unfinished one on"""
+        released = 0
+        for industry, metro, _, pages in (combo for combos in shards for combo in combos):
+            unfinished = [page for page in pages if (industry, metro, page) not in completed]
+            if unfinished and self.search_manager.release_pages(industry, metro, pages[-1], unfinished[0]):
+                released += pages[-1] - unfinished[0] + 1
+        if released:
+            logger.info(f"Released {released} unfinished page(s) for the next run")
+        return released
+
+    def _write(self, leads: List[Dict], orgs: Dict[str, Dict], workflow_run_id: Optional[str]) -> int:
+        if not self.lead_store:
+            return len(leads)
+        try:
+            with tracing.run_context(workflow_run_id), tracing.span("sourcing.write", leads=len(leads)):
+                return self.lead_store.save_batch(leads, orgs, workflow_run_id=workflow_run_id)
+        except Exception as e:
+            logger.error(f"Failed to store {len(leads)} sourced leads: {e}")
+            return 0
+
+    @staticmethod
+    def _load_apollo_budget(config_path: str) -> Dict:
+        path = Path(config_path)
+        if not path.exists():
+            return {}
+        with open(path, 'r') as f:
+            return json.load(f).get("providers", {}).get("apollo", {})